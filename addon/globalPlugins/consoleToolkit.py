@@ -4,6 +4,9 @@
 #This file is covered by the GNU General Public License.
 #See the file COPYING.txt for more details.
 
+import time
+# Used to measure how much time loading this add-on adds to NVDA startup.
+_loadStartTime = time.perf_counter()
 import addonHandler
 import api
 import bisect
@@ -14,42 +17,38 @@ import core
 import copy
 import ctypes
 from ctypes import create_string_buffer, byref
-import documentBase
 import editableText
+import functools
 import globalPluginHandler
+import globalVars
 import gui
 from gui import guiHelper, nvdaControls
 from gui.settingsDialogs import SettingsPanel
 import inputCore
 import itertools
-import json
 import keyboardHandler
 from logHandler import log
 import math
-import mouseHandler
 import NVDAHelper
 from NVDAObjects import behaviors, NVDAObject
 from NVDAObjects.IAccessible import IAccessible
 from NVDAObjects.UIA import UIA
-from NVDAObjects.window import winword
 import nvwave
 import operator
 import os
 import re
+import review
 from scriptHandler import script, willSayAllResume
 import speech
 import string
 import struct
-import subprocess
-import tempfile
 import textInfos
 import threading
-import time
 import tones
+import traceback
 import types
 import ui
 import watchdog
-import wave
 import winUser
 import wx
 import globalCommands
@@ -59,26 +58,97 @@ from NVDAObjects.UIA.winConsoleUIA import _DiffBasedWinTerminalUIA, _Notificatio
 import buildVersion
 import winBindings
 
-winmm = ctypes.windll.winmm
 TERMINAL_WINDOW_CLASSES = ['Windows.UI.Input.InputSite.WindowClass', 'CASCADIA_HOSTING_WINDOW_CLASS']
 
-debug = False
-if debug:
-    import threading
-    LOG_FILE_NAME = "C:\\Users\\tony\\Dropbox\\1.txt"
-    f = open(LOG_FILE_NAME, "w")
-    f.close()
-    LOG_MUTEX = threading.Lock()
-    def mylog(s):
-        with LOG_MUTEX:
-            f = open(LOG_FILE_NAME, "a", encoding='utf-8')
-            print(s, file=f)
-            #f.write(s.encode('UTF-8'))
-            #f.write('\n')
-            f.close()
-else:
-    def mylog(*arg, **kwarg):
-        pass
+TRACE_DEBUG = 10
+TRACE_INFO = 20
+TRACE_WARNING = 30
+traceLevels = [TRACE_DEBUG, TRACE_INFO, TRACE_WARNING]
+traceLevelNames = {
+    TRACE_DEBUG: "DEBUG",
+    TRACE_INFO: "INFO",
+    TRACE_WARNING: "WARNING",
+}
+TRACE_BUFFER_SIZE = 10000 # records
+TRACE_FLUSH_INTERVAL = 1 # seconds
+
+class Tracer:
+    """
+    Debug tracing facility.
+    Records are appended to a bounded in-memory ring buffer and written to trace file in batches by a background thread,
+    so that tracing doesn't distort timing of the code being traced.
+    When tracing is disabled, trace() returns right away.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.level = TRACE_DEBUG
+        self.fileName = None
+        self.buffer = collections.deque(maxlen=TRACE_BUFFER_SIZE)
+        self.wakeUp = threading.Event()
+        self.thread = None
+        self.stopRequested = False
+
+    def trace(self, message, level=TRACE_DEBUG):
+        if not self.enabled or level < self.level:
+            return
+        self.buffer.append((time.time(), level, message))
+
+    def configure(self, enabled, level, fileName):
+        self.level = level
+        if enabled and self.thread is not None and fileName != self.fileName:
+            self.stop()
+        self.fileName = fileName
+        if enabled and self.thread is None:
+            self.stopRequested = False
+            self.thread = threading.Thread(target=self.run, name="consoleToolkitTracer", daemon=True)
+            self.thread.start()
+        elif not enabled and self.thread is not None:
+            self.stop()
+        self.enabled = enabled
+
+    def stop(self):
+        self.enabled = False
+        if self.thread is None:
+            return
+        self.stopRequested = True
+        self.wakeUp.set()
+        self.thread.join(timeout=2)
+        self.thread = None
+
+    def run(self):
+        try:
+            with open(self.fileName, "a", encoding='utf-8') as f:
+                print(f"Console Toolkit trace started at {time.ctime()}", file=f)
+                while not self.stopRequested:
+                    self.wakeUp.wait(TRACE_FLUSH_INTERVAL)
+                    self.wakeUp.clear()
+                    self.flush(f)
+                self.flush(f)
+        except OSError:
+            log.error(f"Cannot write Console Toolkit trace to {self.fileName}", exc_info=True)
+
+    def flush(self, f):
+        records = []
+        try:
+            while True:
+                records.append(self.buffer.popleft())
+        except IndexError:
+            pass
+        if len(records) == 0:
+            return
+        f.write("".join(
+            f"{time.strftime('%H:%M:%S', time.localtime(timestamp))}.{int(timestamp * 1000) % 1000:03} {traceLevelNames.get(level, level)} {message}\n"
+            for timestamp, level, message in records
+        ))
+        f.flush()
+
+tracer = Tracer()
+mylog = tracer.trace
+
+def getTraceFileName(fileName):
+    if len(fileName) > 0:
+        return fileName
+    return os.path.join(globalVars.appArgs.configPath, "consoleToolkit.log")
 
 def myAssert(condition):
     if not condition:
@@ -95,12 +165,31 @@ def initConfiguration():
         "deletePromptMethod" : "integer( default=3, min=0, max=3)",
         "captureSuffix" : f"string( default='|less -c 2>&1')",
         "captureChimeVolume" : "integer( default=5, min=0, max=100)",
-        "captureOpenOption" : "integer( default=0, min=0, max=3)",
-        "captureTimeout" : "integer( default=60, min=0, max=1000000)",
+        "captureOpenOption" : "integer( default=0, min=0, max=4)",
+        "captureTimeout" : "integer( default=60, min=1, max=1000000)",
+        "captureBackend" : "integer( default=0, min=0, max=1)",
+        "tmuxCommand" : "string( default='tmux')",
+        "followBufferLines" : "integer( default=10000, min=1, max=10000000)",
+        "followSpillFile" : "boolean( default=False)",
+        "watchInterval" : "integer( default=10, min=1, max=86400)",
+        "watchWithoutTmux" : "boolean( default=False)",
+        "historyEnabled" : "boolean( default=False)",
+        "historyMaxSize" : "integer( default=50, min=1, max=100000)",
+        "historyMaxAge" : "integer( default=30, min=1, max=100000)",
         "overrideTopReview" : "boolean( default=True)",
         "overrideRepeatedReview" : "boolean( default=True)",
+        "profileMainThread" : "boolean( default=False)",
+        "incrementalDiff" : "boolean( default=False)",
+        "traceEnabled" : "boolean( default=False)",
+        "traceLevel" : f"integer( default={TRACE_DEBUG}, min=0, max=100)",
+        "traceFile" : "string( default='')",
+        "muteRules" : "string_list( default=list())",
+        "priorityRules" : "string_list( default=list())",
+        "promptRule" : "string( default='^(PS [^>]*> |[A-Za-z]:[^>]*>|[^ ]*[$#] )')",
     }
     config.conf.spec[module] = confspec
+    global ConfigSnapshot
+    ConfigSnapshot = collections.namedtuple("ConfigSnapshot", confspec.keys())
 
 def getConfig(key):
     value = config.conf[module][key]
@@ -108,9 +197,23 @@ def getConfig(key):
 def setConfig(key, value):
     config.conf[module][key] = value
 
+# Immutable copy of add-on configuration for hot paths, such as processing every new line in console.
+# It is refreshed when settings are saved, configuration profile switches or configuration is reset.
+ConfigSnapshot = None
+configSnapshot = None
+def updateConfigSnapshot(*args, **kwargs):
+    global configSnapshot
+    section = config.conf[module]
+    configSnapshot = ConfigSnapshot(**{
+        key: section[key]
+        for key in ConfigSnapshot._fields
+    })
+    tracer.configure(configSnapshot.traceEnabled, configSnapshot.traceLevel, getTraceFileName(configSnapshot.traceFile))
+
 
 addonHandler.initTranslation()
 initConfiguration()
+updateConfigSnapshot()
 
 
 class SettingsDialog(SettingsPanel):
@@ -154,6 +257,37 @@ class SettingsDialog(SettingsPanel):
       # Capture timeout edit
         self.captureTimeoutEdit = sHelper.addLabeledControl(_("Capture timeout in seconds:"), wx.TextCtrl)
         self.captureTimeoutEdit.Value = str(getConfig("captureTimeout"))
+      # Capture backend combo box
+        label = _("Capture command output using")
+        self.captureBackendCombobox = sHelper.addLabeledControl(label, wx.Choice, choices=captureBackendNames)
+        self.captureBackendCombobox.Selection = getConfig("captureBackend")
+      # tmux command edit
+        self.tmuxCommandEdit = sHelper.addLabeledControl(_("Command to run tmux, for example wsl tmux:"), wx.TextCtrl)
+        self.tmuxCommandEdit.Value = getConfig("tmuxCommand")
+      # Follow buffer size edit
+        self.followBufferLinesEdit = sHelper.addLabeledControl(_("Number of lines to keep in memory in follow mode:"), wx.TextCtrl)
+        self.followBufferLinesEdit.Value = str(getConfig("followBufferLines"))
+      # checkbox follow spill file
+        label = _("In follow mode also write all lines to a file in consoleToolkitFollow folder inside temporary folder")
+        self.followSpillFileCheckbox = sHelper.addItem(wx.CheckBox(self, label=label))
+        self.followSpillFileCheckbox.Value = getConfig("followSpillFile")
+      # Watch interval edit
+        self.watchIntervalEdit = sHelper.addLabeledControl(_("Interval between runs of watched command in seconds:"), wx.TextCtrl)
+        self.watchIntervalEdit.Value = str(getConfig("watchInterval"))
+      # checkbox watch without tmux
+        label = _("Allow watch mode without tmux (warning: command is typed into console on every run, filling shell history and blocking the prompt)")
+        self.watchWithoutTmuxCheckbox = sHelper.addItem(wx.CheckBox(self, label=label))
+        self.watchWithoutTmuxCheckbox.Value = getConfig("watchWithoutTmux")
+      # checkbox capture history
+        label = _("Save captured output in capture history")
+        self.historyEnabledCheckbox = sHelper.addItem(wx.CheckBox(self, label=label))
+        self.historyEnabledCheckbox.Value = getConfig("historyEnabled")
+      # History size edit
+        self.historyMaxSizeEdit = sHelper.addLabeledControl(_("Maximum size of capture history in megabytes:"), wx.TextCtrl)
+        self.historyMaxSizeEdit.Value = str(getConfig("historyMaxSize"))
+      # History age edit
+        self.historyMaxAgeEdit = sHelper.addLabeledControl(_("Keep captured output in history for this many days:"), wx.TextCtrl)
+        self.historyMaxAgeEdit.Value = str(getConfig("historyMaxAge"))
 
       # Output capture chime  volume slider
         sizer=wx.BoxSizer(wx.HORIZONTAL)
@@ -172,6 +306,35 @@ class SettingsDialog(SettingsPanel):
         label = _("Ignore repeated route review cursor events")
         self.overrideRepeatedReviewCheckbox = sHelper.addItem(wx.CheckBox(self, label=label))
         self.overrideRepeatedReviewCheckbox.Value = getConfig("overrideRepeatedReview")
+      # checkbox incremental diff
+        label = _("Use fast line-based algorithm to detect new text in consoles (experimental)")
+        self.incrementalDiffCheckbox = sHelper.addItem(wx.CheckBox(self, label=label))
+        self.incrementalDiffCheckbox.Value = getConfig("incrementalDiff")
+      # checkbox main thread profiler
+        label = _("Profile time spent by Console Toolkit on NVDA main thread (for troubleshooting)")
+        self.profileMainThreadCheckbox = sHelper.addItem(wx.CheckBox(self, label=label))
+        self.profileMainThreadCheckbox.Value = getConfig("profileMainThread")
+      # checkbox debug trace
+        label = _("Write debug trace to file (for troubleshooting)")
+        self.traceEnabledCheckbox = sHelper.addItem(wx.CheckBox(self, label=label))
+        self.traceEnabledCheckbox.Value = getConfig("traceEnabled")
+      # Trace level combo box
+        label = _("Debug trace level:")
+        self.traceLevelCombobox = sHelper.addLabeledControl(label, wx.Choice, choices=[traceLevelNames[level] for level in traceLevels])
+        level = getConfig("traceLevel")
+        self.traceLevelCombobox.Selection = traceLevels.index(level) if level in traceLevels else 0
+      # Trace file edit
+        self.traceFileEdit = sHelper.addLabeledControl(_("Debug trace file (leave empty to write consoleToolkit.log in NVDA configuration folder):"), wx.TextCtrl)
+        self.traceFileEdit.Value = getConfig("traceFile")
+      # Mute rules edit
+        self.muteRulesEdit = sHelper.addLabeledControl(_("Don't speak console lines matching these regular expressions (one per line):"), wx.TextCtrl, style=wx.TE_MULTILINE)
+        self.muteRulesEdit.Value = "\n".join(getConfig("muteRules"))
+      # Priority rules edit
+        self.priorityRulesEdit = sHelper.addLabeledControl(_("Speak console lines matching these regular expressions (one per line) immediately:"), wx.TextCtrl, style=wx.TE_MULTILINE)
+        self.priorityRulesEdit.Value = "\n".join(getConfig("priorityRules"))
+      # Prompt rule edit
+        self.promptRuleEdit = sHelper.addLabeledControl(_("Regular expression matching command prompt lines (used for prompt navigation):"), wx.TextCtrl)
+        self.promptRuleEdit.Value = getConfig("promptRule")
 
     def onSave(self):
         try:
@@ -181,6 +344,50 @@ class SettingsDialog(SettingsPanel):
             self.captureTimeoutEdit.SetFocus()
             ui.message(_("Capture timeout must be a positive integer"))
             return
+        try:
+            if int(self.followBufferLinesEdit.Value) <= 0:
+                raise Exception()
+        except:
+            self.followBufferLinesEdit.SetFocus()
+            ui.message(_("Number of lines in follow mode must be a positive integer"))
+            return
+        try:
+            if int(self.watchIntervalEdit.Value) <= 0:
+                raise Exception()
+        except:
+            self.watchIntervalEdit.SetFocus()
+            ui.message(_("Watch interval must be a positive integer"))
+            return
+        for edit in [self.historyMaxSizeEdit, self.historyMaxAgeEdit]:
+            try:
+                if int(edit.Value) <= 0:
+                    raise Exception()
+            except:
+                edit.SetFocus()
+                ui.message(_("Capture history limits must be positive integers"))
+                return
+        muteRules = splitRules(self.muteRulesEdit.Value)
+        priorityRules = splitRules(self.priorityRulesEdit.Value)
+        for rules, edit in [(muteRules, self.muteRulesEdit), (priorityRules, self.priorityRulesEdit)]:
+            for rule in rules:
+                try:
+                    re.compile(rule)
+                except re.error as e:
+                    edit.SetFocus()
+                    ui.message(_("Invalid regular expression {rule}: {error}").format(rule=rule, error=e))
+                    return
+        try:
+            LineFilter(muteRules, priorityRules, "")
+        except re.error as e:
+            self.muteRulesEdit.SetFocus()
+            ui.message(_("Cannot combine regular expressions: {error}").format(error=e))
+            return
+        try:
+            re.compile(self.promptRuleEdit.Value)
+        except re.error as e:
+            self.promptRuleEdit.SetFocus()
+            ui.message(_("Invalid regular expression {rule}: {error}").format(rule=self.promptRuleEdit.Value, error=e))
+            return
         setConfig("consoleRealtime", self.consoleRealtimeCheckbox.Value)
         setConfig("consoleBeep", self.consoleBeepCheckbox.Value)
         setConfig("controlVInConsole", self.controlVInConsoleCheckbox.Value)
@@ -188,25 +395,80 @@ class SettingsDialog(SettingsPanel):
         setConfig("captureSuffix", self.captureSuffixEdit.Value)
         setConfig("captureOpenOption", self.captureOpenOptionCombobox.Selection)
         setConfig("captureTimeout", int(self.captureTimeoutEdit.Value))
+        setConfig("captureBackend", self.captureBackendCombobox.Selection)
+        setConfig("tmuxCommand", self.tmuxCommandEdit.Value)
+        setConfig("followBufferLines", int(self.followBufferLinesEdit.Value))
+        setConfig("followSpillFile", self.followSpillFileCheckbox.Value)
+        setConfig("watchInterval", int(self.watchIntervalEdit.Value))
+        setConfig("watchWithoutTmux", self.watchWithoutTmuxCheckbox.Value)
+        setConfig("historyEnabled", self.historyEnabledCheckbox.Value)
+        setConfig("historyMaxSize", int(self.historyMaxSizeEdit.Value))
+        setConfig("historyMaxAge", int(self.historyMaxAgeEdit.Value))
         setConfig("captureChimeVolume", self.captureChimeVolumeSlider.Value)
         setConfig("overrideTopReview", self.overrideTopReviewCheckbox.Value)
         setConfig("overrideRepeatedReview", self.overrideRepeatedReviewCheckbox.Value)
-
+        setConfig("incrementalDiff", self.incrementalDiffCheckbox.Value)
+        setConfig("profileMainThread", self.profileMainThreadCheckbox.Value)
+        setConfig("traceEnabled", self.traceEnabledCheckbox.Value)
+        setConfig("traceLevel", traceLevels[self.traceLevelCombobox.Selection])
+        setConfig("traceFile", self.traceFileEdit.Value)
+        setConfig("muteRules", muteRules)
+        setConfig("priorityRules", priorityRules)
+        setConfig("promptRule", self.promptRuleEdit.Value)
+        updateConfigSnapshot()
+
+def getKeyboardLayout():
+    # Keyboard layout of foreground window, that is the layout of the window we are typing into.
+    threadId = winUser.getWindowThreadProcessID(winUser.getForegroundWindow())[1]
+    return ctypes.windll.user32.GetKeyboardLayout(threadId)
+
+memoizeRegistry = []
 class Memoize:
-    def __init__(self, f):
+    """
+    Size-bounded LRU cache for pure functions.
+    Arguments are used as cache key, so it shouldn't be applied to methods: cache would keep every instance alive.
+    """
+    def __init__(self, f, maxSize=256):
+        functools.update_wrapper(self, f)
         self.f = f
-        self.memo = {}
+        self.maxSize = maxSize
+        self.memo = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        memoizeRegistry.append(self)
+
     def __call__(self, *args):
-        if not args in self.memo:
-            self.memo[args] = self.f(*args)
+        try:
+            value = self.memo[args]
+        except KeyError:
+            self.misses += 1
+            value = self.f(*args)
+            self.memo[args] = value
+            if len(self.memo) > self.maxSize:
+                self.memo.popitem(last=False)
+            return value
+        self.hits += 1
+        self.memo.move_to_end(args)
         #Warning: You may wish to do a deepcopy here if returning objects
-        return self.memo[args]
+        return value
+
+    def invalidate(self):
+        if len(self.memo) > 0:
+            self.invalidations += 1
+        self.memo.clear()
+
+    def getStats(self):
+        total = self.hits + self.misses
+        hitRate = self.hits / total if total > 0 else 0
+        return f"{self.__qualname__}: size={len(self.memo)}/{self.maxSize} hits={self.hits} misses={self.misses} hitRate={hitRate:.1%} invalidations={self.invalidations}"
+
+def memoize(**kwargs):
+    # Decorator with arguments, e.g. @memoize(maxSize=16)
+    return lambda f: Memoize(f, **kwargs)
 
 class Beeper:
     BASE_FREQ = speech.IDT_BASE_FREQUENCY
-    def getPitch(self, indent):
-        return self.BASE_FREQ*2**(indent/24.0) #24 quarter tones per octave.
-
     BEEP_LEN = 10 # millis
     PAUSE_LEN = 5 # millis
     MAX_CRACKLE_LEN = 400 # millis
@@ -219,18 +481,30 @@ class Beeper:
         OUTPUT_DEVICE = config.conf["speech"]["outputDevice"]
 
     def __init__(self):
-        self.player = nvwave.WavePlayer(
-            channels=2,
-            samplesPerSec=int(tones.SAMPLE_RATE),
-            bitsPerSample=16,
-            outputDevice = self.OUTPUT_DEVICE,
-            wantDucking=False,
-            purpose=nvwave.AudioPurpose.SOUNDS,
-        )
+        self._player = None
+
+    @property
+    def player(self):
+        # Audio device is only opened on first use.
+        if self._player is None:
+            self._player = nvwave.WavePlayer(
+                channels=2,
+                samplesPerSec=int(tones.SAMPLE_RATE),
+                bitsPerSample=16,
+                outputDevice = self.OUTPUT_DEVICE,
+                wantDucking=False,
+                purpose=nvwave.AudioPurpose.SOUNDS,
+            )
+        return self._player
 
 
 
     def fancyCrackle(self, levels, volume, initialDelay=0):
+        buf = self.makeCrackleBuffer(levels, volume, initialDelay)
+        self.player.stop()
+        threading.Thread(target=lambda:self.player.feed(buf.raw)).start()
+
+    def makeCrackleBuffer(self, levels, volume, initialDelay=0):
         l = len(levels)
         coef = 10
         l = coef * math.log(
@@ -242,7 +516,7 @@ class Beeper:
         pauseLen = self.PAUSE_LEN
         initialDelaySize = 0 if initialDelay == 0 else NVDAHelper.localLib.generateBeep(None,self.BASE_FREQ,initialDelay,0, 0)
         pauseBufSize = NVDAHelper.localLib.generateBeep(None,self.BASE_FREQ,pauseLen,0, 0)
-        beepBufSizes = [NVDAHelper.localLib.generateBeep(None,self.getPitch(l), beepLen, volume, volume) for l in levels]
+        beepBufSizes = [NVDAHelper.localLib.generateBeep(None,getBeepPitch(l), beepLen, volume, volume) for l in levels]
         bufSize = initialDelaySize + sum(beepBufSizes) + len(levels) * pauseBufSize
         buf = ctypes.create_string_buffer(bufSize)
         bufPtr = 0
@@ -250,10 +524,9 @@ class Beeper:
         for l in levels:
             bufPtr += NVDAHelper.localLib.generateBeep(
                 ctypes.cast(ctypes.byref(buf, bufPtr), ctypes.POINTER(ctypes.c_char)),
-                self.getPitch(l), beepLen, volume, volume)
+                getBeepPitch(l), beepLen, volume, volume)
             bufPtr += pauseBufSize # add a short pause
-        self.player.stop()
-        threading.Thread(target=lambda:self.player.feed(buf.raw)).start()
+        return buf
 
     def simpleCrackle(self, n, volume, initialDelay=0):
         return self.fancyCrackle([0] * n, volume, initialDelay=initialDelay)
@@ -262,21 +535,10 @@ class Beeper:
     NOTES = "A,B,H,C,C#,D,D#,E,F,F#,G,G#".split(",")
     NOTE_RE = re.compile("[A-H][#]?")
     BASE_FREQ = 220
-    def getChordFrequencies(self, chord):
-        prev = -1
-        result = []
-        for m in self.NOTE_RE.finditer(chord):
-            s = m.group()
-            i =self.NOTES.index(s)
-            while i < prev:
-                i += 12
-            result.append(int(self.BASE_FREQ * (2 ** (i / 12.0))))
-            prev = i
-        return result
 
     def fancyBeep(self, chord, length, left=10, right=10):
         beepLen = length
-        freqs = self.getChordFrequencies(chord)
+        freqs = getChordFrequencies(chord)
         intSize = 8 # bytes
         bufSize = max([NVDAHelper.localLib.generateBeep(None,freq, beepLen, right, left) for freq in freqs])
         if bufSize % intSize != 0:
@@ -306,35 +568,331 @@ class Beeper:
             result.append(a[i  // m])
         return result
     def stop(self):
-        self.player.stop()
+        if self._player is not None:
+            self._player.stop()
+
+# Pure helpers of Beeper are memoized as module-level functions, so that cache keys don't keep Beeper instances alive.
+@Memoize
+def getBeepPitch(indent):
+    return Beeper.BASE_FREQ*2**(indent/24.0) #24 quarter tones per octave.
+
+@memoize(maxSize=64)
+def getChordFrequencies(chord):
+    prev = -1
+    result = []
+    for m in Beeper.NOTE_RE.finditer(chord):
+        s = m.group()
+        i = Beeper.NOTES.index(s)
+        while i < prev:
+            i += 12
+        result.append(int(Beeper.BASE_FREQ * (2 ** (i / 12.0))))
+        prev = i
+    # Returning tuple, since memoized value must not be modified.
+    return tuple(result)
 
 
 
+PROFILER_BUFFER_SIZE = 1000
+PROFILER_STALL_BUDGET = 0.05 # seconds
+class StallProfiler:
+    """
+    Records wall time of every task step and every hook invocation running on NVDA main thread.
+    Records are kept in a ring buffer; steps exceeding budget are recorded together with their stack.
+    """
+    def __init__(self):
+        self.records = collections.deque(maxlen=PROFILER_BUFFER_SIZE)
+
+    @property
+    def enabled(self):
+        return configSnapshot.profileMainThread
+
+    def record(self, kind, name, elapsed, getStack):
+        stack = None
+        if elapsed > PROFILER_STALL_BUDGET:
+            stack = "".join(getStack())
+        self.records.append((time.time(), kind, name, elapsed, stack))
+
+    def wrap(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record("hook", name, time.time() - start, traceback.format_stack)
+        return wrapper
+
+    def recordTaskStep(self, task, elapsed):
+        frame = task.gen.gi_frame
+        getStack = lambda: traceback.format_stack(frame) if frame is not None else []
+        self.record("task", repr(task), elapsed, getStack)
+
+    def getReport(self):
+        records = list(self.records)
+        stats = {}
+        for timestamp, kind, name, elapsed, stack in records:
+            count, total, maximum = stats.get(name, (0, 0, 0))
+            stats[name] = (count + 1, total + elapsed, max(maximum, elapsed))
+        lines = [f"Console Toolkit main thread profile: {len(records)} records"]
+        for name, (count, total, maximum) in sorted(stats.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name}: count={count} total={int(total * 1000)}ms max={int(maximum * 1000)}ms")
+        stalls = [record for record in records if record[4] is not None]
+        lines.append("Memoized functions:")
+        for memo in memoizeRegistry:
+            lines.append(memo.getStats())
+        lines.append(f"Stalls over {int(PROFILER_STALL_BUDGET * 1000)}ms: {len(stalls)}")
+        for timestamp, kind, name, elapsed, stack in stalls:
+            lines.append(f"{time.strftime('%H:%M:%S', time.localtime(timestamp))} {kind} {name} took {int(elapsed * 1000)}ms")
+            lines.append(stack)
+        return "\n".join(lines), len(records), len(stalls)
+
+stallProfiler = StallProfiler()
+
+TASK_OVERLAP_ALLOW = 0
+TASK_OVERLAP_REPLACE = 1
+TASK_OVERLAP_SKIP = 2
+DEFAULT_TASK_STEP_BUDGET = 0.1 # seconds
+
+class TaskCancelled(Exception):
+    pass
+
+class Task:
+    """
+    Generator function driven by Scheduler. Every time the generator yields, it is paused and NVDA can process updates from the operating system.
+    The generator can yield:
+    - A number: the rest of generator will be executed after that many milliseconds.
+    - Another Task: generator will be resumed once that task completes; yield expression evaluates to the result of that task.
+    - A callable: it will be called with a continuation function resume(value=None, error=None).
+      Generator will be resumed once continuation is called; yield expression evaluates to value, or error is raised inside generator.
+      Continuation must be called on the main thread. See runInThread() for an example.
+    """
+    def __init__(self, scheduler, gen, name, budget):
+        self.scheduler = scheduler
+        self.gen = gen
+        self.name = name
+        self.budget = budget
+        self.done = False
+        self.cancelled = False
+        self.running = False
+        self.result = None
+        self.error = None
+        self.doneCallbacks = []
+        # Incremented on every yield, so that stale continuations are ignored.
+        self.step = 0
+
+    def __repr__(self):
+        return f"Task({self.name or self.gen.__name__})"
+
+    def addDoneCallback(self, callback):
+        if self.done:
+            callback(self)
+        else:
+            self.doneCallbacks.append(callback)
+
+    def cancel(self):
+        if self.done:
+            return
+        self.cancelled = True
+        if self.running:
+            # Cannot close generator from within itself; it will be closed once current step completes.
+            return
+        try:
+            self.gen.close()
+        except Exception:
+            log.error(f"Error while cancelling {self}", exc_info=True)
+        self._finish(error=TaskCancelled())
+
+    def _resume(self, value=None, error=None):
+        if self.done:
+            return
+        self.running = True
+        start = time.time()
+        try:
+            if error is not None:
+                yielded = self.gen.throw(error)
+            else:
+                yielded = self.gen.send(value)
+        except StopIteration as e:
+            self._finish(result=e.value)
+            return
+        except Exception as e:
+            if not isinstance(e, TaskCancelled):
+                log.error(f"{self} failed", exc_info=True)
+            self._finish(error=e)
+            return
+        finally:
+            self.running = False
+            elapsed = time.time() - start
+            if elapsed > self.budget:
+                log.debugWarning(f"{self} step took {int(elapsed * 1000)} ms, which exceeds budget of {int(self.budget * 1000)} ms")
+            if stallProfiler.enabled:
+                stallProfiler.recordTaskStep(self, elapsed)
+        if self.cancelled:
+            self.cancel()
+            return
+        self._wait(yielded)
+
+    def _wait(self, value):
+        self.step += 1
+        step = self.step
+        def resume(value=None, error=None):
+            if step == self.step:
+                self._resume(value, error)
+        if isinstance(value, Task):
+            value.addDoneCallback(lambda task: core.callLater(0, resume, task.result, task.error))
+        elif callable(value):
+            value(resume)
+        else:
+            core.callLater(value or 0, resume)
+
+    def _finish(self, result=None, error=None):
+        self.done = True
+        self.result = result
+        self.error = error
+        self.scheduler._onTaskFinished(self)
+        callbacks = self.doneCallbacks
+        self.doneCallbacks = []
+        for callback in callbacks:
+            callback(self)
+
+class Scheduler:
+    """
+    Runs cooperative tasks on NVDA main thread.
+    Named tasks can be cancelled by name; when a task is started with a name of another running task,
+    overlap argument decides whether to cancel old task, skip new one, or allow both to run.
+    """
+    def __init__(self):
+        self.tasks = {}
+
+    def run(self, gen, name=None, overlap=TASK_OVERLAP_REPLACE, budget=DEFAULT_TASK_STEP_BUDGET):
+        if not isinstance(gen, types.GeneratorType):
+            raise Exception("Generator function required")
+        if name is not None:
+            existing = self.tasks.get(name)
+            if existing is not None and not existing.done:
+                if overlap == TASK_OVERLAP_SKIP:
+                    gen.close()
+                    return existing
+                elif overlap == TASK_OVERLAP_REPLACE:
+                    existing.cancel()
+        task = Task(self, gen, name, budget)
+        if name is not None:
+            self.tasks[name] = task
+        task._resume()
+        return task
+
+    def get(self, name):
+        task = self.tasks.get(name)
+        if task is None or task.done:
+            return None
+        return task
+
+    def cancel(self, name):
+        """
+        Cancels task with given name, returns whether such task has been running.
+        """
+        task = self.tasks.get(name)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    def cancelAll(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+
+    def _onTaskFinished(self, task):
+        if task.name is not None and self.tasks.get(task.name) is task:
+            del self.tasks[task.name]
+
+scheduler = Scheduler()
+
+def runInThread(func, *args, **kwargs):
+    """
+    To be yielded from a task: executes func in a background thread, while the task is paused.
+    Task is resumed on the main thread and yield expression evaluates to the return value of func,
+    or exception raised by func is raised inside the task.
+    """
+    def start(resume):
+        def worker():
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                core.callLater(0, resume, None, e)
+                return
+            core.callLater(0, resume, result)
+        threading.Thread(target=worker, daemon=True).start()
+    return start
+
 def executeAsynchronously(gen):
     """
     This function executes a generator-function in such a manner, that allows updates from the operating system to be processed during execution.
-    For an example of such generator function, please see GlobalPlugin.script_editJupyter.
-    Specifically, every time the generator function yilds a positive number,, the rest of the generator function will be executed
-    from within wx.CallLater() call.
-    If generator function yields a value of 0, then the rest of the generator function
-    will be executed from within wx.CallAfter() call.
-    This allows clear and simple expression of the logic inside the generator function, while still allowing NVDA to process update events from the operating system.
+    For an example of such generator function, please see editPrompt.
     Essentially the generator function will be paused every time it calls yield, then the updates will be processed by NVDA and then the remainder of generator function will continue executing.
+    See Task for the values that generator function can yield.
     """
-    if not isinstance(gen, types.GeneratorType):
-        raise Exception("Generator function required")
-    try:
-        value = gen.__next__()
-    except StopIteration:
-        return
-    l = lambda gen=gen: executeAsynchronously(gen)
-    core.callLater(value, executeAsynchronously, gen)
+    return scheduler.run(gen, overlap=TASK_OVERLAP_ALLOW)
+
+LINE_NORMAL = 0
+LINE_MUTED = 1
+LINE_PRIORITY = 2
+
+def splitRules(text):
+    return [rule for rule in text.splitlines() if len(rule.strip()) > 0]
+
+class LineFilter:
+    """
+    Classifies console lines according to user's mute and priority rules.
+    Mute rules and priority rules are each compiled into a single regular expression,
+    so every line is scanned at most twice no matter how many rules are configured.
+    Priority rules are checked first, so that a line matching both kinds of rules is never muted.
+    Prompt rule is kept separately, since prompt lines are spoken as usual.
+    """
+    def __init__(self, muteRules, priorityRules, promptRule):
+        self.muteRegex = self.combineRules(muteRules)
+        self.priorityRegex = self.combineRules(priorityRules)
+        self.promptRegex = re.compile(promptRule) if len(promptRule) > 0 else None
+
+    @staticmethod
+    def combineRules(rules):
+        if len(rules) == 0:
+            return None
+        return re.compile("|".join(f"(?:{rule})" for rule in rules))
+
+    def classify(self, line):
+        if self.priorityRegex is not None and self.priorityRegex.search(line) is not None:
+            return LINE_PRIORITY
+        if self.muteRegex is not None and self.muteRegex.search(line) is not None:
+            return LINE_MUTED
+        return LINE_NORMAL
+
+    def isPrompt(self, line):
+        return self.promptRegex is not None and self.promptRegex.search(line) is not None
+
+lineFilter = None
+lineFilterSnapshot = None
+def getLineFilter():
+    global lineFilter, lineFilterSnapshot
+    if lineFilterSnapshot is not configSnapshot:
+        try:
+            lineFilter = LineFilter(configSnapshot.muteRules, configSnapshot.priorityRules, configSnapshot.promptRule)
+        except re.error:
+            log.error("Console Toolkit: invalid mute, priority or prompt rules, ignoring them", exc_info=True)
+            lineFilter = LineFilter([], [], "")
+        lineFilterSnapshot = configSnapshot
+    return lineFilter
+
+# Regular lines that have waited for longer than this are skipped once newer output arrives.
+SPEECH_CHUNK_STALE_SECONDS = 1
 
 class SpeechChunk:
-    def __init__(self, text, now):
+    def __init__(self, text, now, priority=False):
         self.text = text
         self.timestamp = now
         self.spoken = False
+        self.priority = priority
         self.nextChunk = None
 
     def speak(self):
@@ -358,9 +916,14 @@ class SpeechChunk:
                     )
                 )
 
-                currentSpeechChunk = self.nextChunk
-                if self.nextChunk is not None:
-                    self.nextChunk.speak()
+                nextChunk = self.nextChunk
+                if self.priority and nextChunk is not None:
+                    # Regular line interrupted by priority lines is spoken again from its beginning,
+                    # unless newer output has arrived in the meantime and made it stale.
+                    nextChunk = skipStaleChunks(nextChunk, time.time() - SPEECH_CHUNK_STALE_SECONDS)
+                currentSpeechChunk = nextChunk
+                if nextChunk is not None:
+                    nextChunk.speak()
                 else:
                     latestSpeechChunk = None
         speech.speak([
@@ -368,6 +931,15 @@ class SpeechChunk:
             speech.commands.CallbackCommand(callback),
         ])
 
+def skipStaleChunks(chunk, threshold):
+    """
+    Returns the first chunk in the queue starting from chunk, that is either a priority chunk,
+    or a regular chunk not older than threshold, or the latest chunk.
+    """
+    while not chunk.priority and chunk.timestamp < threshold and chunk.nextChunk is not None:
+        chunk = chunk.nextChunk
+    return chunk
+
 currentSpeechChunk = None
 latestSpeechChunk = None
 speechChunksLock = threading.RLock()
@@ -376,24 +948,55 @@ originalSpeechSpeak = None
 originalCancelSpeech = None
 def newReportConsoleText(selfself, line, *args, **kwargs):
     global currentSpeechChunk, latestSpeechChunk
-    if getConfig("consoleBeep"):
+    lineFilter = getLineFilter()
+    promptIndex = promptIndexes.get(selfself.windowHandle)
+    if promptIndex is not None and not promptIndex.dirty and lineFilter.isPrompt(line):
+        # A new prompt has been printed, so prompt index must be refreshed before next navigation.
+        promptIndex.dirty = True
+    if selfself.windowHandle in suppressedLiveTextWindows:
+        return
+    lineKind = lineFilter.classify(line)
+    if lineKind == LINE_MUTED:
+        return
+    if configSnapshot.consoleBeep:
         tones.beep(100, 5)
-    if not getConfig("consoleRealtime"):
+    if not configSnapshot.consoleRealtime:
         return originalReportNewText(selfself, line, *args, **kwargs)
     now = time.time()
-    threshold = now - 1
-    newChunk = SpeechChunk(line, now)
+    threshold = now - SPEECH_CHUNK_STALE_SECONDS
+    newChunk = SpeechChunk(line, now, priority=lineKind == LINE_PRIORITY)
     #mylog(f'newReportConsoleText pre acquire line="{line}"')
     with speechChunksLock:
         #mylog(f'newReportConsoleText lock acquired!')
         myAssert((currentSpeechChunk is not None) == (latestSpeechChunk is not None))
-        if latestSpeechChunk is not None:
+        if latestSpeechChunk is not None and newChunk.priority:
+            if currentSpeechChunk.priority:
+                # Queue after priority lines that are already waiting, but ahead of all the regular lines.
+                chunk = currentSpeechChunk
+                while chunk.nextChunk is not None and chunk.nextChunk.priority:
+                    chunk = chunk.nextChunk
+                newChunk.nextChunk = chunk.nextChunk
+                chunk.nextChunk = newChunk
+                if newChunk.nextChunk is None:
+                    latestSpeechChunk = newChunk
+            else:
+                # Interrupt current line; it will be spoken again right after the priority line.
+                originalCancelSpeech()
+                newChunk.nextChunk = currentSpeechChunk
+                currentSpeechChunk = newChunk
+                newChunk.speak()
+        elif latestSpeechChunk is not None:
             latestSpeechChunk.nextChunk = newChunk
             latestSpeechChunk = newChunk
-            if currentSpeechChunk.timestamp < threshold:
+            if currentSpeechChunk.priority:
+                # Priority lines are never interrupted by regular ones; only stale regular lines queued after them are dropped.
+                chunk = currentSpeechChunk
+                while chunk.nextChunk.priority:
+                    chunk = chunk.nextChunk
+                chunk.nextChunk = skipStaleChunks(chunk.nextChunk, threshold)
+            elif currentSpeechChunk.timestamp < threshold:
                 originalCancelSpeech()
-                while currentSpeechChunk.timestamp < threshold:
-                    currentSpeechChunk = currentSpeechChunk.nextChunk
+                currentSpeechChunk = skipStaleChunks(currentSpeechChunk, threshold)
                 currentSpeechChunk.speak()
         else:
             currentSpeechChunk = latestSpeechChunk = newChunk
@@ -409,6 +1012,148 @@ def newCancelSpeech(*args, **kwargs):
     #mylog(f'newCancelSpeech lock released!')
     return originalCancelSpeech(*args, **kwargs)
 
+# Incremental line diff engine.
+# Consoles mostly either append lines at the bottom, scroll, or redraw a few lines.
+# Lines are compared by their hashes; scrolling is detected by looking up a rolling hash of the first lines of new screen among windows of old screen.
+# Then common prefix and suffix are trimmed and Myers diff is only computed on the remaining changed window.
+SCROLL_ANCHOR_LINES = 4
+MAX_DIFF_EDIT_DISTANCE = 500
+ROLLING_HASH_BASE = 1000003
+ROLLING_HASH_MODULO = (1 << 61) - 1
+
+def hashLines(lines):
+    return [hash(line) & ROLLING_HASH_MODULO for line in lines]
+
+def detectScroll(oldHashes, newHashes):
+    """
+    Returns the number of lines that old screen has been scrolled up by, such that old lines starting from that index align with the beginning of new screen.
+    Returns 0 if no scrolling is detected.
+    """
+    w = min(SCROLL_ANCHOR_LINES, len(oldHashes), len(newHashes))
+    if w == 0 or oldHashes[:w] == newHashes[:w]:
+        return 0
+    base = ROLLING_HASH_BASE
+    modulo = ROLLING_HASH_MODULO
+    highPower = pow(base, w - 1, modulo)
+    target = 0
+    for h in newHashes[:w]:
+        target = (target * base + h) % modulo
+    rolling = 0
+    for h in oldHashes[:w]:
+        rolling = (rolling * base + h) % modulo
+    bestScroll = 0
+    bestLength = 0
+    for scroll in range(0, len(oldHashes) - w + 1):
+        if scroll > 0:
+            rolling = ((rolling - oldHashes[scroll - 1] * highPower) * base + oldHashes[scroll + w - 1]) % modulo
+        if rolling != target or oldHashes[scroll:scroll + w] != newHashes[:w]:
+            continue
+        length = w
+        while scroll + length < len(oldHashes) and length < len(newHashes) and oldHashes[scroll + length] == newHashes[length]:
+            length += 1
+        if length > bestLength:
+            bestScroll = scroll
+            bestLength = length
+        if scroll + length == len(oldHashes):
+            # The rest of old screen matches - this is the most common case of scrolling.
+            break
+    return bestScroll
+
+def myersMatchedIndices(a, b, maxD):
+    """
+    Myers O(ND) diff algorithm.
+    Returns the set of indices in b that are matched to some elements of a in the shortest edit script,
+    or None if edit distance exceeds maxD.
+    """
+    n = len(a)
+    m = len(b)
+    v = {1: 0}
+    trace = []
+    for d in range(min(maxD, n + m) + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                break
+        else:
+            continue
+        break
+    else:
+        return None
+    # Backtracking the edit script
+    matched = set()
+    x = n
+    y = m
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            previousK = k + 1
+        else:
+            previousK = k - 1
+        previousX = v[previousK]
+        previousY = previousX - previousK
+        while x > previousX and y > previousY:
+            x -= 1
+            y -= 1
+            matched.add(y)
+        x = previousX
+        y = previousY
+    return matched
+
+def calculateNewLines(oldLines, newLines, partialLines=True):
+    """
+    Returns the list of new text that appeared on the screen.
+    When only a single line has changed, only the inserted part of that line is returned, so that NVDA can still recognize typed characters,
+    unless partialLines is False.
+    """
+    if oldLines == newLines:
+        return []
+    oldHashes = hashLines(oldLines)
+    newHashes = hashLines(newLines)
+    scroll = detectScroll(oldHashes, newHashes)
+    oldStart = scroll
+    newStart = 0
+    oldEnd = len(oldHashes)
+    newEnd = len(newHashes)
+    while oldStart < oldEnd and newStart < newEnd and oldHashes[oldStart] == newHashes[newStart]:
+        oldStart += 1
+        newStart += 1
+    while oldStart < oldEnd and newStart < newEnd and oldHashes[oldEnd - 1] == newHashes[newEnd - 1]:
+        oldEnd -= 1
+        newEnd -= 1
+    if partialLines and oldEnd - oldStart == 1 and newEnd - newStart == 1:
+        suffixLength, deleteCount, insertText = computeMinimalEdit(oldLines[oldStart], newLines[newStart])
+        if len(insertText.strip()) == 0:
+            return []
+        return [insertText]
+    matched = myersMatchedIndices(oldHashes[oldStart:oldEnd], newHashes[newStart:newEnd], MAX_DIFF_EDIT_DISTANCE)
+    if matched is None:
+        matched = set()
+    return [
+        newLines[newStart + i]
+        for i in range(newEnd - newStart)
+        if i not in matched
+    ]
+
+originalCalculateNewText = None
+def newCalculateNewText(selfself, newText, oldText, *args, **kwargs):
+    if not configSnapshot.incrementalDiff:
+        return originalCalculateNewText(selfself, newText, oldText, *args, **kwargs)
+    if isinstance(newText, str):
+        newText = newText.splitlines()
+    if isinstance(oldText, str):
+        oldText = oldText.splitlines()
+    return calculateNewLines(oldText, newText)
+
 class SingleLineEditTextDialog(wx.Dialog):
     # This is a single line text edit window.
     def __init__(self, parent, text, onTextComplete):
@@ -544,6 +1289,21 @@ class SingleLineEditTextDialog(wx.Dialog):
             suppressTerminalTitleAnnouncement = False
         core.callLater(1000, reset)
 
+class TextLineIndex:
+    """
+    Offsets of line starts in text, so that offsets in text can be converted to line and column numbers in O(log n).
+    """
+    def __init__(self, text):
+        self.text = text
+        self.lineStarts = [0] + [m.end() for m in re.finditer("\n", text)]
+
+    def offsetToLineCol(self, offset):
+        lineNum = bisect.bisect_right(self.lineStarts, offset) - 1
+        return lineNum, offset - self.lineStarts[lineNum]
+
+    def lineColToOffset(self, lineNum, colNum):
+        return self.lineStarts[lineNum] + colNum
+
 class MultilineEditTextDialog(wx.Dialog):
     def __init__(self, parent, text, onTextComplete):
         self.tabValue = "    "
@@ -554,6 +1314,10 @@ class MultilineEditTextDialog(wx.Dialog):
         self.onTextComplete = onTextComplete
         self.keystroke = None
         self._finished = False
+        # Line index and search matches are computed lazily and dropped whenever text changes.
+        self.lineIndex = None
+        self.findRegex = None
+        self.findMatches = None
 
         mainSizer = wx.BoxSizer(wx.VERTICAL)
         sHelper = gui.guiHelper.BoxSizerHelper(self, orientation=wx.VERTICAL)
@@ -563,6 +1327,7 @@ class MultilineEditTextDialog(wx.Dialog):
         self.Bind(wx.EVT_CHAR_HOOK, self.OnKeyUP)
         sHelper.addItem(self.textCtrl)
         self.textCtrl.SetValue(text)
+        self.textCtrl.Bind(wx.EVT_TEXT, self.onTextChanged)
         self.SetFocus()
         self.Maximize(True)
     
@@ -608,8 +1373,7 @@ class MultilineEditTextDialog(wx.Dialog):
             if not any(modifiers):
                 # Just pure enter without any modifiers
                 # Perform Autoindent
-                curPos = self.textCtrl.GetInsertionPoint
-                lineNum = len(self.textCtrl.GetRange( 0, self.textCtrl.GetInsertionPoint() ).split("\n")) - 1
+                _, colNum, lineNum = self.textCtrl.PositionToXY(self.textCtrl.GetInsertionPoint())
                 lineText = self.textCtrl.GetLineText(lineNum)
                 m = re.search("^\s*", lineText)
                 if m:
@@ -640,14 +1404,10 @@ class MultilineEditTextDialog(wx.Dialog):
             else:
                 # Shift+Tab
                 curPos = self.textCtrl.GetInsertionPoint()
-                lineNum = len(self.textCtrl.GetRange( 0, self.textCtrl.GetInsertionPoint() ).split("\n")) - 1
-                priorText = self.textCtrl.GetRange( 0, self.textCtrl.GetInsertionPoint() )
-                text = self.textCtrl.GetValue()
-                postText = text[len(priorText):]
+                _, colNum, lineNum = self.textCtrl.PositionToXY(curPos)
+                priorText = self.textCtrl.GetLineText(lineNum)[:colNum]
                 if priorText.endswith(self.tabValue):
-                    newText = priorText[:-len(self.tabValue)] + postText
-                    self.textCtrl.SetValue(newText)
-                    self.textCtrl.SetInsertionPoint(curPos - len(self.tabValue))
+                    self.textCtrl.Remove(curPos - len(self.tabValue), curPos)
         elif event.GetKeyCode() == wx.WXK_CONTROL_A:
             self.textCtrl.SetSelection(-1,-1)
         elif event.GetKeyCode() == wx.WXK_HOME:
@@ -679,8 +1439,61 @@ class MultilineEditTextDialog(wx.Dialog):
             self.keystroke = None
             self._finish(wx.ID_CANCEL)
             return
+        elif keyCode == ord("F") and event.ControlDown() and not event.ShiftDown() and not event.AltDown():
+            self.promptFind()
+            return
+        elif keyCode == wx.WXK_F3 and not event.ControlDown() and not event.AltDown():
+            self.findNext(-1 if event.ShiftDown() else 1)
+            return
+        event.Skip()
+
+    def onTextChanged(self, event):
+        self.lineIndex = None
+        self.findMatches = None
         event.Skip()
 
+    def getLineIndex(self):
+        if self.lineIndex is None:
+            self.lineIndex = TextLineIndex(self.textCtrl.GetValue())
+        return self.lineIndex
+
+    def promptFind(self):
+        with wx.TextEntryDialog(self, _("Find regular expression or text:"), _("Find")) as d:
+            if self.findRegex is not None:
+                d.SetValue(self.findRegex.pattern)
+            if d.ShowModal() != wx.ID_OK or len(d.GetValue()) == 0:
+                return
+            pattern = d.GetValue()
+        try:
+            self.findRegex = re.compile(pattern, re.IGNORECASE)
+        except re.error:
+            self.findRegex = re.compile(re.escape(pattern), re.IGNORECASE)
+        self.findMatches = None
+        self.findNext(1)
+
+    def findNext(self, direction):
+        """
+        Moves caret to the next or previous match, wrapping around.
+        Matches are found once per text and pattern; each jump is then a binary search from caret position.
+        """
+        if self.findRegex is None:
+            return self.promptFind()
+        lineIndex = self.getLineIndex()
+        if self.findMatches is None:
+            self.findMatches = [m.start() for m in self.findRegex.finditer(lineIndex.text)]
+        if len(self.findMatches) == 0:
+            ui.message(_("Not found"))
+            return
+        dummy, colNum, lineNum = self.textCtrl.PositionToXY(self.textCtrl.GetInsertionPoint())
+        offset = lineIndex.lineColToOffset(lineNum, colNum)
+        if direction > 0:
+            i = bisect.bisect_right(self.findMatches, offset) % len(self.findMatches)
+        else:
+            i = (bisect.bisect_left(self.findMatches, offset) - 1) % len(self.findMatches)
+        lineNum, colNum = lineIndex.offsetToLineCol(self.findMatches[i])
+        self.textCtrl.SetInsertionPoint(self.textCtrl.XYToPosition(colNum, lineNum))
+        ui.message(self.textCtrl.GetLineText(lineNum))
+
 _currentEditDialog = None
 
 def popupEditTextDialog(text, onTextComplete):
@@ -742,17 +1555,65 @@ def fromNameEnglish(name):
 
     return keyboardHandler.KeyboardInputGesture(keys[:-1], vk, 0, ext)
 
-def fromNameSmart(name):
+def resolveGestureName(name):
     try:
         return keyboardHandler.KeyboardInputGesture.fromName(name)
-    except:
-        log.error(f"Couldn't resolve {name} keystroke using system default locale.", exc_info=True)
+    except Exception:
+        log.debug(f"Couldn't resolve {name} keystroke using current keyboard layout.")
     try:
         return fromNameEnglish(name)
     except:
         log.error(f"Couldn't resolve {name} keystroke using English default locale.", exc_info=True)
     return None
 
+# Keystrokes that the add-on sends itself. They are resolved in advance for every keyboard layout.
+PRECOMPUTED_GESTURE_NAMES = [
+    "+".join(modifiers + ("Enter",))
+    for n in range(4)
+    for modifiers in itertools.combinations(("control", "shift", "alt"), n)
+] + [
+    "Shift+Insert",
+    "Control+v",
+]
+
+class GestureTable:
+    """
+    Table of resolved keystrokes for current keyboard layout.
+    Table is rebuilt when input locale changes, so that keystrokes are resolved by a single dictionary lookup.
+    """
+    def __init__(self):
+        self.layout = None
+        self.table = {}
+
+    @staticmethod
+    def normalize(name):
+        keys = name.lower().split("+")
+        return tuple(sorted(keys[:-1])) + (keys[-1],)
+
+    def rebuild(self, layout):
+        self.layout = layout
+        self.table = {
+            self.normalize(name): resolveGestureName(name)
+            for name in PRECOMPUTED_GESTURE_NAMES
+        }
+
+    def resolve(self, name):
+        layout = getKeyboardLayout()
+        if layout != self.layout:
+            self.rebuild(layout)
+        key = self.normalize(name)
+        try:
+            return self.table[key]
+        except KeyError:
+            gesture = resolveGestureName(name)
+            self.table[key] = gesture
+            return gesture
+
+gestureTable = GestureTable()
+
+def fromNameSmart(name):
+    return gestureTable.resolve(name)
+
 originalTerminalGainFocus = None
 originalNVDAObjectFfocusEntered = None
 suppressTerminalTitleAnnouncement = False
@@ -772,28 +1633,214 @@ def myReview_top(self, gesture: inputCore.InputGesture):
     review=api.getReviewPosition()
     obj = review.obj
     count=scriptHandler.getLastScriptRepeatCount()
-    if not getConfig("overrideTopReview") or count >= 1 or not isinstance(obj, (_NotificationsBasedWinTerminalUIA if _shouldUseWindowsTerminalNotifications() else _DiffBasedWinTerminalUIA)):
+    if not configSnapshot.overrideTopReview or count >= 1 or not isinstance(obj, (_NotificationsBasedWinTerminalUIA if _shouldUseWindowsTerminalNotifications() else _DiffBasedWinTerminalUIA)):
         return originalReview_top(gesture)
 
-    def speakInfo(info):
+    return speakReviewLine(findFirstVisibleLine(review))
+
+def speakReviewLine(info):
+    info.collapse()
+    if api.setReviewPosition(info):
+        info.expand(textInfos.UNIT_LINE)
+        speech.speakTextInfo(
+            info,
+            unit=textInfos.UNIT_LINE,
+            reason=controlTypes.OutputReason.CARET
+        )
+    else:
+        ui.message(_("Failed to set review positionreveiew "))
+
+def findFirstVisibleLine(review):
+    """
+    Finds the topmost visible line above review position.
+    Lines above review position are visible up to a certain distance and invisible beyond that,
+    so instead of walking up line by line we first find an upper bound by doubling the distance
+    and then bisect it. This takes O(log n) UIA calls instead of O(n).
+    """
+    probes = {}
+    def getLine(linesUp):
+        info = review.copy()
         info.collapse()
-        if api.setReviewPosition(info):
-            info.expand(textInfos.UNIT_LINE)
-            speech.speakTextInfo(
-                info,
-                unit=textInfos.UNIT_LINE,
-                reason=controlTypes.OutputReason.CARET
-            )
+        moved = info.move(textInfos.UNIT_LINE, -linesUp) if linesUp > 0 else 0
+        info.expand(textInfos.UNIT_LINE)
+        return info, moved == -linesUp
+    def isInvisible(linesUp):
+        if linesUp not in probes:
+            info, exists = getLine(linesUp)
+            probes[linesUp] = not exists or len(info.boundingRects) == 0
+        return probes[linesUp]
+    lo = 0
+    hi = 1
+    while not isInvisible(hi):
+        lo = hi
+        hi *= 2
+    # Line lo is visible or is the review line itself; line hi is invisible.
+    firstInvisible = lo + bisect.bisect_left(range(lo, hi + 1), True, key=isInvisible)
+    info, exists = getLine(firstInvisible - 1)
+    return info
+
+class ConsoleTextTracker:
+    """
+    Remembers the position in console buffer up to which text has been read,
+    so that next time only the text printed after that position is retrieved.
+    Last non-empty line might still be changing, e.g. when user is typing a command, so it is never considered read.
+    Trailing empty lines are not considered read either, since console prints new text into them.
+    Position is only trusted as long as the line before it hasn't changed; otherwise buffer has been cleared,
+    trimmed or, in legacy consoles, scrolled, and the whole buffer is read again.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.stableEnd = None
+        self.lastStableLine = None
+
+    def isStableEndValid(self):
+        if self.stableEnd is None:
+            return False
+        info = self.stableEnd.copy()
+        if info.move(textInfos.UNIT_LINE, -1) != -1:
+            return False
+        info.expand(textInfos.UNIT_LINE)
+        return info.text == self.lastStableLine
+
+    def read(self, obj):
+        """
+        Returns a tuple of text info at the beginning of retrieved text, its lines,
+        the number of those lines that are now considered read, and whether only new text has been retrieved.
+        In UIA consoles this is called in background thread.
+        """
+        incremental = self.isStableEndValid()
+        if incremental:
+            start = self.stableEnd
         else:
-            ui.message(_("Failed to set review positionreveiew "))
-
-    while True:
-        old = review.copy()
-        review.collapse()
-        code = review.move(textInfos.UNIT_LINE, -1)
-        review.expand(textInfos.UNIT_LINE)
-        if code == 0 or len(review.boundingRects) == 0:
-            return speakInfo(old)
+            self.reset()
+            start = obj.makeTextInfo(textInfos.POSITION_FIRST)
+        chunk = start.copy()
+        chunk.setEndPoint(obj.makeTextInfo(textInfos.POSITION_ALL), "endToEnd")
+        lines = splitConsoleText(chunk, chunk.text)
+        stableLineCount = max([i for i, line in enumerate(lines) if len(line.strip()) > 0], default=0)
+        if stableLineCount > 0:
+            lastStable = start.copy()
+            lastStable.move(textInfos.UNIT_LINE, stableLineCount - 1)
+            lastStable.expand(textInfos.UNIT_LINE)
+            self.lastStableLine = lastStable.text
+            self.stableEnd = lastStable.copy()
+            self.stableEnd.collapse(end=True)
+        return start, lines, stableLineCount, incremental
+
+class PromptIndex:
+    """
+    Positions of command prompts in console buffer, kept as collapsed text infos in buffer order.
+    Console buffer normally only grows at the end, so on every update only the text printed since the previous update
+    is retrieved, see ConsoleTextTracker.
+    Navigation compares review position with stored positions, so it doesn't retrieve console text at all.
+    Index is marked dirty by newReportConsoleText when a new prompt is printed.
+    """
+    def __init__(self):
+        self.tracker = ConsoleTextTracker()
+        self.reset()
+
+    def reset(self):
+        self.tracker.reset()
+        self.prompts = []
+        self.stablePromptCount = 0
+        self.dirty = True
+
+    def update(self, obj, lineFilter):
+        """
+        Scans text printed since the previous update. In UIA consoles this is called in background thread.
+        """
+        # Cleared before reading, so that a prompt reported while reading is not lost.
+        self.dirty = False
+        start, lines, stableLineCount, incremental = self.tracker.read(obj)
+        if incremental:
+            del self.prompts[self.stablePromptCount:]
+        else:
+            self.prompts = []
+            self.stablePromptCount = 0
+        # Every prompt is located by moving from the previous one, so that moving by lines costs O(lines) in total.
+        info = start
+        infoLineNum = 0
+        for lineNum, line in enumerate(lines):
+            if lineFilter.isPrompt(line):
+                if lineNum < stableLineCount:
+                    self.stablePromptCount += 1
+                info = info.copy()
+                info.move(textInfos.UNIT_LINE, lineNum - infoLineNum)
+                infoLineNum = lineNum
+                self.prompts.append(info)
+
+    def bisect(self, lineStart, right):
+        key = lambda prompt: prompt.compareEndPoints(lineStart, "startToStart")
+        if right:
+            return bisect.bisect_right(self.prompts, 0, key=key)
+        return bisect.bisect_left(self.prompts, 0, key=key)
+
+    def previous(self, lineStart, inclusive=False):
+        i = self.bisect(lineStart, right=inclusive)
+        return self.prompts[i - 1] if i > 0 else None
+
+    def next(self, lineStart):
+        i = self.bisect(lineStart, right=True)
+        return self.prompts[i] if i < len(self.prompts) else None
+
+promptIndexes = {}
+
+def getReviewLineAndIndex(obj):
+    review = api.getReviewPosition()
+    if review.obj is not obj:
+        review = obj.makeTextInfo(textInfos.POSITION_CARET)
+    lineStart = review.copy()
+    lineStart.expand(textInfos.UNIT_LINE)
+    lineStart.collapse()
+    promptIndex = promptIndexes.get(obj.windowHandle)
+    if promptIndex is None:
+        promptIndex = promptIndexes[obj.windowHandle] = PromptIndex()
+    return lineStart, promptIndex
+
+def navigatePromptAsync(obj, direction):
+    lineStart, promptIndex = getReviewLineAndIndex(obj)
+    lineFilter = getLineFilter()
+    for attempt in range(2):
+        refreshed = promptIndex.dirty
+        if refreshed:
+            yield from callConsoleAsync(obj, promptIndex.update, obj, lineFilter)
+        target = promptIndex.previous(lineStart) if direction < 0 else promptIndex.next(lineStart)
+        if target is None:
+            ui.message(_("No previous prompt") if direction < 0 else _("No next prompt"))
+            return
+        info = target.copy()
+        info.expand(textInfos.UNIT_LINE)
+        if refreshed or lineFilter.isPrompt(info.text.rstrip("\r\n")):
+            return speakReviewLine(info)
+        # Buffer must have been trimmed or cleared without printing a new prompt.
+        promptIndex.reset()
+
+def readCommandOutput(obj, prompt, nextPrompt):
+    output = prompt.copy()
+    if output.move(textInfos.UNIT_LINE, 1) != 1:
+        return []
+    if nextPrompt is not None:
+        output.setEndPoint(nextPrompt, "endToStart")
+    else:
+        output.setEndPoint(obj.makeTextInfo(textInfos.POSITION_ALL), "endToEnd")
+    return splitConsoleText(output, output.text)
+
+def getCommandOutputAsync(obj):
+    lineStart, promptIndex = getReviewLineAndIndex(obj)
+    # Output of the last command might still be growing, so new text is always scanned.
+    yield from callConsoleAsync(obj, promptIndex.update, obj, getLineFilter())
+    start = promptIndex.previous(lineStart, inclusive=True)
+    if start is None:
+        ui.message(_("No prompt found above review cursor"))
+        return
+    end = promptIndex.next(start)
+    lines = yield from callConsoleAsync(obj, readCommandOutput, obj, start, end)
+    lines = [line.rstrip() for line in lines]
+    while len(lines) > 0 and len(lines[-1].strip()) == 0:
+        lines.pop()
+    presentCaptureResult(lines)
 
 def ephemeralCopyToClip(text: str):
     """
@@ -850,6 +1897,7 @@ def verifyWindowUnderMousePointer(obj):
 
 def pastePuttyOld(obj):
     # This approach doesn't appear to work, since apparently Putty triggers context menu on right click. Middle button doesn't appear to do anything either.
+    import mouseHandler
     origX, origY = winUser.getCursorPos()
     (left,top,width,height) = obj.location
     x=left+(width//2)
@@ -904,6 +1952,7 @@ controlCharacter = "⌂" # character code 127
 
 
 
+@memoize(maxSize=64)
 def getVkLetter(keyName):
     en_us_input_Hkl = 1033 + (1033 << 16)
     try:
@@ -928,60 +1977,302 @@ def getVkCodes():
     return d
 
 KEYEVENTF_EXTENDEDKEY = 0x0001
+# Input sequences are built directly into contiguous ctypes arrays of INPUT structures,
+# that can be passed to SendInput without any further marshalling.
+def makeInputArray(n):
+    return (winBindings.user32.INPUT * n)()
+
 def makeVkInput(pairs):
-    result = []
     if not isinstance(pairs, list):
         pairs = [pairs]
+    keys = []
     for pair in pairs:
         try:
             vk, extended = pair
         except TypeError:
             vk = pair
             extended = False
-        input = winBindings.user32.INPUT(type=winBindings.user32.INPUT_TYPE.KEYBOARD)
-        input.ii.ki.wVk = vk
-        input.ii.ki.dwFlags = (KEYEVENTF_EXTENDEDKEY * extended)
-        result.append(input)
-    for pair in reversed(pairs):
-        try:
-            vk, extended = pair
-        except TypeError:
-            vk = pair
-        input = winBindings.user32.INPUT(type=winBindings.user32.INPUT_TYPE.KEYBOARD)
-        input.ii.ki.wVk = vk
-        input.ii.ki.dwFlags = (KEYEVENTF_EXTENDEDKEY * extended) | winBindings.user32.KEYEVENTF.KEYUP
-        result.append(input)
+        keys.append((vk, extended))
+    n = len(keys)
+    result = makeInputArray(2 * n)
+    keyboardType = winBindings.user32.INPUT_TYPE.KEYBOARD
+    keyUp = winBindings.user32.KEYEVENTF.KEYUP
+    for i, (vk, extended) in enumerate(keys):
+        flags = KEYEVENTF_EXTENDEDKEY * extended
+        down = result[i]
+        down.type = keyboardType
+        down.ii.ki.wVk = vk
+        down.ii.ki.dwFlags = flags
+        up = result[2 * n - 1 - i]
+        up.type = keyboardType
+        up.ii.ki.wVk = vk
+        up.ii.ki.dwFlags = flags | keyUp
     return result
 
 def makeUnicodeInput(string):
-    result = []
-    for c in string:
-        input = winBindings.user32.INPUT(type=winBindings.user32.INPUT_TYPE.KEYBOARD)
-        input.ii.ki.wScan = ord(c)
-        input.ii.ki.dwFlags = winBindings.user32.KEYEVENTF.UNICODE
-        result.append(input)
-        input2 = winBindings.user32.INPUT(type=winBindings.user32.INPUT_TYPE.KEYBOARD)
-        input2.ii.ki.wScan = ord(c)
-        input2.ii.ki.dwFlags = winBindings.user32.KEYEVENTF.UNICODE | winBindings.user32.KEYEVENTF.KEYUP
-        result.append(input2)
+    # Encoding as UTF-16 so that characters outside of BMP are sent as surrogate pairs.
+    data = string.encode('utf-16-le')
+    codes = struct.unpack(f"<{len(data) // 2}H", data)
+    result = makeInputArray(2 * len(codes))
+    keyboardType = winBindings.user32.INPUT_TYPE.KEYBOARD
+    flags = winBindings.user32.KEYEVENTF.UNICODE
+    flagsUp = flags | winBindings.user32.KEYEVENTF.KEYUP
+    for i, code in enumerate(codes):
+        down = result[2 * i]
+        down.type = keyboardType
+        down.ii.ki.wScan = code
+        down.ii.ki.dwFlags = flags
+        up = result[2 * i + 1]
+        up.type = keyboardType
+        up.ii.ki.wScan = code
+        up.ii.ki.dwFlags = flagsUp
     return result
 
+# Frequently used sequences are built only once.
+# Cached arrays must never be modified, since InputBuilder only copies them.
+@Memoize
+def getCachedVkInput(*pairs):
+    return makeVkInput(list(pairs))
+
+@Memoize
+def getCachedUnicodeInput(string):
+    return makeUnicodeInput(string)
+
+class InputBuilder:
+    """
+    Collects INPUT arrays and concatenates them into a single contiguous array.
+    """
+    def __init__(self):
+        self.parts = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, inputs):
+        self.parts.append(inputs)
+        self.count += len(inputs)
+        return self
+
+    def vk(self, pairs):
+        return self.add(makeVkInput(pairs))
+
+    def unicode(self, string):
+        return self.add(makeUnicodeInput(string))
+
+    def build(self):
+        result = makeInputArray(self.count)
+        address = ctypes.addressof(result)
+        for part in self.parts:
+            size = ctypes.sizeof(part)
+            ctypes.memmove(address, part, size)
+            address += size
+        return result
+
+def sliceInputs(inputs, start, end):
+    # Returns a view into inputs array without copying.
+    return (winBindings.user32.INPUT * (end - start)).from_buffer(inputs, start * ctypes.sizeof(winBindings.user32.INPUT))
+
+def sendInputs(inputs):
+    if isinstance(inputs, InputBuilder):
+        inputs = inputs.build()
+    if len(inputs) == 0:
+        return
+    with keyboardHandler.ignoreInjection():
+        winBindings.user32.dll.SendInput(len(inputs), inputs, ctypes.sizeof(winBindings.user32.INPUT))
+
+def getKeystrokeBoundaries(inputs):
+    """
+    Returns indices in the inputs array, at which no key is held down.
+    This way chords, such as Control+V, are never split between two SendInput calls.
+    Characters outside of BMP are typed as a high surrogate followed by a low surrogate; such a pair is treated as a single keystroke.
+    """
+    boundaries = []
+    pressed = set()
+    keyUp = winBindings.user32.KEYEVENTF.KEYUP
+    unicode = winBindings.user32.KEYEVENTF.UNICODE
+    for i, input in enumerate(inputs):
+        key = (input.ii.ki.wVk, input.ii.ki.wScan)
+        flags = input.ii.ki.dwFlags
+        if flags & keyUp:
+            pressed.discard(key)
+        else:
+            pressed.add(key)
+        isHighSurrogate = (flags & unicode) and 0xD800 <= input.ii.ki.wScan <= 0xDBFF
+        if len(pressed) == 0 and not isHighSurrogate:
+            boundaries.append(i + 1)
+    if len(boundaries) == 0 or boundaries[-1] != len(inputs):
+        boundaries.append(len(inputs))
+    return boundaries
+
+INJECTION_MIN_CHUNK_SIZE = 4 # keystrokes
+INJECTION_MAX_CHUNK_SIZE = 256 # keystrokes
+INJECTION_PACING_DELAY = 10 # millis
+INJECTION_ECHO_TIMEOUT = 1 # seconds
+INJECTION_FAST_ECHO = 0.05 # seconds
+INJECTION_SLOW_ECHO = 0.3 # seconds
+# Chunk size is adjusted as we learn how fast console keeps up with injected keystrokes.
+injectionChunkSize = 32
+
+def readCaretLine(obj):
+    # Typed text is echoed at caret, so only its line is compared; whole console buffer can be huge.
+    info = obj.makeTextInfo(textInfos.POSITION_CARET)
+    info.expand(textInfos.UNIT_LINE)
+    return info.text
+
+def sendInputsPaced(obj, inputs, verifyEcho=False):
+    """
+    Generator function that injects inputs in chunks and yields between chunks, so that slow consoles, such as laggy SSH connections, don't drop keystrokes.
+    When verifyEcho is True, after each chunk it waits until line of caret changes and adjusts chunk size depending on how quickly console keeps up.
+    Only set verifyEcho for inputs that are expected to change console text, such as typed characters or backspaces.
+    """
+    global injectionChunkSize
+    if isinstance(inputs, InputBuilder):
+        inputs = inputs.build()
+    if len(inputs) == 0:
+        return
+    boundaries = getKeystrokeBoundaries(inputs)
+    i = 0
+    while i < len(boundaries):
+        chunkStart = boundaries[i - 1] if i > 0 else 0
+        i = min(i + injectionChunkSize, len(boundaries))
+        chunk = sliceInputs(inputs, chunkStart, boundaries[i - 1])
+        if verifyEcho:
+            text = yield from callConsoleAsync(obj, readCaretLine, obj)
+        sendInputs(chunk)
+        if not verifyEcho:
+            if i < len(boundaries):
+                yield INJECTION_PACING_DELAY
+            continue
+        start = time.time()
+        timeout = start + INJECTION_ECHO_TIMEOUT
+        echoed = False
+        while time.time() < timeout:
+            yield INJECTION_PACING_DELAY
+            if (yield from callConsoleAsync(obj, readCaretLine, obj)) != text:
+                echoed = True
+                break
+        elapsed = time.time() - start
+        if tracer.enabled:
+            mylog(f"Injected chunk of {injectionChunkSize} keystrokes, echoed={echoed} in {elapsed:0.3}s")
+        if not echoed or elapsed > INJECTION_SLOW_ECHO:
+            injectionChunkSize = max(INJECTION_MIN_CHUNK_SIZE, injectionChunkSize // 2)
+        elif elapsed < INJECTION_FAST_ECHO:
+            injectionChunkSize = min(INJECTION_MAX_CHUNK_SIZE, injectionChunkSize * 2)
+
 def script_editPrompt(self, gesture):
-    executeAsynchronously(editPrompt(self, gesture))
+    scheduler.run(editPrompt(self, gesture), name="editPrompt")
 script_editPrompt.category = "Console toolkit"
 script_editPrompt.__name__ = _("Edit prompt")
 script_editPrompt.__doc__ = _("Opens accessible window that allows to edit current command line prompt.")
 
 def script_captureOutput(self, gesture):
-    executeAsynchronously(captureOutputAsync(self, gesture))
+    scheduler.run(captureOutputAsync(self, gesture), name="captureOutput")
 script_captureOutput.category = "Console toolkit"
 script_captureOutput.__name__ = _("Capture command output")
 script_captureOutput.__doc__ = _("Executes command, captures output and presents it in accessible window.")
 
+def script_previousPrompt(self, gesture):
+    scheduler.run(navigatePromptAsync(self, -1), name="promptNavigation")
+script_previousPrompt.category = "Console toolkit"
+script_previousPrompt.__name__ = _("Previous prompt")
+script_previousPrompt.__doc__ = _("Moves review cursor to the previous command prompt in console.")
+
+def script_nextPrompt(self, gesture):
+    scheduler.run(navigatePromptAsync(self, 1), name="promptNavigation")
+script_nextPrompt.category = "Console toolkit"
+script_nextPrompt.__name__ = _("Next prompt")
+script_nextPrompt.__doc__ = _("Moves review cursor to the next command prompt in console.")
+
+def script_commandOutput(self, gesture):
+    scheduler.run(getCommandOutputAsync(self), name="promptNavigation")
+script_commandOutput.category = "Console toolkit"
+script_commandOutput.__name__ = _("Command output")
+script_commandOutput.__doc__ = _("Presents output of the command under review cursor in the same way as captured output.")
+
+def script_captureBatch(self, gesture):
+    scheduler.run(captureBatchOutputAsync(self, gesture), name="captureOutput")
+script_captureBatch.category = "Console toolkit"
+script_captureBatch.__name__ = _("Capture output of each command")
+script_captureBatch.__doc__ = _("Executes commands separated by semicolons one by one and presents output of each of them in a separate section.")
+
+def captureBatchOutputAsync(self, gesture):
+    scheduler.cancel("capture")
+    for delay in waitUntilModifiersReleased():
+        yield delay
+    prompt = []
+    for token in extractCurrentPrompt(self, prompt):
+        yield token
+    captureSuffix = getConfig("captureSuffix")
+    prompt = prompt[0].rstrip()
+    commandLine = prompt
+    if len(captureSuffix) > 0 and commandLine.endswith(captureSuffix):
+        commandLine = commandLine[:-len(captureSuffix)]
+    commands = splitCommands(commandLine)
+    if len(commands) == 0:
+        ui.message(_("No commands to capture"))
+        return
+    # Commands are typed one by one, so the original command line is erased.
+    yield from updatePrompt(wx.ID_CANCEL, "", None, prompt, self)
+    scheduler.run(captureBatchAsync(self, commands), name="capture")
+
+def script_toggleFollow(self, gesture):
+    toggleFollow(self)
+script_toggleFollow.category = "Console toolkit"
+script_toggleFollow.__name__ = _("Toggle follow mode")
+script_toggleFollow.__doc__ = _("Starts or stops collecting all new output of this console in the background.")
+
+def script_showFollowedOutput(self, gesture):
+    showFollowedOutput(self)
+script_showFollowedOutput.category = "Console toolkit"
+script_showFollowedOutput.__name__ = _("Show followed output")
+script_showFollowedOutput.__doc__ = _("Presents output collected in follow mode so far without stopping follow mode.")
+
+def script_exportScrollback(self, gesture):
+    scheduler.run(exportScrollbackAsync(self), name="export", overlap=TASK_OVERLAP_SKIP)
+script_exportScrollback.category = "Console toolkit"
+script_exportScrollback.__name__ = _("Export console buffer")
+script_exportScrollback.__doc__ = _("Presents whole console buffer including scrollback in the same way as captured command output.")
+
+def script_toggleWatch(self, gesture):
+    if isWatching:
+        scheduler.cancel("capture")
+        return
+    scheduler.run(watchOutputAsync(self, gesture), name="captureOutput")
+script_toggleWatch.category = "Console toolkit"
+script_toggleWatch.__name__ = _("Toggle watch mode")
+script_toggleWatch.__doc__ = _("Re-runs command at the prompt periodically and speaks only lines of output that have changed.")
+
+def watchOutputAsync(self, gesture):
+    scheduler.cancel("capture")
+    for delay in waitUntilModifiersReleased():
+        yield delay
+    if getConfig("captureBackend") != CAPTURE_BACKEND_TMUX and not getConfig("watchWithoutTmux"):
+        ui.message(_("Watch mode requires tmux capture method. Watching without tmux can be allowed in Console Toolkit settings"))
+        return
+    captureSuffix = getConfig("captureSuffix")
+    prompt = []
+    for token in extractCurrentPrompt(self, prompt):
+        yield token
+    prompt = prompt[0].rstrip()
+    command = prompt
+    if len(captureSuffix) > 0 and command.endswith(captureSuffix):
+        command = command[:-len(captureSuffix)]
+    if len(command.strip()) == 0:
+        ui.message(_("No command to watch"))
+        return
+    # Command is typed again on every run, so the original command line is erased.
+    yield from updatePrompt(wx.ID_CANCEL, "", None, prompt, self)
+    scheduler.run(watchAsync(self, command), name="capture")
+
+def script_showCaptureHistory(self, gesture):
+    scheduler.run(showCaptureHistoryAsync(), name="captureHistory", overlap=TASK_OVERLAP_SKIP)
+script_showCaptureHistory.category = "Console toolkit"
+script_showCaptureHistory.__name__ = _("Capture history")
+script_showCaptureHistory.__doc__ = _("Shows previously captured command outputs and opens the selected one.")
+
 def captureOutputAsync(self, gesture):
-    global captureStopFlag
-    # That's the worst multithreading ever. Hope that if there's another thread running, they'll see this flag before  this function finishes. I'm ashamed of this.
-    captureStopFlag = True
+    scheduler.cancel("capture")
     for delay in waitUntilModifiersReleased():
         yield delay
     captureSuffix = getConfig("captureSuffix")
@@ -990,17 +2281,21 @@ def captureOutputAsync(self, gesture):
         yield token
     prompt = prompt[0]
     prompt = prompt.rstrip()
-    inputs = []
+    command = prompt
+    if len(captureSuffix) > 0 and command.endswith(captureSuffix):
+        command = command[:-len(captureSuffix)]
+    if getConfig("captureBackend") == CAPTURE_BACKEND_TMUX:
+        # Command runs in its own tmux window, so here we only erase it from the prompt.
+        yield from updatePrompt(wx.ID_CANCEL, "", None, prompt, self)
+        scheduler.run(captureTmuxAsync(self, command), name="capture")
+        return
     if not prompt.endswith(captureSuffix):
         d = getVkCodes()
-        inputs+= makeVkInput(d['end'])
-        inputs += makeUnicodeInput(captureSuffix)
-    inputs += makeVkInput([winUser.VK_RETURN])
-    with keyboardHandler.ignoreInjection():
-        winUser.SendInput(inputs)
-    captureStopFlag =False
+        sendInputs(getCachedVkInput(d['end']))
+        yield from sendInputsPaced(self, getCachedUnicodeInput(captureSuffix), verifyEcho=True)
+    sendInputs(getCachedVkInput(winUser.VK_RETURN))
 
-    executeAsynchronously(captureAsync(self, None))
+    scheduler.run(captureAsync(self, None, historyCommand=command), name="capture")
 
 def extractCurrentPrompt(obj, promptResult):
     # promptResult must be an empty list, where we will write the output
@@ -1013,14 +2308,13 @@ def extractCurrentPrompt(obj, promptResult):
         return
     d = getVkCodes()
 
-    inputs = []
-    inputs.extend(makeVkInput(d['end']))
-    inputs.extend(makeUnicodeInput(controlCharacter))
-    inputs.extend(makeVkInput(d['home']))
-    inputs.extend(makeUnicodeInput(controlCharacter))
+    inputs = InputBuilder()
+    inputs.add(getCachedVkInput(d['end']))
+    inputs.add(getCachedUnicodeInput(controlCharacter))
+    inputs.add(getCachedVkInput(d['home']))
+    inputs.add(getCachedUnicodeInput(controlCharacter))
     controlCharactersAtStart = 1
-    with keyboardHandler.ignoreInjection():
-        winUser.SendInput(inputs)
+    sendInputs(inputs)
 
     try:
         timeoutSeconds = 1
@@ -1047,11 +2341,10 @@ def extractCurrentPrompt(obj, promptResult):
             # So we print another control character in the beginning to shift everything again by one more character to be able to tell,
             # whetehr there is a space between first and second lines, or every pair of lines, or no space.
             # Note however, that it is impossible to figure out the number of spaces, therefore when multiple spaces are present, their count is not guaranteed to be preserved.
-            inputs = []
-            inputs.extend(makeVkInput(d['home']))
-            inputs.extend(makeUnicodeInput(controlCharacter))
-            with keyboardHandler.ignoreInjection():
-                winUser.SendInput(inputs)
+            inputs = InputBuilder()
+            inputs.add(getCachedVkInput(d['home']))
+            inputs.add(getCachedUnicodeInput(controlCharacter))
+            sendInputs(inputs)
             controlCharactersAtStart += 1
             timeoutSeconds = 1
             timeout = time.time() + timeoutSeconds
@@ -1071,74 +2364,79 @@ def extractCurrentPrompt(obj, promptResult):
                 raise Exception(f"Unexpected: encountered {len(indices)} control characters on second iteration in UIA mode!")
             text2 = text[indices[1] + 1 : indices[2]]
     finally:
-        inputs = []
-        inputs.extend(makeVkInput(d['home']))
+        inputs = InputBuilder()
+        inputs.add(getCachedVkInput(d['home']))
         for dummy in range(controlCharactersAtStart):
-            inputs.extend(makeVkInput(d['delete']))
-        inputs.extend(makeVkInput(d['end']))
-        inputs.extend(makeVkInput(d['backspace']))
-        with keyboardHandler.ignoreInjection():
-            winUser.SendInput(inputs)
+            inputs.add(getCachedVkInput(d['delete']))
+        inputs.add(getCachedVkInput(d['end']))
+        inputs.add(getCachedVkInput(d['backspace']))
+        sendInputs(inputs)
     if UIAMode:
         text1 = text1.replace("\n", "").replace("\r", "")
         text2 = text2.replace("\n", "").replace("\r", "")
-        # text1 and text2 should be mostly identical, with the only difference being spaces possibly injected in at certain positions. near the end of lines.
-        # Combine text1 and text2 into oldText while preserving those spaces.
-        result = []
-        n = len(text1)
-        m = len(text2)
-        i = j = 0
-        def reportMatchingProblem():
-            message = f"In UIA mode, error while matching text1 and text2. i={i}, j={j}, n={n}, m={m};\n{text1}\n{text2}"
-            raise Exception(message)
-        while True:
-            if i >= n and j >= m:
-                break
-            if i >= n:
-                if text2[j] == " ":
-                    result.append(" ")
-                    j += 1
-                    continue
-                else:
-                    reportMatchingProblem()
-            if j >= m:
-                if text1[i] == " ":
-                    result.append(" ")
-                    i += 1
-                    continue
-                else:
-                    reportMatchingProblem()
-            # now both i and j are within bounds
-            if text1[i] == text2[j]:
-                result.append(text1[i])
-                i += 1
+        oldText = mergeUIAPromptTexts(text1, text2)
+        if tracer.enabled:
+            mylog("text1 in UIA mode!:")
+            mylog(text1)
+            mylog("text2:")
+            mylog(text2)
+            mylog("oldText:")
+            mylog(oldText)
+    else:
+        oldText = text1.replace("\n", "").replace("\r", "")
+        if tracer.enabled:
+            mylog("text1:")
+            mylog(text1)
+            mylog("oldText:")
+            mylog(oldText)
+    promptResult.append(oldText)
+def mergeUIAPromptTexts(text1, text2):
+    """
+    In UIA mode prompt is retrieved twice, the second time shifted by one character.
+    text1 and text2 should be mostly identical, with the only difference being spaces possibly injected in at certain positions near the end of lines.
+    Combine text1 and text2 into a single string while preserving those spaces.
+    """
+    result = []
+    n = len(text1)
+    m = len(text2)
+    i = j = 0
+    def reportMatchingProblem():
+        message = f"In UIA mode, error while matching text1 and text2. i={i}, j={j}, n={n}, m={m};\n{text1}\n{text2}"
+        raise Exception(message)
+    while True:
+        if i >= n and j >= m:
+            break
+        if i >= n:
+            if text2[j] == " ":
+                result.append(" ")
                 j += 1
-            elif text1[i] == " ":
+                continue
+            else:
+                reportMatchingProblem()
+        if j >= m:
+            if text1[i] == " ":
                 result.append(" ")
                 i += 1
-            elif text2[j] == " ":
-                result.append(" ")
-                j += 1
+                continue
             else:
                 reportMatchingProblem()
-        result = "".join(result)
-        oldText = result
-        mylog(f"text1 in UIA mode!:")
-        mylog(f"{text1}")
-        mylog(f"text2:")
-        mylog(f"{text2}")
-        mylog(f"oldText:")
-        mylog(f"{oldText}")
-    else:
-        oldText = text1.replace("\n", "").replace("\r", "")
-        mylog(f"text1:")
-        mylog(f"{text1}")
-        mylog(f"oldText:")
-        mylog(f"{oldText}")
-    promptResult.append(oldText)
+        # now both i and j are within bounds
+        if text1[i] == text2[j]:
+            result.append(text1[i])
+            i += 1
+            j += 1
+        elif text1[i] == " ":
+            result.append(" ")
+            i += 1
+        elif text2[j] == " ":
+            result.append(" ")
+            j += 1
+        else:
+            reportMatchingProblem()
+    return "".join(result)
+
 def editPrompt(obj, gesture):
-    global captureStopFlag
-    captureStopFlag = True
+    scheduler.cancel("capture")
     prompt = []
     for token in extractCurrentPrompt(obj, prompt):
         yield token
@@ -1148,7 +2446,7 @@ def editPrompt(obj, gesture):
     suffix = getConfig("captureSuffix").rstrip()
     if oldText.endswith(suffix):
         oldText = oldText[:-len(suffix)]
-    onTextComplete = lambda result, newText, keystroke: executeAsynchronously(updatePrompt(result, newText, keystroke, oldText, obj))
+    onTextComplete = lambda result, newText, keystroke: scheduler.run(updatePrompt(result, newText, keystroke, oldText, obj), name="updatePrompt")
     popupEditTextDialog(oldText, onTextComplete)
 
 
@@ -1171,6 +2469,25 @@ def getControlVGesture():
         # vk code for V key is 86
         return keyboardHandler.KeyboardInputGesture(modifiers={(winUser.VK_CONTROL, False)}, vkCode=86, scanCode=0, isExtended=False)
 
+def computeMinimalEdit(oldText, newText):
+    """
+    Finds the shortest contiguous region of oldText that needs to be replaced in order to turn it into newText.
+    Returns a tuple (suffixLength, deleteCount, insertText):
+    suffixLength is the length of the common suffix, that is how many characters the cursor must be moved to the left from the end of the line;
+    deleteCount is the number of characters to be deleted before that point;
+    insertText is the text to be inserted instead.
+    """
+    n = min(len(oldText), len(newText))
+    prefixLength = 0
+    while prefixLength < n and oldText[prefixLength] == newText[prefixLength]:
+        prefixLength += 1
+    suffixLength = 0
+    while suffixLength < n - prefixLength and oldText[-1 - suffixLength] == newText[-1 - suffixLength]:
+        suffixLength += 1
+    deleteCount = len(oldText) - prefixLength - suffixLength
+    insertText = newText[prefixLength:len(newText) - suffixLength]
+    return suffixLength, deleteCount, insertText
+
 def updatePrompt(result, text, keystroke, oldText, obj):
     yield from waitUntilModifiersReleased()
     doCapture = False
@@ -1182,48 +2499,63 @@ def updatePrompt(result, text, keystroke, oldText, obj):
             modifiers == ["control"]
             and mainKeyName == "enter"
         ):
-            text += getConfig("captureSuffix")
+            if getConfig("captureBackend") == CAPTURE_BACKEND_TMUX:
+                # Command runs in its own tmux window, so here we only erase it from the prompt.
+                text = ""
+            else:
+                text += getConfig("captureSuffix")
             doCapture = True
 
     obj.setFocus()
     yield 10 # if we don't capture output, we need NVDA to see current screen, so that the updates will be spoken correctly
     method = getConfig("deletePromptMethod")
-    inputs = []
+    moveInputs = InputBuilder()
+    inputs = InputBuilder()
+    pasteText = text
     if method == DELETE_METHOD_CONTROL_C:
-        inputs.extend(makeVkInput([winUser.VK_LCONTROL, getVkLetter("C")]))
+        inputs.vk([winUser.VK_LCONTROL, getVkLetter("C")])
     elif method == DELETE_METHOD_ESCAPE:
-        inputs.extend(makeVkInput(winUser.VK_ESCAPE))
+        inputs.add(getCachedVkInput(winUser.VK_ESCAPE))
     elif method == DELETE_METHOD_CONTROL_K:
-        inputs.extend(makeVkInput([winUser.VK_LCONTROL, getVkLetter("A")]))
-        inputs.extend(makeVkInput([winUser.VK_LCONTROL, getVkLetter("K")]))
+        inputs.vk([winUser.VK_LCONTROL, getVkLetter("A")])
+        inputs.vk([winUser.VK_LCONTROL, getVkLetter("K")])
     elif method == DELETE_METHOD_BACKSPACE:
-        inputs.extend(makeVkInput(winUser.VK_END))
-        for dummy in range(len(oldText)):
-            inputs.extend(makeVkInput(winUser.VK_BACK))
+        # Only replace the part of the line that has actually changed:
+        # move cursor to the end of changed region, erase it and paste the new middle part.
+        suffixLength, deleteCount, pasteText = computeMinimalEdit(oldText, text)
+        moveInputs.add(getCachedVkInput((winUser.VK_END, True)))
+        for dummy in range(suffixLength):
+            moveInputs.add(getCachedVkInput((winUser.VK_LEFT, True)))
+        for dummy in range(deleteCount):
+            inputs.add(getCachedVkInput(winUser.VK_BACK))
     else:
         raise Exception(f"Unknown method {method}!")
+    # Cursor movements don't change console text, so we can only verify echo of deletions.
+    yield from sendInputsPaced(obj, moveInputs)
+    yield from sendInputsPaced(obj, inputs, verifyEcho=(method == DELETE_METHOD_BACKSPACE))
     isWindowsTerminal = getattr(obj, 'windowClassName', None) in TERMINAL_WINDOW_CLASSES
-    if isinstance(obj, PuttyControlV):
-        inputs.extend(makeVkInput([winUser.VK_SHIFT, (winUser.VK_INSERT, True)]))
-    elif isWindowsTerminal:
-        inputs.extend(makeVkInput([winUser.VK_LCONTROL, getVkLetter("V")]))
-    with BackupClipboard(text):
-        with keyboardHandler.ignoreInjection():
-            winUser.SendInput(inputs)
-        if isinstance(obj, ConsoleControlV):
-            pasteConsole(obj)
-        elif isinstance(obj, PuttyControlV):
-            pass
+    if len(pasteText) > 0:
+        inputs = InputBuilder()
+        if isinstance(obj, PuttyControlV):
+            inputs.add(getCachedVkInput(winUser.VK_SHIFT, (winUser.VK_INSERT, True)))
         elif isWindowsTerminal:
-            pass
-        else:
-            raise RuntimeError("Unknown terminal type!")
+            inputs.vk([winUser.VK_LCONTROL, getVkLetter("V")])
+        with BackupClipboard(pasteText):
+            sendInputs(inputs)
+            if isinstance(obj, ConsoleControlV):
+                pasteConsole(obj)
+            elif isinstance(obj, PuttyControlV):
+                pass
+            elif isWindowsTerminal:
+                pass
+            else:
+                raise RuntimeError("Unknown terminal type!")
 
-    if doCapture:
+    if doCapture and getConfig("captureBackend") == CAPTURE_BACKEND_TMUX:
+        scheduler.run(captureTmuxAsync(obj, rawCommand), name="capture")
+    elif doCapture:
         fromNameSmart("Enter").send()
-        global captureStopFlag
-        captureStopFlag = False
-        executeAsynchronously(captureAsync(obj, rawCommand))
+        scheduler.run(captureAsync(obj, rawCommand), name="capture")
     elif result == wx.ID_OK:
         keystroke.send()
 
@@ -1234,17 +2566,80 @@ allModifiers = [
     winUser.VK_RMENU, winUser.VK_LWIN, winUser.VK_RWIN,
 ]
 
+class ModifierTracker:
+    """
+    Tracks state of modifier keys via NVDA keyboard hook, so that we can wait for modifiers to be released without polling.
+    Raw key events arrive on the keyboard hook thread, so continuations are always scheduled on the main thread.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pressed = set()
+        self.waiters = []
+
+    def onRawKey(self, vkCode, scanCode, extended, pressed):
+        if vkCode not in allModifiers:
+            return True
+        with self.lock:
+            if pressed:
+                self.pressed.add(vkCode)
+            else:
+                self.pressed.discard(vkCode)
+            if len(self.pressed) > 0 or len(self.waiters) == 0:
+                return True
+            waiters = self.waiters
+            self.waiters = []
+        for waiter in waiters:
+            core.callLater(0, waiter)
+        return True
+
+    def anyPressed(self):
+        with self.lock:
+            return len(self.pressed) > 0
+
+    def waitForRelease(self, timeoutSeconds):
+        """
+        Returns a function to be yielded from a task.
+        It resumes the generator as soon as all the pressed modifiers are released, or once timeout has expired.
+        """
+        def wait(resume):
+            resumed = False
+            def resumeOnce():
+                nonlocal resumed
+                if resumed:
+                    return
+                resumed = True
+                resume()
+            with self.lock:
+                # Hook only tells us about transitions, so initial state is taken from getKeyState.
+                self.pressed = set(getPressedModifiers())
+                alreadyReleased = len(self.pressed) == 0
+                if not alreadyReleased:
+                    self.waiters.append(resumeOnce)
+            if alreadyReleased:
+                core.callLater(0, resumeOnce)
+            else:
+                core.callLater(int(timeoutSeconds * 1000), resumeOnce)
+        return wait
+
+modifierTracker = ModifierTracker()
+
+def getPressedModifiers():
+    return [
+        k
+        for k in allModifiers
+        if winUser.getKeyState(k) & 32768
+    ]
+
 def waitUntilModifiersReleased():
     timeoutSeconds = 5
-    timeout = time.time() + timeoutSeconds
-    while time.time() < timeout:
-        status = [
-            winUser.getKeyState(k) & 32768
-            for k in allModifiers
-        ]
-        if not any(status):
-            return
-        yield 10
+    if len(getPressedModifiers()) == 0:
+        return
+    yield modifierTracker.waitForRelease(timeoutSeconds)
+    if not modifierTracker.anyPressed():
+        return
+    # Keyboard hook might have missed some events, so check getKeyState before giving up.
+    if len(getPressedModifiers()) == 0:
+        return
     message = _("Timed out while waiting for modifiers to be released!")
     ui.message(message)
     raise Exception(message)
@@ -1254,88 +2649,565 @@ def injectKeystroke(hWnd, vkCode):
     # Alternative ways, such as WM_CHAR event, or using SendMessage can work in plain command prompt, but they don't appear to work in any falvours of ssh.
     # We don't use SendInput() function, since it can only send keystrokes to the active focused window,
     # and here we would like to be able to send keystrokes to console window regardless whether it is focused or not.
-    mylog(f"injectKeystroke({vkCode}, {hWnd})")
+    if tracer.enabled:
+        mylog(f"injectKeystroke({vkCode}, {hWnd})")
     WM_KEYDOWN                      =0x0100
     WM_KEYUP                        =0x0101
     winUser.PostMessage(hWnd, WM_KEYDOWN, vkCode, 1)
     winUser.PostMessage(hWnd, WM_KEYUP, vkCode, 1 | (1<<30) | (1<<31))
 
 captureBeeper = Beeper()
-captureStopFlag = False
-def captureAsync(obj, rawCommand):
-    timeoutSeconds = getConfig("captureTimeout")
-    timeout = time.time() + timeoutSeconds
+LESS_SCREEN_INCOMPLETE = 0
+LESS_SCREEN_PAGE = 1
+LESS_SCREEN_END = 2
+def parseLessScreen(lines):
+    """
+    Parses a screen of less output.
+    Returns a tuple of state and lines of output on this screen, excluding less prompt and "~" filler lines.
+    """
+    lastLine = lines[-1].rstrip()
+    if lastLine == "(END)":
+        index = len(lines) - 1
+        while index > 0 and lines[index - 1].rstrip() == "~":
+            index -= 1
+        return LESS_SCREEN_END, lines[:index]
+    elif lastLine == ":":
+        return LESS_SCREEN_PAGE, lines[:-1]
+    return LESS_SCREEN_INCOMPLETE, lines
+
+def readConsoleLinesAsync(obj):
+    if isinstance(obj, UIA):
+        # UIA text is retrieved in background thread, so that NVDA stays responsive on large buffers
+        text = yield runInThread(lambda: obj.makeTextInfo(textInfos.POSITION_ALL).text)
+        return text.split("\r\n")
+    else:
+        # Legacy winConsole support: whole screen is read at once instead of expanding every line separately.
+        textInfo = obj.makeTextInfo(textInfos.POSITION_ALL)
+        text = textInfo.text
+        if "\n" in text:
+            return [line.rstrip() for line in text.split("\n")]
+        lineStart, lineEnd = textInfo._getLineOffsets(0)
+        return splitFixedWidthText(text, lineEnd - lineStart)
+
+def callConsoleAsync(obj, func, *args):
+    """
+    To be used with yield from: calls func that reads console text.
+    UIA text is retrieved in background thread, so that NVDA stays responsive on large buffers.
+    Legacy console objects are only accessed from the main thread.
+    """
+    if isinstance(obj, UIA):
+        return (yield runInThread(func, *args))
+    return func(*args)
+
+def splitConsoleText(textInfo, text):
+    """
+    Splits text of textInfo into console lines.
+    Legacy console text has no line breaks, so it is split into rows of the width of console window.
+    Padding of rows is kept, since it cannot be told apart from trailing spaces, that are significant in prompts.
+    """
+    if isinstance(textInfo.obj, UIA) or "\n" in text:
+        return [line.rstrip("\r") for line in text.split("\n")]
+    lineStart, lineEnd = textInfo._getLineOffsets(0)
+    width = lineEnd - lineStart
+    if width <= 0:
+        return [text]
+    return [text[i:i + width] for i in range(0, len(text), width)]
+
+def splitFixedWidthText(text, width):
+    """
+    Legacy console text has no line breaks: every row is padded with spaces to the width of console window.
+    Returns rows with padding removed.
+    """
+    if width <= 0:
+        return [text.rstrip()]
+    return [text[i:i + width].rstrip() for i in range(0, len(text), width)]
+
+def captureLinesAsync(obj, timeout):
+    """
+    Pages through output of a command piped into less and returns all of its lines.
+    Quits less once the end of output has been reached.
+    """
     start = time.time()
     result = []
-    if rawCommand is not None:
-        result.append(f"$ {rawCommand}")
     previousLines = []
     previousLinesCounter = 0
-    captureBeeper.fancyBeep("CDGA", length=5000 * int(math.ceil(timeoutSeconds / 5)) , left=5, right=5)
-    try:
-        while time.time() < timeout:
-            t = time.time() - start
-            mylog(f"{t:0.3}")
-            if captureStopFlag:
-                ui.message(_("Capture interrupted!"))
-                return
-            textInfo = obj.makeTextInfo(textInfos.POSITION_ALL)
-            if isinstance(obj, UIA):
-                lines = textInfo.text.split("\r\n")
-            else:
-                # Legacy winConsole support
-                lines = list(textInfo.getTextInChunks(textInfos.UNIT_LINE))
-            if lines == previousLines:
+    while time.time() < timeout:
+        if tracer.enabled:
+            mylog(f"{time.time() - start:0.3}")
+        lines = yield from readConsoleLinesAsync(obj)
+        if lines == previousLines:
+            if tracer.enabled:
                 mylog(f"Screen hasn't changed! counter={previousLinesCounter}")
-                previousLinesCounter += 1
-                if previousLinesCounter < 10:
-                    yield 10
-                    continue
+            previousLinesCounter += 1
+            if previousLinesCounter < 10:
+                yield 10
+                continue
+            if tracer.enabled:
                 mylog("Current lines:")
                 for line in lines:
                     line = line.rstrip("\r\n")
                     mylog(f"    {line}")
-            previousLines = lines
-            previousLinesCounter = 0
-            lastLine = lines[-1].rstrip()
-            pageComplete = lastLine == ":"
-            fileComplete= lastLine == "(END)"
-            mylog(f"pageComplete={pageComplete} fileComplete={fileComplete}")
-            if fileComplete:
-                index = len(lines) - 1
-                while index > 0 and lines[index - 1].rstrip() == "~":
-                    index -= 1
-                lines = lines[:index]
-                result += lines
-                # Sending q letter to quit less command
-                #watchdog.cancellableSendMessage(obj.windowHandle, WM_CHAR, 0x71, 0)
-                injectKeystroke(obj.windowHandle, 0x51)
-                presentCaptureResult(result)
-                return
-            elif pageComplete:
-                result += lines[:-1]
-                # Sending space key:
-                #watchdog.cancellableSendMessage(obj.windowHandle, WM_CHAR, 0x20, 0)
-                injectKeystroke(obj.windowHandle, 0x20)
-            else:
-                yield 1
-    finally:
-        captureBeeper.stop()
+        previousLines = lines
+        previousLinesCounter = 0
+        state, lines = parseLessScreen(lines)
+        if tracer.enabled:
+            mylog(f"less screen state={state}")
+        if state == LESS_SCREEN_END:
+            result += lines
+            # Sending q letter to quit less command
+            #watchdog.cancellableSendMessage(obj.windowHandle, WM_CHAR, 0x71, 0)
+            injectKeystroke(obj.windowHandle, 0x51)
+            return result
+        elif state == LESS_SCREEN_PAGE:
+            result += lines
+            # Sending space key:
+            #watchdog.cancellableSendMessage(obj.windowHandle, WM_CHAR, 0x20, 0)
+            injectKeystroke(obj.windowHandle, 0x20)
+        else:
+            yield 1
+    message = _("Timed out while waiting for command output!")
+    ui.message(message)
+    raise Exception(message)
+
+def waitForLessExitAsync(obj, timeout):
+    """
+    After less has been told to quit, its last screen stays visible for a little while.
+    Waits until it is gone, so that it is not mistaken for output of the next command.
+    """
+    while time.time() < timeout:
+        lines = yield from readConsoleLinesAsync(obj)
+        state, lines = parseLessScreen(lines)
+        if state != LESS_SCREEN_END:
+            return
+        yield 10
     message = _("Timed out while waiting for command output!")
     ui.message(message)
     raise Exception(message)
 
+def captureAsync(obj, rawCommand, historyCommand=None):
+    timeoutSeconds = getCaptureTimeout()
+    result = []
+    if rawCommand is not None:
+        result.append(f"$ {rawCommand}")
+    captureBeeper.fancyBeep("CDGA", length=5000 * int(math.ceil(timeoutSeconds / 5)) , left=5, right=5)
+    try:
+        result += yield from captureLinesAsync(obj, time.time() + timeoutSeconds)
+    except GeneratorExit:
+        ui.message(_("Capture interrupted!"))
+        raise
+    finally:
+        captureBeeper.stop()
+    presentCaptureResult(result, command=historyCommand or rawCommand, obj=obj)
+
+# Reserved words that open compound commands, mapped to the words that close them
+SHELL_BLOCK_CLOSERS = {
+    "if": "fi",
+    "case": "esac",
+    "for": "done",
+    "select": "done",
+    "while": "done",
+    "until": "done",
+    "{": "}",
+}
+# Reserved words, after which a new command starts
+SHELL_COMMAND_KEYWORDS = {"if", "then", "elif", "else", "while", "until", "do", "{", "!", "time"}
+
+def splitCommands(commandLine):
+    """
+    Splits command line into separate commands on semicolons at the top level.
+    Semicolons that are quoted or escaped don't separate commands, and neither do semicolons
+    inside parentheses, command substitutions, braces and compound commands, such as for ... done or if ... fi.
+    Reserved words are only recognized at the beginning of a command, as in shell.
+    """
+    commands = []
+    current = []
+    quote = None
+    escaped = False
+    # Stack of words or characters that close currently open blocks
+    closers = []
+    word = []
+    wordQuoted = False
+    commandStart = True
+    for c in commandLine:
+        if escaped:
+            escaped = False
+            wordQuoted = True
+        elif c == "\\" and quote != "'":
+            escaped = True
+        elif quote is not None:
+            if c == quote:
+                quote = None
+        elif c in "'\"`":
+            quote = c
+            wordQuoted = True
+        elif c.isspace() or c in ";&|()":
+            if len(word) > 0 or wordQuoted:
+                text = "".join(word)
+                if commandStart and not wordQuoted:
+                    if text in SHELL_BLOCK_CLOSERS:
+                        closers.append(SHELL_BLOCK_CLOSERS[text])
+                    elif len(closers) > 0 and text == closers[-1]:
+                        closers.pop()
+                commandStart = not wordQuoted and text in SHELL_COMMAND_KEYWORDS
+                word = []
+                wordQuoted = False
+            if c == "(":
+                closers.append(")")
+            elif c == ")" and len(closers) > 0 and closers[-1] == ")":
+                # Otherwise this is the end of a pattern in case statement.
+                closers.pop()
+            elif c == ";" and len(closers) == 0:
+                commands.append("".join(current))
+                current = []
+                commandStart = True
+                continue
+            if not c.isspace():
+                commandStart = True
+        else:
+            word.append(c)
+        current.append(c)
+    commands.append("".join(current))
+    return [command.strip() for command in commands if len(command.strip()) > 0]
+
+def getCaptureTimeout():
+    # Zero timeout, that might have been saved by older versions, would make every capture fail at once.
+    return max(1, getConfig("captureTimeout"))
+
+def getCaptureBackend():
+    if getConfig("captureBackend") == CAPTURE_BACKEND_TMUX:
+        return TmuxCaptureBackend(getConfig("tmuxCommand"))
+    return None
+
+def captureCommandLinesAsync(obj, command, backend, timeoutSeconds):
+    """
+    Runs command, which must not be present at the prompt, and returns lines of its output.
+    Without tmux backend the command is typed into console and its output is paged through less.
+    """
+    import subprocess
+    if backend is not None:
+        try:
+            return (yield runInThread(backend.capture, command, timeoutSeconds))
+        except subprocess.TimeoutExpired:
+            message = _("Timed out while waiting for command output!")
+            ui.message(message)
+            raise Exception(message)
+    # Commands vary, so their inputs are not cached.
+    yield from sendInputsPaced(obj, makeUnicodeInput(command + getConfig("captureSuffix")), verifyEcho=True)
+    sendInputs(getCachedVkInput(winUser.VK_RETURN))
+    timeout = time.time() + timeoutSeconds
+    lines = yield from captureLinesAsync(obj, timeout)
+    yield from waitForLessExitAsync(obj, timeout)
+    return lines
+
+def captureBatchAsync(obj, commands):
+    """
+    Runs commands one after another and presents all their outputs as a single result,
+    with a section for every command.
+    """
+    timeoutSeconds = getCaptureTimeout()
+    backend = getCaptureBackend()
+    start = time.time()
+    result = []
+    captureBeeper.fancyBeep("CDGA", length=5000 * int(math.ceil(timeoutSeconds * len(commands) / 5)) , left=5, right=5)
+    try:
+        for command in commands:
+            if len(result) > 0:
+                result.append("")
+            result.append(f"$ {command}")
+            result += yield from captureCommandLinesAsync(obj, command, backend, timeoutSeconds)
+    except GeneratorExit:
+        ui.message(_("Capture interrupted!"))
+        raise
+    finally:
+        captureBeeper.stop()
+    message = _("Captured {count} commands in {seconds:.1f} seconds").format(count=len(commands), seconds=time.time() - start)
+    result += ["", message]
+    presentCaptureResult(result, command="; ".join(commands), obj=obj)
+    ui.message(message)
+
+isWatching = False
+# Windows whose new text must not be reported, since it is typed and paged through by the add-on itself.
+suppressedLiveTextWindows = set()
+def getWatchChanges(previousLines, lines):
+    """
+    Returns texts to be spoken for lines that have appeared in output of watched command,
+    followed by lines that have disappeared from it.
+    """
+    addedLines = calculateNewLines(previousLines, lines, partialLines=False)
+    removedLines = calculateNewLines(lines, previousLines, partialLines=False)
+    return (
+        [line for line in addedLines if len(line.strip()) > 0]
+        + [_("Removed {line}").format(line=line) for line in removedLines if len(line.strip()) > 0]
+    )
+
+def watchAsync(obj, command):
+    """
+    Re-runs command periodically and only speaks lines of its output that have appeared or disappeared since the previous run.
+    Outputs are compared line by line using hashes of lines.
+    Without tmux backend command is typed into console and paged through less,
+    so new text of console is not reported while a run is being captured.
+    """
+    global isWatching
+    timeoutSeconds = getCaptureTimeout()
+    backend = getCaptureBackend()
+    previousLines = None
+    isWatching = True
+    try:
+        while True:
+            if backend is None:
+                suppressedLiveTextWindows.add(obj.windowHandle)
+            try:
+                lines = yield from captureCommandLinesAsync(obj, command, backend, timeoutSeconds)
+            finally:
+                suppressedLiveTextWindows.discard(obj.windowHandle)
+            if previousLines is None:
+                ui.message(_("Watching {command}, {count} lines of output").format(command=command, count=len(lines)))
+            else:
+                changes = getWatchChanges(previousLines, lines)
+                if len(changes) > 0:
+                    ui.message("\n".join(changes))
+            previousLines = lines
+            yield getConfig("watchInterval") * 1000
+    except GeneratorExit:
+        ui.message(_("Stopped watching"))
+        raise
+    finally:
+        isWatching = False
+
+CAPTURE_BACKEND_LESS = 0
+CAPTURE_BACKEND_TMUX = 1
+captureBackendNames = [
+    _("less pager in current console"),
+    _("new tmux window"),
+]
+TMUX_HISTORY_LIMIT = 1000000
+
+class TmuxCaptureBackend:
+    """
+    Runs a command in a new detached tmux session and reads all of its output in a single capture-pane call,
+    instead of paging through it in less.
+    Every command gets its own session, so that history limit can be raised just for it without changing global options,
+    and the session is killed once output has been captured.
+    When the command finishes, it signals a wait-for channel and then waits for acknowledgement,
+    so that its window stays alive until its output has been captured.
+    It only talks to tmux via subprocess, so it works with any tmux server reachable from a command line,
+    such as wsl tmux on Windows or tmux on Linux.
+    """
+    channelCounter = 0
+
+    def __init__(self, tmuxCommand):
+        self.tmuxArgs = tmuxCommand.split()
+
+    def tmux(self, *args, timeout=None):
+        import subprocess
+        kwargs = {}
+        if os.name == "nt":
+            kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW
+        process = subprocess.run(self.tmuxArgs + list(args), capture_output=True, timeout=timeout, **kwargs)
+        if process.returncode != 0:
+            raise RuntimeError(f"tmux {args[0]} failed: {process.stderr.decode('utf-8', 'replace').strip()}")
+        return process.stdout.decode('utf-8', 'replace')
+
+    def capture(self, command, timeoutSeconds):
+        TmuxCaptureBackend.channelCounter += 1
+        channel = f"consoleToolkit-{os.getpid()}-{TmuxCaptureBackend.channelCounter}"
+        # Newline before closing brace terminates a possible trailing comment in the command.
+        shellCommand = f"{{ {command}\n}} 2>&1; tmux wait-for -S {channel}; tmux wait-for {channel}-ack"
+        directory = self.tmux("display-message", "-p", "#{pane_current_path}").strip()
+        # History limit only applies to panes created after it has been set,
+        # so command runs in the second window of the session.
+        paneId = self.tmux(
+            "new-session", "-d", "-s", channel, "-c", directory, ";",
+            "set-option", "-t", channel, "history-limit", str(TMUX_HISTORY_LIMIT), ";",
+            "new-window", "-d", "-P", "-F", "#{pane_id}", "-t", f"{channel}:", "-c", directory, shellCommand,
+        ).strip()
+        try:
+            self.tmux("wait-for", channel, timeout=timeoutSeconds)
+            output = self.tmux("capture-pane", "-p", "-J", "-S", "-", "-E", "-", "-t", paneId)
+            self.tmux("wait-for", "-S", f"{channel}-ack")
+        finally:
+            self.tmux("kill-session", "-t", channel)
+        lines = output.split("\n")
+        while len(lines) > 0 and len(lines[-1].strip()) == 0:
+            lines.pop()
+        return lines
+
+def captureTmuxAsync(obj, rawCommand):
+    import subprocess
+    timeoutSeconds = getCaptureTimeout()
+    backend = TmuxCaptureBackend(getConfig("tmuxCommand"))
+    captureBeeper.fancyBeep("CDGA", length=5000 * int(math.ceil(timeoutSeconds / 5)) , left=5, right=5)
+    try:
+        lines = yield runInThread(backend.capture, rawCommand, timeoutSeconds)
+    except GeneratorExit:
+        ui.message(_("Capture interrupted!"))
+        raise
+    except subprocess.TimeoutExpired:
+        message = _("Timed out while waiting for command output!")
+        ui.message(message)
+        raise Exception(message)
+    except (OSError, RuntimeError) as e:
+        ui.message(_("Failed to capture output via tmux: {error}").format(error=e))
+        raise
+    finally:
+        captureBeeper.stop()
+    presentCaptureResult([f"$ {rawCommand}"] + lines, command=rawCommand, obj=obj)
+
+FOLLOW_POLL_INTERVAL = 500 # millis
+FOLLOW_SPILL_MAX_SIZE = 50 * 1024 * 1024
+
+class FollowBuffer:
+    """
+    Keeps the most recent console lines in a ring of fixed size, so that memory stays bounded
+    no matter for how long the output is being followed.
+    Optionally all the lines are also appended to a spill file, which is rotated once it becomes too large.
+    """
+    def __init__(self, maxLines, spillFileName=None):
+        self.lines = collections.deque(maxlen=maxLines)
+        self.totalLines = 0
+        self.spillFileName = spillFileName
+        self.spillFile = None
+        if spillFileName is not None:
+            self.spillFile = open(spillFileName, "a", encoding="utf-8")
+
+    def append(self, lines):
+        self.lines.extend(lines)
+        self.totalLines += len(lines)
+        if self.spillFile is not None:
+            self.spillFile.writelines(line + "\n" for line in lines)
+            if self.spillFile.tell() > FOLLOW_SPILL_MAX_SIZE:
+                self.spillFile.close()
+                os.replace(self.spillFileName, self.spillFileName + ".1")
+                self.spillFile = open(self.spillFileName, "w", encoding="utf-8")
+
+    def snapshot(self):
+        return list(self.lines)
+
+    def close(self):
+        if self.spillFile is not None:
+            self.spillFile.close()
+            self.spillFile = None
+
+followBuffers = {}
+
+def getFollowTaskName(obj):
+    return f"follow{obj.windowHandle}"
+
+def readFollowedLines(obj, tracker):
+    """
+    Returns lines printed since the previous call, including lines that have already scrolled out of view in UIA consoles.
+    """
+    lastLine = tracker.lastStableLine
+    start, lines, stableLineCount, incremental = tracker.read(obj)
+    lines = [line.rstrip() for line in lines[:stableLineCount]]
+    if not incremental and lastLine is not None:
+        # Buffer has been scrolled, trimmed or cleared, so new lines start after the last occurrence of the last line read, if any.
+        lastLine = lastLine.rstrip()
+        for i in range(len(lines) - 1, -1, -1):
+            if lines[i] == lastLine:
+                return lines[i + 1:]
+    return lines
+
+def followAsync(obj, followBuffer):
+    """
+    Periodically reads text that has been printed to console since the previous poll and appends new lines to follow buffer until cancelled.
+    Polling doesn't depend on console being focused, so output keeps being collected in background.
+    Legacy consoles only expose the visible screen, so there lines that scroll out of view between two polls are lost.
+    """
+    tracker = ConsoleTextTracker()
+    try:
+        # The first read only primes the tracker, so that text printed before following has started is not collected.
+        yield from callConsoleAsync(obj, tracker.read, obj)
+        while True:
+            yield FOLLOW_POLL_INTERVAL
+            lines = yield from callConsoleAsync(obj, readFollowedLines, obj, tracker)
+            followBuffer.append([line for line in lines if len(line) > 0])
+    except Exception:
+        log.error("Console Toolkit: follow mode failed", exc_info=True)
+        ui.message(_("Stopped following console output"))
+    finally:
+        followBuffer.close()
+
+def toggleFollow(obj):
+    name = getFollowTaskName(obj)
+    if scheduler.cancel(name):
+        followBuffer = followBuffers[obj.windowHandle]
+        ui.message(_("Stopped following console output, {count} lines collected").format(count=followBuffer.totalLines))
+        return
+    spillFileName = None
+    if getConfig("followSpillFile"):
+        spillFileName = os.path.join(getFollowDirectory(), f"follow{obj.windowHandle}.log")
+    followBuffer = followBuffers[obj.windowHandle] = FollowBuffer(getConfig("followBufferLines"), spillFileName)
+    scheduler.run(followAsync(obj, followBuffer), name=name)
+    ui.message(_("Following console output"))
+
+def showFollowedOutput(obj):
+    followBuffer = followBuffers.get(obj.windowHandle)
+    if followBuffer is None:
+        ui.message(_("Console output is not being followed"))
+        return
+    # Ring is copied, so that following can go on while the copy is being presented.
+    presentCaptureResult(followBuffer.snapshot())
+
+EXPORT_CHUNK_LINES = 500
+
+def readScrollbackChunk(start, lineCount):
+    """
+    Reads up to lineCount lines starting at start text info.
+    Returns lines, text info positioned at the beginning of the next chunk and whether the end of buffer has been reached.
+    """
+    chunk = start.copy()
+    moved = chunk.move(textInfos.UNIT_LINE, lineCount, endPoint="end")
+    done = moved < lineCount
+    if done:
+        chunk.setEndPoint(start.obj.makeTextInfo(textInfos.POSITION_ALL), "endToEnd")
+    nextStart = chunk.copy()
+    nextStart.collapse(end=True)
+    text = chunk.text
+    lines = splitConsoleText(chunk, text)
+    if text.endswith("\n"):
+        # Line break of the last line of the chunk doesn't start a new line.
+        lines.pop()
+    return lines, nextStart, done
+
+def exportScrollbackAsync(obj):
+    """
+    Exports whole console buffer without running any command.
+    Buffer is read in chunks of lines and NVDA gets control back between chunks,
+    so that it stays responsive even with very long scrollback.
+    """
+    ui.message(_("Exporting console buffer"))
+    lines = []
+    start = obj.makeTextInfo(textInfos.POSITION_FIRST)
+    done = False
+    while not done:
+        chunkLines, start, done = yield from callConsoleAsync(obj, readScrollbackChunk, start, EXPORT_CHUNK_LINES)
+        lines += [line.rstrip() for line in chunkLines]
+        yield 0
+    while len(lines) > 0 and len(lines[-1]) == 0:
+        lines.pop()
+    presentCaptureResult(lines)
+
 CAPTURE_COPY_TO_CLIPBOARD = 0
 CAPTURE_OPEN_TEMP_WINDOW = 1
 CAPTION_OPEN_NOTEPAD = 2
 CAPTION_OPEN_NPP = 3
+CAPTURE_SAVE_TO_FILE = 4
 captureOpenOptionNames = [
     _("Copy to clipboard"),
     _("Open in temporary window"),
     _("Open in Notepad"),
     _("Open in Notepad++"),
+    _("Save to file"),
 ]
-def presentCaptureResult(lines):
+def presentCaptureResult(lines, command=None, obj=None):
+    """
+    Presents lines according to user's settings.
+    When command is specified, lines are also saved in capture history.
+    """
+    if command is not None and getConfig("historyEnabled"):
+        console = (obj.name or "") if obj is not None else ""
+        executeAsynchronously(saveCaptureHistoryAsync(list(lines), command, console))
     output = "\r\n".join(lines)
     option = getConfig("captureOpenOption")
     if option == CAPTURE_COPY_TO_CLIPBOARD:
@@ -1347,54 +3219,277 @@ def presentCaptureResult(lines):
         result = d.Show()
         gui.mainFrame.postPopup()
     elif option in [CAPTION_OPEN_NOTEPAD, CAPTION_OPEN_NPP]:
+        import subprocess
+        import tempfile
         # Prepare temp file
-        tf = tempfile.NamedTemporaryFile(delete=False, prefix="temp_")
+        tf = tempfile.NamedTemporaryFile(delete=False, dir=getTempDirectory(), prefix="capture_", suffix=".txt")
         tf.write(output.encode('utf-8'))
         tf.close()
         if option == CAPTION_OPEN_NOTEPAD:
             subprocess.Popen(f"""notepad "{tf.name}" """)
         elif option ==         CAPTION_OPEN_NPP:
             os.system(f"""notepad++ "{tf.name}" """)
+    elif option == CAPTURE_SAVE_TO_FILE:
+        gui.mainFrame.prePopup()
+        with wx.FileDialog(
+            gui.mainFrame,
+            _("Save console output"),
+            wildcard=_("Text files (*.txt)|*.txt|All files (*.*)|*.*"),
+            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT,
+        ) as d:
+            result = d.ShowModal()
+            fileName = d.GetPath()
+        gui.mainFrame.postPopup()
+        if result == wx.ID_OK:
+            # Lines are already joined with CRLF, so newline translation is disabled.
+            with open(fileName, "w", encoding="utf-8", newline="") as f:
+                f.write(output)
+            ui.message(_("Console output saved"))
     else:
         raise Exception(f"Unknown option {option}")
 
+def getTempDirectory():
+    """
+    Temporary files of the add-on live in their own directory, so that they can be cleaned up.
+    """
+    import tempfile
+    directory = os.path.join(tempfile.gettempdir(), "consoleToolkit")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def getFollowDirectory():
+    """
+    Spill files of follow mode are kept across NVDA restarts,
+    so they live in a separate directory, that is not cleaned up together with temporary files.
+    """
+    import tempfile
+    directory = os.path.join(tempfile.gettempdir(), "consoleToolkitFollow")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def cleanupTempFiles():
+    directory = getTempDirectory()
+    for fileName in os.listdir(directory):
+        try:
+            os.remove(os.path.join(directory, fileName))
+        except OSError:
+            # File might still be open, it will be deleted next time.
+            pass
+
+HISTORY_DIRECTORY_NAME = "consoleToolkitHistory"
+
+class CaptureHistory:
+    """
+    Persistent store of captured outputs.
+    Every entry is compressed with zlib and saved in its own file. A small JSON index keeps command, console,
+    timestamp and size of every entry in chronological order, so that history can be listed and searched
+    without reading the entries themselves.
+    Oldest entries are evicted once they exceed maximum age, or once total size of entries exceeds the limit.
+    """
+    INDEX_FILE_NAME = "index.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        # Loaded lazily, so that NVDA startup doesn't wait for disk.
+        self.entries = None
+
+    def _load(self):
+        import json
+        if self.entries is not None:
+            return
+        try:
+            with open(os.path.join(self.directory, self.INDEX_FILE_NAME), "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = []
+
+    def _save(self):
+        import json
+        fileName = os.path.join(self.directory, self.INDEX_FILE_NAME)
+        with open(fileName + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(fileName + ".tmp", fileName)
+
+    def add(self, lines, command, console, maxSize, maxAge):
+        import zlib
+        data = zlib.compress("\n".join(lines).encode("utf-8"))
+        with self.lock:
+            self._load()
+            os.makedirs(self.directory, exist_ok=True)
+            timestamp = time.time()
+            counter = int(timestamp * 1000)
+            while os.path.exists(os.path.join(self.directory, f"{counter}.z")):
+                counter += 1
+            fileName = f"{counter}.z"
+            with open(os.path.join(self.directory, fileName), "wb") as f:
+                f.write(data)
+            self.entries.append({
+                "file": fileName,
+                "command": command,
+                "console": console,
+                "timestamp": timestamp,
+                "size": len(data),
+                "lines": len(lines),
+            })
+            self._evict(maxSize, maxAge)
+            self._save()
+
+    def _evict(self, maxSize, maxAge):
+        threshold = time.time() - maxAge
+        totalSize = sum(entry["size"] for entry in self.entries)
+        # Entries are in chronological order, so the oldest ones are evicted first. The newest entry is always kept.
+        evictCount = 0
+        while evictCount < len(self.entries) - 1:
+            entry = self.entries[evictCount]
+            if entry["timestamp"] >= threshold and totalSize <= maxSize:
+                break
+            totalSize -= entry["size"]
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except OSError:
+                pass
+            evictCount += 1
+        del self.entries[:evictCount]
+
+    def find(self, command=None, console=None):
+        """
+        Returns matching entries, the newest first.
+        """
+        with self.lock:
+            self._load()
+            return [
+                entry
+                for entry in reversed(self.entries)
+                if (command is None or entry["command"] == command)
+                and (console is None or entry["console"] == console)
+            ]
+
+    def read(self, entry):
+        import zlib
+        with open(os.path.join(self.directory, entry["file"]), "rb") as f:
+            return zlib.decompress(f.read()).decode("utf-8").split("\n")
+
+captureHistory = CaptureHistory(os.path.join(globalVars.appArgs.configPath, HISTORY_DIRECTORY_NAME))
+
+def saveCaptureHistoryAsync(lines, command, console):
+    maxSize = getConfig("historyMaxSize") * 1024 * 1024
+    maxAge = getConfig("historyMaxAge") * 24 * 3600
+    # Compression and disk writes happen in background thread.
+    yield runInThread(captureHistory.add, lines, command, console, maxSize, maxAge)
+
+def chooseCaptureHistoryEntry(choices, resume):
+    """
+    Shows list of captured outputs and resumes task with index of the chosen one, or None if the dialog has been cancelled.
+    """
+    def showDialog():
+        gui.mainFrame.prePopup()
+        try:
+            with wx.SingleChoiceDialog(gui.mainFrame, _("Choose captured output to open"), _("Capture history"), choices) as d:
+                result = d.ShowModal()
+                selection = d.GetSelection()
+        finally:
+            gui.mainFrame.postPopup()
+        resume(selection if result == wx.ID_OK else None)
+    # Dialog runs its own event loop, so it is shown outside of task step, and other tasks keep running while it is open.
+    wx.CallAfter(showDialog)
+
+def showCaptureHistoryAsync():
+    entries = yield runInThread(captureHistory.find)
+    if len(entries) == 0:
+        if not getConfig("historyEnabled"):
+            ui.message(_("Capture history is disabled, it can be enabled in Console Toolkit settings"))
+        else:
+            ui.message(_("Capture history is empty"))
+        return
+    choices = [
+        f"{entry['command']} - {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['timestamp']))} - {entry['console']}"
+        for entry in entries
+    ]
+    selection = yield functools.partial(chooseCaptureHistoryEntry, choices)
+    if selection is None:
+        return
+    lines = yield runInThread(captureHistory.read, entries[selection])
+    presentCaptureResult(lines)
+
+CARET_FILTER_WINDOW_CLASSES = ['ConsoleWindowClass', 'Windows.UI.Input.InputSite.WindowClass']
+CARET_DEBOUNCE_DELAY = 30 # millis
 originalHandleCaretMove = None
-lastObj = None
-lastInfo = None
+lastCaretKey = None
+pendingCaretMove = None
+caretBurstActive = False
+
+def getCaretKey(obj):
+    """
+    Returns a key identifying caret position in console window, or None if caret cannot be retrieved.
+    Legacy console text infos expose caret offset directly, so the key is just a pair of numbers.
+    UIA text infos don't have offsets, so the text info itself is kept and compared by its endpoints.
+    """
+    try:
+        info = obj.makeTextInfo(textInfos.POSITION_CARET)
+    except (NotImplementedError, RuntimeError, LookupError):
+        return None
+    offset = getattr(info, '_startOffset', None)
+    if offset is not None:
+        return (obj.windowHandle, offset)
+    return (obj.windowHandle, info)
+
+def handleCaretMove(obj):
+    global lastCaretKey
+    key = getCaretKey(obj)
+    if key is not None and key == lastCaretKey:
+        # Caret hasn't actually moved - skip this event.
+        return
+    lastCaretKey = key
+    return originalHandleCaretMove(obj)
+
 def newHandleCaretMove(pos):
-    global lastObj, lastInfo
-    if getConfig("overrideRepeatedReview") and config.conf['reviewCursor']['followCaret']:
-        if not isinstance(pos,textInfos.TextInfo):
-            obj=pos
-            if isinstance(obj,NVDAObjects.NVDAObject):
-                if obj.windowClassName in  ['ConsoleWindowClass', 'Windows.UI.Input.InputSite.WindowClass']:
-                    try:
-                        info=obj.makeTextInfo(textInfos.POSITION_CARET)
-                    except (NotImplementedError,RuntimeError):
-                        info = None
-                    
-                    if obj == lastObj:
-                        if info==lastInfo:
-                            # Skip this!
-                            return
-                    lastObj = obj
-                    lastInfo = info
-                    
-    return originalHandleCaretMove(pos)
+    global pendingCaretMove, caretBurstActive
+    if (
+        isinstance(pos, textInfos.TextInfo)
+        or not configSnapshot.overrideRepeatedReview
+        or not config.conf['reviewCursor']['followCaret']
+        or getattr(pos, 'windowClassName', None) not in CARET_FILTER_WINDOW_CLASSES
+    ):
+        return originalHandleCaretMove(pos)
+    if caretBurstActive:
+        # Further events of a burst, e.g. while typing or while console is redrawing,
+        # are coalesced into a single update at the end of debounce interval.
+        pendingCaretMove = pos
+        return
+    # The first event of a burst is handled at once, so that review cursor follows single caret moves without delay.
+    caretBurstActive = True
+    core.callLater(CARET_DEBOUNCE_DELAY, flushCaretMove)
+    return handleCaretMove(pos)
+
+def flushCaretMove():
+    global pendingCaretMove, caretBurstActive
+    obj = pendingCaretMove
+    pendingCaretMove = None
+    if obj is None:
+        # No events have arrived during debounce interval, so the burst is over.
+        caretBurstActive = False
+        return
+    core.callLater(CARET_DEBOUNCE_DELAY, flushCaretMove)
+    handleCaretMove(obj)
 
 
 class GlobalPlugin(globalPluginHandler.GlobalPlugin):
     scriptCategory = _("Console toolkit")
 
     def __init__(self, *args, **kwargs):
+        startTime = time.perf_counter()
         super(GlobalPlugin, self).__init__(*args, **kwargs)
         self.createMenu()
         self.injectHooks()
-        self.lastConsoleUpdateTime = 0
-        self.beeper = Beeper()
+        config.post_configProfileSwitch.register(updateConfigSnapshot)
+        config.post_configReset.register(updateConfigSnapshot)
+        # Leftovers from previous sessions are removed in background, so that NVDA startup is not delayed.
+        threading.Thread(target=cleanupTempFiles, daemon=True).start()
+        log.debug(f"Console Toolkit global plugin initialized in {(time.perf_counter() - startTime) * 1000:.1f} ms")
 
     def chooseNVDAObjectOverlayClasses(self, obj, clsList):
-        if getConfig("controlVInConsole"):
+        if configSnapshot.controlVInConsole:
             window_class_name = getattr(obj, 'windowClassName', None)
             if window_class_name == 'ConsoleWindowClass':
                 clsList.insert(0, ConsoleControlV)
@@ -1411,22 +3506,32 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 
 
     def terminate(self):
+        config.post_configProfileSwitch.unregister(updateConfigSnapshot)
+        config.post_configReset.unregister(updateConfigSnapshot)
+        scheduler.cancelAll()
+        promptIndexes.clear()
+        followBuffers.clear()
+        tracer.stop()
+        cleanupTempFiles()
         self.removeHooks()
         gui.settingsDialogs.NVDASettingsDialog.categoryClasses.remove(SettingsDialog)
 
     def injectHooks(self):
-        global originalReportNewText, originalCancelSpeech, originalTerminalGainFocus, originalNVDAObjectFfocusEntered, originalReview_top
+        global originalReportNewText, originalCalculateNewText, originalCancelSpeech, originalTerminalGainFocus, originalNVDAObjectFfocusEntered, originalReview_top, originalHandleCaretMove
         originalReportNewText = behaviors.LiveText._reportNewText
-        behaviors.LiveText._reportNewText = newReportConsoleText
+        behaviors.LiveText._reportNewText = stallProfiler.wrap("newReportConsoleText", newReportConsoleText)
+        # This one runs on LiveText monitor thread, so it is not profiled.
+        originalCalculateNewText = behaviors.LiveText._calculateNewText
+        behaviors.LiveText._calculateNewText = newCalculateNewText
         originalCancelSpeech = speech.speech.cancelSpeech
-        speech.speech.cancelSpeech = newCancelSpeech
+        speech.speech.cancelSpeech = stallProfiler.wrap("newCancelSpeech", newCancelSpeech)
         speech.cancelSpeech = speech.speech.cancelSpeech
         # Apparently we need to monkey patch in two places to avoid terminal title being spoken when we switch to it from edit prompt window.
         # behaviors.Terminal.event_gainFocus is needed for both legacy and UIA implementation,
         # but in legacy it speaks window title, while in UIA mode it speaks current line in the terminal
         # NVDAObject.event_focusEntered speaks window title in UIA mode.
         originalTerminalGainFocus = behaviors.Terminal.event_gainFocus
-        behaviors.Terminal.event_gainFocus = terminalGainFocus
+        behaviors.Terminal.event_gainFocus = stallProfiler.wrap("terminalGainFocus", terminalGainFocus)
         originalNVDAObjectFfocusEntered = NVDAObject.event_focusEntered
         NVDAObject.event_focusEntered = nvdaObjectFfocusEntered
         behaviors.Terminal.script_editPrompt = script_editPrompt
@@ -1437,14 +3542,38 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
             behaviors.Terminal._Terminal__gestures = {}
         behaviors.Terminal._Terminal__gestures["kb:NVDA+E"] = "editPrompt"
         behaviors.Terminal._Terminal__gestures["kb:Control+Enter"] = "captureOutput"
+        behaviors.Terminal.script_captureBatch = script_captureBatch
+        behaviors.Terminal._Terminal__gestures["kb:Control+Shift+Enter"] = "captureBatch"
+        behaviors.Terminal.script_toggleFollow = script_toggleFollow
+        behaviors.Terminal.script_showFollowedOutput = script_showFollowedOutput
+        behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+F"] = "toggleFollow"
+        behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+V"] = "showFollowedOutput"
+        behaviors.Terminal.script_exportScrollback = script_exportScrollback
+        behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+B"] = "exportScrollback"
+        behaviors.Terminal.script_toggleWatch = script_toggleWatch
+        behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+W"] = "toggleWatch"
+        behaviors.Terminal.script_showCaptureHistory = script_showCaptureHistory
+        behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+H"] = "showCaptureHistory"
+        behaviors.Terminal.script_previousPrompt = script_previousPrompt
+        behaviors.Terminal.script_nextPrompt = script_nextPrompt
+        behaviors.Terminal.script_commandOutput = script_commandOutput
+        behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+UpArrow"] = "previousPrompt"
+        behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+DownArrow"] = "nextPrompt"
+        behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+O"] = "commandOutput"
       # global commands review top
         originalReview_top = globalCommands.commands.script_review_top
-        globalCommands.commands.script_review_top = myReview_top
+        globalCommands.commands.script_review_top = stallProfiler.wrap("myReview_top", myReview_top)
         globalCommands.commands._gestureMap['kb:numpad7+shift'] = globalCommands.commands.script_review_top
         globalCommands.commands._gestureMap['kb(laptop):control+home+nvda'] = globalCommands.commands.script_review_top
+        inputCore.decide_handleRawKey.register(modifierTracker.onRawKey)
+        originalHandleCaretMove = review.handleCaretMove
+        review.handleCaretMove = stallProfiler.wrap("newHandleCaretMove", newHandleCaretMove)
 
     def  removeHooks(self):
+        inputCore.decide_handleRawKey.unregister(modifierTracker.onRawKey)
+        review.handleCaretMove = originalHandleCaretMove
         behaviors.LiveText._reportNewText = originalReportNewText
+        behaviors.LiveText._calculateNewText = originalCalculateNewText
         speech.speech.cancelSpeech = originalCancelSpeech
         speech.cancelSpeech = speech.speech.cancelSpeech
         behaviors.Terminal.event_gainFocus = originalTerminalGainFocus
@@ -1453,29 +3582,36 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
         del behaviors.Terminal.script_captureOutput
         del behaviors.Terminal._Terminal__gestures["kb:NVDA+E"]
         del behaviors.Terminal._Terminal__gestures["kb:Control+Enter"]
+        del behaviors.Terminal.script_captureBatch
+        del behaviors.Terminal._Terminal__gestures["kb:Control+Shift+Enter"]
+        del behaviors.Terminal.script_toggleFollow
+        del behaviors.Terminal.script_showFollowedOutput
+        del behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+F"]
+        del behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+V"]
+        del behaviors.Terminal.script_exportScrollback
+        del behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+B"]
+        del behaviors.Terminal.script_toggleWatch
+        del behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+W"]
+        del behaviors.Terminal.script_showCaptureHistory
+        del behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+H"]
+        del behaviors.Terminal.script_previousPrompt
+        del behaviors.Terminal.script_nextPrompt
+        del behaviors.Terminal.script_commandOutput
+        del behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+UpArrow"]
+        del behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+DownArrow"]
+        del behaviors.Terminal._Terminal__gestures["kb:NVDA+Alt+O"]
         globalCommands.commands.script_review_top = originalReview_top
         globalCommands.commands._gestureMap['kb:numpad7+shift'] = globalCommands.commands.script_review_top
         globalCommands.commands._gestureMap['kb(laptop):control+home+nvda'] = globalCommands.commands.script_review_top
 
-    def preCalculateNewText(self, selfself, *args, **kwargs):
-        oldLines = args[1]
-        newLines = args[0]
-        if oldLines == newLines:
-            return []
-        outLines =   self.originalCalculateNewText(selfself, *args, **kwargs)
-        return outLines
-        if len(outLines) == 1 and len(outLines[0].strip()) == 1:
-            # Only a single character has changed - in this case NVDA thinks that's a typed character, so it is not spoken anyway. Con't interfere.
-            return outLines
-        if len(outLines) == 0:
-            return outLines
-        if getConfig("consoleBeep"):
-            tones.beep(100, 5)
-        if getConfig("consoleRealtime"):
-            #if time.time() > self.lastConsoleUpdateTime + 0.5:
-                #self.lastConsoleUpdateTime = time.time()
-            speech.cancelSpeech()
-        return outLines
+    @script(description=_("Report main thread profile of Console Toolkit to NVDA log"))
+    def script_dumpStallProfile(self, gesture):
+        if not stallProfiler.enabled:
+            ui.message(_("Profiling is disabled in Console Toolkit settings"))
+            return
+        report, nRecords, nStalls = stallProfiler.getReport()
+        log.info(report)
+        ui.message(_("Profile with {records} records and {stalls} stalls written to NVDA log").format(records=nRecords, stalls=nStalls))
 
 
 class ConsoleControlV(NVDAObject):
@@ -1509,10 +3645,10 @@ class TmuxWindowSwitcher(NVDAObject):
         self.switchToTmuxWindowSync(gesture)
 
     def switchToTmuxWindowSync(self, gesture):
-        inputs = []
-        inputs.extend(makeVkInput([winUser.VK_LCONTROL, getVkLetter("B")]))
-        inputs.extend(makeVkInput([getVkLetter(gesture.mainKeyName)]))
-        with keyboardHandler.ignoreInjection():
-            winUser.SendInput(inputs)
+        inputs = InputBuilder()
+        inputs.vk([winUser.VK_LCONTROL, getVkLetter("B")])
+        inputs.vk([getVkLetter(gesture.mainKeyName)])
+        sendInputs(inputs)
         tones.beep(100, 20, 20, 20)
 
+log.debug(f"Console Toolkit module loaded in {(time.perf_counter() - _loadStartTime) * 1000:.1f} ms")
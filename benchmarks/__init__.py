@@ -0,0 +1,8 @@
+"""
+Benchmarks of Console Toolkit that run without NVDA.
+NVDA modules are replaced with stubs from nvdaStubs, so that consoleToolkit can be imported on any platform.
+Run them from the root of the repository with: python -m benchmarks
+"""
+
+# Stubs must be installed before any NVDA module is imported by benchmarks.
+from . import nvdaStubs
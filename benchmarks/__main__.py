@@ -0,0 +1,39 @@
+import json
+import os
+import platform
+import sys
+import time
+
+from . import captureHistory, diffEngine, follow, harness, hotPaths, reviewNavigation, scrollback, startup, tmuxBackend
+
+RESULTS_FILE_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.json")
+MAX_RUNS = 50
+suites = [startup, hotPaths, diffEngine, reviewNavigation, follow, scrollback, captureHistory, tmuxBackend]
+
+def main():
+    sys.path.insert(0, harness.REPOSITORY_DIRECTORY)
+    import buildVars
+    results = {}
+    for suite in suites:
+        for benchmark in suite.benchmarks:
+            print(f"{benchmark.__name__}...", flush=True)
+            for name, stats in benchmark().items():
+                print(f"    {name}: {stats['medianUs']} us")
+                results[name] = stats
+    try:
+        with open(RESULTS_FILE_NAME, "r", encoding="utf-8") as f:
+            runs = json.load(f)
+    except (OSError, ValueError):
+        runs = []
+    runs.append({
+        "version": buildVars.addon_info["addon_version"],
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": results,
+    })
+    with open(RESULTS_FILE_NAME, "w", encoding="utf-8") as f:
+        json.dump(runs[-MAX_RUNS:], f, indent=2)
+    print(f"Results saved to {RESULTS_FILE_NAME}")
+
+main()
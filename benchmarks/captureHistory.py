@@ -0,0 +1,55 @@
+"""
+Checks of capture history against a history directory inside temporary NVDA configuration folder of the stubs.
+"""
+
+import api
+import wx
+
+from .harness import check, checkEqual, consoleToolkit as ct, runTask
+
+class FakeChoiceDialog:
+    """
+    Chooses the given entry or cancels, and records whether some task step was running while the dialog was shown.
+    """
+    selection = None
+    shownDuringTaskStep = []
+
+    def __init__(self, parent, message, caption, choices):
+        self.choices = choices
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def ShowModal(self):
+        FakeChoiceDialog.shownDuringTaskStep.append(any(task.running for task in ct.scheduler.tasks.values()))
+        return wx.ID_CANCEL if self.selection is None else wx.ID_OK
+
+    def GetSelection(self):
+        return self.selection
+
+def chooseHistoryEntry(selection):
+    FakeChoiceDialog.selection = selection
+    api.clipboard = None
+    runTask(ct.showCaptureHistoryAsync(), name="captureHistory")
+    return api.clipboard
+
+def benchmarkCaptureHistory():
+    originalDialog = wx.SingleChoiceDialog
+    wx.SingleChoiceDialog = FakeChoiceDialog
+    try:
+        for i in range(3):
+            ct.captureHistory.add([f"output {j} of command {i}" for j in range(3)], f"command {i}", "console", 1024 * 1024, 3600)
+        # The newest entry is listed first.
+        checkEqual(chooseHistoryEntry(1), "\r\n".join(f"output {j} of command 1" for j in range(3)), "Opened history entry")
+        checkEqual(chooseHistoryEntry(None), None, "Output presented when history dialog is cancelled")
+        checkEqual(FakeChoiceDialog.shownDuringTaskStep, [False, False], "History dialog shown during task step")
+    finally:
+        wx.SingleChoiceDialog = originalDialog
+    return {}
+
+benchmarks = [
+    benchmarkCaptureHistory,
+]
@@ -0,0 +1,162 @@
+"""
+Benchmarks and regression checks of the incremental line diff engine.
+Pairs of screens in screens folder have been recorded from a real terminal with tmux capture-pane;
+they are diffed and compared with expected new lines.
+Myers backtracking and rolling hash scroll detection are checked against straightforward oracles on random screens.
+"""
+
+import glob
+import json
+import os
+import random
+
+from .harness import check, checkEqual, consoleToolkit as ct, measure
+
+SCREENS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "screens")
+RANDOM_SEED = 20240601
+RANDOM_TRIALS = 2000
+
+def loadScreens():
+    result = {}
+    for fileName in sorted(glob.glob(os.path.join(SCREENS_DIRECTORY, "*.json"))):
+        with open(fileName, "r", encoding="utf-8") as f:
+            result[os.path.splitext(os.path.basename(fileName))[0]] = json.load(f)
+    return result
+
+def benchmarkRecordedScreens():
+    results = {}
+    recordedScreens = loadScreens()
+    for name, screens in recordedScreens.items():
+        old = screens["old"]
+        new = screens["new"]
+        stats, newLines = measure(lambda: ct.calculateNewLines(old, new), 1000)
+        checkEqual(newLines, screens["expectedNewLines"], f"New lines of {name} screen")
+        results[f"calculateNewLines {name}"] = stats
+    # After scrolling, the unchanged lines must be aligned by scroll detection rather than by Myers diff.
+    scroll = recordedScreens["scroll"]
+    checkEqual(ct.detectScroll(ct.hashLines(scroll["old"]), ct.hashLines(scroll["new"])), 13, "Scroll of recorded screen")
+    return results
+
+def benchmarkLargeScroll():
+    old = [f"{i:5} some output line of the console" for i in range(3000)]
+    appended = [f"{i:5} new line" for i in range(100)]
+    new = old[100:] + appended
+    stats, newLines = measure(lambda: ct.calculateNewLines(old, new), 20)
+    checkEqual(newLines, appended, "New lines of scrolled buffer")
+    return {"calculateNewLines large scroll": stats}
+
+def lcsLength(a, b):
+    # Textbook dynamic programming, used as an oracle.
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+def isSubsequence(items, sequence):
+    iterator = iter(sequence)
+    return all(item in iterator for item in items)
+
+def naiveScroll(old, new):
+    w = min(ct.SCROLL_ANCHOR_LINES, len(old), len(new))
+    if w == 0 or old[:w] == new[:w]:
+        return 0
+    bestScroll = 0
+    bestLength = 0
+    for scroll in range(len(old) - w + 1):
+        if old[scroll:scroll + w] != new[:w]:
+            continue
+        length = 0
+        while scroll + length < len(old) and length < len(new) and old[scroll + length] == new[length]:
+            length += 1
+        if length > bestLength:
+            bestScroll = scroll
+            bestLength = length
+    return bestScroll
+
+def randomScreen(rng, alphabet, maxLength):
+    return [rng.choice(alphabet) for dummy in range(rng.randint(0, maxLength))]
+
+def randomScreenPair(rng):
+    # Small alphabets make repeated lines common, which is where backtracking and scroll detection are easy to get wrong.
+    alphabet = [f"line {i}" for i in range(rng.choice([2, 3, 5, 20]))]
+    old = randomScreen(rng, alphabet, 30)
+    kind = rng.randrange(3)
+    if kind == 0:
+        new = randomScreen(rng, alphabet, 30)
+    elif kind == 1:
+        # Scrolled screen with a few new lines at the bottom
+        scroll = rng.randint(0, len(old))
+        new = old[scroll:] + randomScreen(rng, alphabet, 5)
+    else:
+        # Redrawn screen with a few lines replaced
+        new = [line if rng.random() < 0.8 else rng.choice(alphabet) for line in old]
+    return old, new
+
+def checkMyersAgainstOracle():
+    rng = random.Random(RANDOM_SEED)
+    for trial in range(RANDOM_TRIALS):
+        a, b = randomScreenPair(rng)
+        lcs = lcsLength(a, b)
+        editDistance = len(a) + len(b) - 2 * lcs
+        matched = ct.myersMatchedIndices(a, b, editDistance)
+        check(matched is not None, f"Myers diff must succeed with maxD equal to edit distance: {a} {b}")
+        checkEqual(len(matched), lcs, f"Matched lines of {a} and {b} must form the longest common subsequence")
+        check(all(0 <= i < len(b) for i in matched), f"Matched indices out of range: {a} {b}")
+        check(isSubsequence([b[i] for i in sorted(matched)], a), f"Matched lines of {a} and {b} must be a common subsequence")
+        if editDistance > 0:
+            checkEqual(ct.myersMatchedIndices(a, b, editDistance - 1), None, f"Myers diff must give up below edit distance: {a} {b}")
+
+def checkScrollDetectionAgainstOracle():
+    rng = random.Random(RANDOM_SEED)
+    for trial in range(RANDOM_TRIALS):
+        old, new = randomScreenPair(rng)
+        oldHashes = ct.hashLines(old)
+        newHashes = ct.hashLines(new)
+        checkEqual(ct.detectScroll(oldHashes, newHashes), naiveScroll(oldHashes, newHashes), f"Scroll of {old} to {new}")
+
+def checkNewLinesAgainstOracle():
+    rng = random.Random(RANDOM_SEED)
+    for trial in range(RANDOM_TRIALS):
+        old, new = randomScreenPair(rng)
+        newLines = ct.calculateNewLines(old, new, partialLines=False)
+        scroll = naiveScroll(ct.hashLines(old), ct.hashLines(new))
+        checkEqual(len(newLines), len(new) - lcsLength(old[scroll:], new), f"Number of new lines of {old} and {new}")
+        check(isSubsequence(newLines, new), f"New lines {newLines} must come from {new} in order")
+
+def benchmarkOracles():
+    results = {}
+    for oracleCheck in [checkMyersAgainstOracle, checkScrollDetectionAgainstOracle, checkNewLinesAgainstOracle]:
+        stats, dummy = measure(oracleCheck, 1, repeats=1)
+        results[oracleCheck.__name__] = stats
+    return results
+
+def benchmarkWatchChanges():
+    header = "NAME    READY   STATUS"
+    cases = [
+        (
+            [header, "web-1   1/1     Running", "web-2   1/1     Running", "db-1    1/1     Running"],
+            [header, "web-1   1/1     Running", "db-1    1/1     Running", "web-3   0/1     Pending"],
+            ["web-3   0/1     Pending", "Removed web-2   1/1     Running"],
+        ),
+        # Removal of the first line must not be mistaken for scrolling.
+        (list("abcde"), list("bcdef"), ["f", "Removed a"]),
+        (list("abc"), list("abc"), []),
+        (["a", "", "b"], ["a", "b"], []),
+    ]
+    for previousLines, lines, expected in cases:
+        checkEqual(ct.getWatchChanges(previousLines, lines), expected, f"Changes from {previousLines} to {lines}")
+    previousLines = [f"pod-{i:04}   1/1     Running" for i in range(1000)]
+    lines = previousLines[:500] + ["pod-0500   0/1     CrashLoopBackOff"] + previousLines[501:]
+    stats, changes = measure(lambda: ct.getWatchChanges(previousLines, lines), 100)
+    checkEqual(changes, ["pod-0500   0/1     CrashLoopBackOff", "Removed pod-0500   1/1     Running"], "Changes of a long output")
+    return {"getWatchChanges": stats}
+
+benchmarks = [
+    benchmarkRecordedScreens,
+    benchmarkLargeScroll,
+    benchmarkOracles,
+    benchmarkWatchChanges,
+]
@@ -0,0 +1,204 @@
+"""
+Fake console windows for driving capture, navigation and follow code of consoleToolkit without a real console.
+"""
+
+import itertools
+
+import textInfos
+import winBindings
+import winUser
+from NVDAObjects import NVDAObject
+from NVDAObjects.UIA import UIA
+
+from .harness import check
+
+VK_SPACE = 0x20
+VK_Q = 0x51
+windowHandles = itertools.count(0x10000)
+
+class TextInfo:
+    def __init__(self, obj, text):
+        self.obj = obj
+        self.text = text
+
+    def expand(self, unit):
+        # Text infos of caret already contain a single line.
+        check(unit == textInfos.UNIT_LINE, "Only lines are simulated")
+
+class LegacyTextInfo(TextInfo):
+    def _getLineOffsets(self, offset):
+        lineStart = offset - offset % self.obj.width
+        return lineStart, lineStart + self.obj.width
+
+class FakeConsole:
+    """
+    Console window of fixed size showing output of a command piped into less.
+    less is controlled by keystrokes posted to console window: space shows next page and q quits.
+    As with less -c, every page is painted from the top of the screen, and the last page is padded with "~" lines.
+    """
+    def __init__(self, outputLines, height=30, width=120):
+        self.outputLines = outputLines
+        self.height = height
+        self.width = width
+        self.pageSize = height - 1
+        self.top = 0
+        self.quit = False
+        self.keystrokes = []
+        self.windowHandle = next(windowHandles)
+        winUser.windows[self.windowHandle] = self
+
+    def close(self):
+        del winUser.windows[self.windowHandle]
+
+    def onKey(self, vkCode):
+        self.keystrokes.append(vkCode)
+        if vkCode == VK_SPACE:
+            self.top += self.pageSize
+        elif vkCode == VK_Q:
+            self.quit = True
+
+    def getScreen(self):
+        if self.quit:
+            return ["$ "] + [""] * (self.height - 1)
+        lines = self.outputLines[self.top:self.top + self.pageSize]
+        if self.top + self.pageSize < len(self.outputLines):
+            return lines + [":"]
+        return lines + ["~"] * (self.pageSize - len(lines)) + ["(END)"]
+
+class FakeUIAConsole(FakeConsole, UIA):
+    def makeTextInfo(self, position):
+        # Caret of less is always in its last line.
+        if position == textInfos.POSITION_CARET:
+            return TextInfo(self, self.getScreen()[-1])
+        return TextInfo(self, "\r\n".join(self.getScreen()))
+
+class FakeLegacyConsole(FakeConsole, NVDAObject):
+    # Legacy console text has no line breaks, every row is padded to the width of the window.
+    def makeTextInfo(self, position):
+        if position == textInfos.POSITION_CARET:
+            return LegacyTextInfo(self, self.getScreen()[-1].ljust(self.width))
+        return LegacyTextInfo(self, "".join(line.ljust(self.width) for line in self.getScreen()))
+
+class SimulatedConsole:
+    """
+    Console buffer made of rows, of which only rows from firstVisible to lastVisible are on the screen.
+    Every call of boundingRects is counted as a probe, every retrieved character is counted as read
+    and every line that a text info is moved by is counted as moved, since that is what costs UIA calls in a real console.
+    """
+    windowHandles = itertools.count(0x20000)
+
+    def __init__(self, rows, firstVisible=0, lastVisible=None):
+        self.rows = rows
+        self.firstVisible = firstVisible
+        self.lastVisible = lastVisible if lastVisible is not None else len(rows) - 1
+        self.probes = 0
+        self.charactersRead = 0
+        self.linesMoved = 0
+        self.windowHandle = next(self.windowHandles)
+
+    def makeTextInfo(self, position):
+        if position == textInfos.POSITION_ALL:
+            return self.textInfoClass(self, 0, len(self.rows))
+        elif position == textInfos.POSITION_FIRST:
+            return self.textInfoClass(self, 0, 0)
+        elif position == textInfos.POSITION_CARET:
+            # Prompt with caret is in the last row.
+            return self.textInfoClass(self, len(self.rows) - 1, len(self.rows) - 1)
+        raise ValueError(position)
+
+    def onInputs(self, inputs):
+        # Typed characters are echoed at the end of the last row.
+        keyUp = winBindings.user32.KEYEVENTF.KEYUP
+        self.rows[-1] += "".join(chr(input.ii.ki.wScan) for input in inputs if not input.ii.ki.dwFlags & keyUp)
+
+    def formatRows(self, rows):
+        raise NotImplementedError
+
+class RowTextInfo:
+    # Text info whose endpoints are always at the beginning of a row; end is exclusive.
+    def __init__(self, obj, start, end):
+        self.obj = obj
+        self.start = start
+        self.end = end
+
+    def copy(self):
+        return type(self)(self.obj, self.start, self.end)
+
+    def collapse(self, end=False):
+        if end:
+            self.start = self.end
+        else:
+            self.end = self.start
+
+    def expand(self, unit):
+        check(unit == textInfos.UNIT_LINE, "Only lines are simulated")
+        self.start = min(self.start, len(self.obj.rows) - 1)
+        self.end = self.start + 1
+
+    def move(self, unit, direction, endPoint=None):
+        check(unit == textInfos.UNIT_LINE, "Only moving by lines is simulated")
+        if endPoint == "end":
+            newEnd = min(max(self.end + direction, self.start), len(self.obj.rows))
+            moved = newEnd - self.end
+            self.end = newEnd
+            self.obj.linesMoved += abs(moved)
+            return moved
+        check(endPoint is None, "Only collapsed text infos and ends are moved")
+        newStart = min(max(self.start + direction, 0), len(self.obj.rows) - 1)
+        moved = newStart - self.start
+        self.start = self.end = newStart
+        self.obj.linesMoved += abs(moved)
+        return moved
+
+    def setEndPoint(self, other, which):
+        if which == "endToEnd":
+            self.end = other.end
+        elif which == "endToStart":
+            self.end = other.start
+        else:
+            raise ValueError(which)
+
+    def compareEndPoints(self, other, which):
+        check(which == "startToStart", "Only starts are compared")
+        return (self.start > other.start) - (self.start < other.start)
+
+    @property
+    def text(self):
+        text = self.obj.formatRows(self.obj.rows[self.start:self.end])
+        self.obj.charactersRead += len(text)
+        return text
+
+    @property
+    def boundingRects(self):
+        self.obj.probes += 1
+        if self.obj.firstVisible <= self.start <= self.obj.lastVisible:
+            return [(0, self.start, 100, 1)]
+        return []
+
+class LegacyRowTextInfo(RowTextInfo):
+    def _getLineOffsets(self, offset):
+        lineStart = offset - offset % self.obj.width
+        return lineStart, lineStart + self.obj.width
+
+class SimulatedUIAConsole(SimulatedConsole, UIA):
+    textInfoClass = RowTextInfo
+
+    def formatRows(self, rows):
+        return "".join(row + "\r\n" for row in rows)
+
+class SimulatedLegacyConsole(SimulatedConsole, NVDAObject):
+    # Legacy console text has no line breaks, every row is padded to the width of the window.
+    textInfoClass = LegacyRowTextInfo
+    width = 80
+
+    def formatRows(self, rows):
+        return "".join(row.ljust(self.width) for row in rows)
+
+PROMPT = "user@host:~/project$ "
+
+def makeSession(commandCount, outputLineCount, firstCommand=0):
+    rows = []
+    for i in range(firstCommand, firstCommand + commandCount):
+        rows.append(f"{PROMPT}command {i}")
+        rows += [f"output {j} of command {i}" for j in range(outputLineCount)]
+    return rows
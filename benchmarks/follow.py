@@ -0,0 +1,112 @@
+"""
+Checks of follow mode against a simulated console, that keeps printing output between polls.
+"""
+
+import os
+
+import core
+
+from .fakeConsoles import makeSession, PROMPT, SimulatedLegacyConsole, SimulatedUIAConsole
+from .harness import check, checkEqual, consoleToolkit as ct, measure, setConfig
+
+BURST_SIZES = [0, 1, 5, 28, 3, 0, 17, 1]
+
+def followOutput(consoleClass, showRows):
+    """
+    Prints log lines in bursts of different sizes and polls the console after every burst.
+    showRows turns all the printed rows into rows of console buffer, e.g. by trimming or scrolling it.
+    Returns all printed and all collected lines.
+    """
+    printed = makeSession(3, 2) + [f"{PROMPT}tail -f log"]
+    console = consoleClass(showRows(printed))
+    tracker = ct.ConsoleTextTracker()
+    collected = ct.readFollowedLines(console, tracker)
+    logLineCount = 0
+    for burst in BURST_SIZES * 10:
+        printed += [f"log line {i}" for i in range(logLineCount, logLineCount + burst)]
+        logLineCount += burst
+        console.rows[:] = showRows(printed)
+        collected += ct.readFollowedLines(console, tracker)
+    # Once the last line is followed by a prompt, it is collected too.
+    printed.append(PROMPT)
+    console.rows[:] = showRows(printed)
+    collected += ct.readFollowedLines(console, tracker)
+    return printed[:-1], collected
+
+def showScreen(rows, height=30):
+    # Legacy console only exposes the visible screen, that is filled from the top.
+    if len(rows) < height:
+        return rows + [""] * (height - len(rows))
+    return rows[-height:]
+
+def checkFollowedLines():
+    cases = [
+        ("UIA", SimulatedUIAConsole, list),
+        ("trimmed UIA", SimulatedUIAConsole, lambda rows: rows[-100:]),
+        ("legacy", SimulatedLegacyConsole, showScreen),
+    ]
+    for name, consoleClass, showRows in cases:
+        printed, collected = followOutput(consoleClass, showRows)
+        checkEqual(collected, printed, f"Lines collected in {name} console")
+
+def pollFollowTask(console):
+    # Runs pending calls until follow task has polled console once more.
+    task = ct.scheduler.get(ct.getFollowTaskName(console))
+    step = task.step
+    while task.step == step:
+        core.runPending(block=True)
+
+def checkFollowTask():
+    console = SimulatedLegacyConsole(makeSession(2, 2) + [PROMPT])
+    try:
+        ct.toggleFollow(console)
+        followBuffer = ct.followBuffers[console.windowHandle]
+        pollFollowTask(console)
+        checkEqual(followBuffer.snapshot(), [], "Lines collected before anything has been printed")
+        newRows = makeSession(1, 2, firstCommand=2)
+        console.rows[-1:] = newRows + [PROMPT]
+        pollFollowTask(console)
+        checkEqual(followBuffer.snapshot(), newRows, "Lines collected after new output")
+        ct.toggleFollow(console)
+    finally:
+        ct.followBuffers.pop(console.windowHandle, None)
+
+def checkSpillFile():
+    setConfig(followSpillFile=True)
+    console = SimulatedLegacyConsole(makeSession(2, 2))
+    try:
+        ct.toggleFollow(console)
+        followBuffer = ct.followBuffers[console.windowHandle]
+        checkEqual(os.path.dirname(followBuffer.spillFileName), ct.getFollowDirectory(), "Directory of spill file")
+        ct.toggleFollow(console)
+        check(followBuffer.spillFile is None, "Spill file must be closed once follow mode is stopped")
+        ct.cleanupTempFiles()
+        check(os.path.exists(followBuffer.spillFileName), "Spill file must be kept when temporary files are cleaned up")
+        os.remove(followBuffer.spillFileName)
+    finally:
+        setConfig(followSpillFile=False)
+        ct.followBuffers.pop(console.windowHandle, None)
+
+def benchmarkFollow():
+    checkFollowedLines()
+    checkFollowTask()
+    checkSpillFile()
+    results = {}
+    for name, consoleClass in [("UIA", SimulatedUIAConsole), ("legacy", SimulatedLegacyConsole)]:
+        console = consoleClass(makeSession(1000, 10) + [PROMPT])
+        tracker = ct.ConsoleTextTracker()
+        ct.readFollowedLines(console, tracker)
+        def poll():
+            # Every poll finds ten new lines at the end of a long buffer.
+            console.rows[-1:] = makeSession(1, 9, firstCommand=len(console.rows)) + [PROMPT]
+            console.charactersRead = 0
+            return ct.readFollowedLines(console, tracker)
+        stats, lines = measure(poll, 100)
+        checkEqual(len(lines), 10, "Number of new lines")
+        check(console.charactersRead < 2000, f"Poll of a long buffer read {console.charactersRead} characters")
+        results[f"readFollowedLines {name}"] = stats
+    return results
+
+benchmarks = [
+    benchmarkFollow,
+]
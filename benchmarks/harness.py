@@ -0,0 +1,61 @@
+"""
+Imports consoleToolkit with NVDA modules stubbed out and provides helpers to measure and verify its code.
+"""
+
+import os
+import statistics
+import sys
+import time
+
+from . import nvdaStubs
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPOSITORY_DIRECTORY, "addon", "globalPlugins"))
+import consoleToolkit
+
+class BenchmarkFailure(Exception):
+    pass
+
+def check(condition, message):
+    if not condition:
+        raise BenchmarkFailure(message)
+
+def checkEqual(actual, expected, message):
+    if actual != expected:
+        raise BenchmarkFailure(f"{message}: expected {expected!r}, got {actual!r}")
+
+def setConfig(**kwargs):
+    for key, value in kwargs.items():
+        consoleToolkit.setConfig(key, value)
+    consoleToolkit.updateConfigSnapshot()
+
+def runTask(gen, name=None):
+    """
+    Runs generator function as a consoleToolkit task until it completes and returns its result.
+    Delays yielded by the task are skipped, everything else is processed as in NVDA.
+    """
+    task = consoleToolkit.scheduler.run(gen, name=name)
+    while not task.done:
+        if not nvdaStubs.runPending(block=True):
+            raise BenchmarkFailure(f"{task} got stuck")
+    if task.error is not None:
+        raise task.error
+    return task.result
+
+def measure(func, iterations, repeats=5):
+    """
+    Calls func iterations times in a row, repeats that several times and returns timing statistics of a single call.
+    Also returns the value returned by the last call, so that it can be verified.
+    """
+    timings = []
+    for dummy in range(repeats):
+        start = time.perf_counter()
+        for dummy in range(iterations):
+            result = func()
+        timings.append((time.perf_counter() - start) / iterations)
+    return {
+        "iterations": iterations,
+        "repeats": repeats,
+        "minUs": round(min(timings) * 1000000, 3),
+        "medianUs": round(statistics.median(timings) * 1000000, 3),
+    }, result
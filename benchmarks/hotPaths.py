@@ -0,0 +1,310 @@
+"""
+Benchmarks of the code that runs on every console update, capture or keystroke injection.
+Every benchmark returns timing statistics and fails if the measured code returns a wrong result.
+"""
+
+import ast
+import math
+import threading
+import time
+import types
+
+import nvwave
+import speech
+import winBindings
+
+from . import nvdaStubs
+from .fakeConsoles import FakeLegacyConsole, FakeUIAConsole, makeSession, PROMPT, SimulatedLegacyConsole, SimulatedUIAConsole, VK_Q, VK_SPACE
+from .harness import check, checkEqual, consoleToolkit as ct, measure, runTask, setConfig
+
+def completeSpeech():
+    # Lets every queued chunk be spoken to the end, including chunks queued by callbacks.
+    spoken = nvdaStubs.spokenSequences
+    i = 0
+    while i < len(spoken):
+        text, callback = spoken[i]
+        callback.callback()
+        i += 1
+
+def reportConsoleText(obj, lines):
+    """
+    Reports lines as new console text, then lets speech complete instantly chunk by chunk.
+    Returns the texts that have been spoken.
+    """
+    spoken = nvdaStubs.spokenSequences
+    del spoken[:]
+    ct.newCancelSpeech()
+    for line in lines:
+        ct.newReportConsoleText(obj, line)
+    completeSpeech()
+    return [text for text, callback in spoken]
+
+def checkPriorityLineSurvivesBurst(obj):
+    """
+    A priority line interrupts a regular line. While it is still being spoken, more than a second later,
+    a burst of regular lines arrives: priority line must not be cut off, and the stale interrupted line must be dropped.
+    """
+    spoken = nvdaStubs.spokenSequences
+    cancelCount = [0]
+    def cancelSpeech():
+        cancelCount[0] += 1
+    now = [1000.0]
+    originalTime = ct.time
+    ct.time = types.SimpleNamespace(time=lambda: now[0])
+    ct.originalCancelSpeech = cancelSpeech
+    try:
+        ct.newCancelSpeech()
+        del spoken[:]
+        cancelCount[0] = 0
+        ct.newReportConsoleText(obj, "Compiling main.c")
+        now[0] += 0.1
+        ct.newReportConsoleText(obj, "main.c:12: error: expected ';'")
+        now[0] += 1.5
+        burst = [f"Compiling file{i}.c" for i in range(5)]
+        for line in burst:
+            ct.newReportConsoleText(obj, line)
+        checkEqual(cancelCount[0], 1, "Speech cancellations; only the regular line may be interrupted")
+        completeSpeech()
+        checkEqual(
+            [text for text, callback in spoken],
+            ["Compiling main.c", "main.c:12: error: expected ';'"] + burst,
+            "Spoken lines around priority line",
+        )
+    finally:
+        ct.time = originalTime
+        ct.originalCancelSpeech = speech.cancelSpeech
+
+def benchmarkReportConsoleText():
+    ct.originalCancelSpeech = speech.cancelSpeech
+    obj = FakeUIAConsole([])
+    lines = [f"{'DEBUG' if i % 3 == 0 else 'INFO'} line {i} of console output" for i in range(1000)]
+    results = {}
+    try:
+        stats, spoken = measure(lambda: reportConsoleText(obj, lines), 10)
+        checkEqual(spoken, lines, "Every line must be spoken once in order")
+        results["newReportConsoleText"] = stats
+        setConfig(muteRules=["^DEBUG "])
+        stats, spoken = measure(lambda: reportConsoleText(obj, lines), 10)
+        checkEqual(spoken, [line for line in lines if not line.startswith("DEBUG ")], "Muted lines must not be spoken")
+        results["newReportConsoleText muted"] = stats
+        setConfig(priorityRules=["error"])
+        checkPriorityLineSurvivesBurst(obj)
+        # Watch runs type into console and page through less, which must not be spoken.
+        watch = ct.watchAsync(obj, "df -h")
+        next(watch)
+        checkEqual(reportConsoleText(obj, lines), [], "Lines spoken while watching")
+        watch.close()
+        checkEqual(reportConsoleText(obj, lines[1:2]), lines[1:2], "Lines spoken after watching has stopped")
+    finally:
+        setConfig(muteRules=[], priorityRules=[])
+        obj.close()
+    return results
+
+def benchmarkLineFilter():
+    lineFilter = ct.LineFilter(["^note: ", r"^\[\d+/\d+\] Compiling"], ["error", "FAILED"], ct.configSnapshot.promptRule)
+    lines = [
+        ("[12/340] Compiling main.c", ct.LINE_MUTED),
+        ("note: test FAILED", ct.LINE_PRIORITY),
+        ("main.c:12: error: expected ';'", ct.LINE_PRIORITY),
+        ("note: expanded from macro", ct.LINE_MUTED),
+        ("Linking consoleToolkit", ct.LINE_NORMAL),
+    ] * 200
+    stats, kinds = measure(lambda: [lineFilter.classify(line) for line, kind in lines], 10)
+    checkEqual(kinds, [kind for line, kind in lines], "Line kinds; priority rules must win over mute rules")
+    return {"LineFilter.classify": stats}
+
+def captureLines(consoleClass, outputLines):
+    console = consoleClass(outputLines)
+    try:
+        lines = runTask(ct.captureLinesAsync(console, time.time() + 60))
+    finally:
+        console.close()
+    pageCount = math.ceil(len(outputLines) / console.pageSize)
+    checkEqual(console.keystrokes, [VK_SPACE] * (pageCount - 1) + [VK_Q], "less must be paged through and quit")
+    return lines
+
+def benchmarkCaptureLines():
+    outputLines = [f"{i:5} output line of the command being captured" for i in range(1000)]
+    results = {}
+    for name, consoleClass in [("UIA", FakeUIAConsole), ("legacy", FakeLegacyConsole)]:
+        stats, lines = measure(lambda: captureLines(consoleClass, outputLines), 3)
+        checkEqual(lines, outputLines, f"Captured lines in {name} console")
+        results[f"captureLinesAsync {name}"] = stats
+    return results
+
+def benchmarkMergeUIAPromptTexts():
+    text1 = " ".join(f"word{i}" for i in range(200))
+    # UIA inserts spaces at some positions of the second copy of the prompt.
+    text2 = text1.replace("1 ", "1  ")
+    stats, merged = measure(lambda: ct.mergeUIAPromptTexts(text1, text2), 200)
+    checkEqual(merged, text2, "Merged prompt")
+    return {"mergeUIAPromptTexts": stats}
+
+def waitForAudioThreads():
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and not thread.daemon:
+            thread.join()
+
+def benchmarkBeeper():
+    beeper = ct.Beeper()
+    levels = list(range(500))
+    results = {}
+    stats, buf = measure(lambda: beeper.makeCrackleBuffer(levels, 5), 100)
+    beepCount = min(int(round(10 * math.log(1 + len(levels) / 10))), ct.Beeper.MAX_BEEP_COUNT)
+    generateBeep = nvdaStubs.generateBeep
+    beepSize = generateBeep(None, 0, ct.Beeper.BEEP_LEN, 0, 0) + generateBeep(None, 0, ct.Beeper.PAUSE_LEN, 0, 0)
+    checkEqual(len(buf), beepCount * beepSize, "Crackle buffer size")
+    results["Beeper.makeCrackleBuffer"] = stats
+    del nvwave.fedAudio[:]
+    stats, dummy = measure(lambda: beeper.fancyBeep("CDGA", length=5000), 3)
+    waitForAudioThreads()
+    checkEqual(nvwave.fedAudio, [generateBeep(None, 0, 5000, 0, 0)] * (stats["iterations"] * stats["repeats"]), "Chord buffer sizes")
+    results["Beeper.fancyBeep"] = stats
+    return results
+
+def benchmarkUnicodeInput():
+    text = "echo Привет, мир! 😀 " * 50
+    codes = [ord(c) for c in text]
+    utf16Length = len(text.encode("utf-16-le")) // 2
+    keyUp = winBindings.user32.KEYEVENTF.KEYUP
+    results = {}
+    stats, inputs = measure(lambda: ct.makeUnicodeInput(text), 100)
+    checkEqual(len(inputs), 2 * utf16Length, "Number of INPUT structures")
+    typed = "".join(chr(input.ii.ki.wScan) for input in inputs if not input.ii.ki.dwFlags & keyUp)
+    checkEqual(typed.encode("utf-16-le", "surrogatepass").decode("utf-16-le"), text, "Typed text")
+    results["makeUnicodeInput"] = stats
+    stats, boundaries = measure(lambda: ct.getKeystrokeBoundaries(inputs), 100)
+    # Surrogate pair of an emoji is one keystroke.
+    checkEqual(len(boundaries), len(codes), "Number of keystrokes")
+    results["getKeystrokeBoundaries"] = stats
+    builder = ct.InputBuilder()
+    for line in text.split("!"):
+        builder.unicode(line).vk(ct.winUser.VK_RETURN)
+    stats, built = measure(builder.build, 100)
+    checkEqual(len(built), len(builder), "Size of built INPUT array")
+    results["InputBuilder.build"] = stats
+    return results
+
+def typeCommand(console, command):
+    console.rows[-1] = PROMPT
+    console.charactersRead = 0
+    runTask(ct.sendInputsPaced(console, ct.makeUnicodeInput(command), verifyEcho=True))
+    return console.rows[-1]
+
+def benchmarkSendInputsPaced():
+    command = "find . -name '*.py' | xargs grep -n 'def ' | sort | uniq -c"
+    results = {}
+    for name, consoleClass in [("UIA", SimulatedUIAConsole), ("legacy", SimulatedLegacyConsole)]:
+        console = consoleClass(makeSession(1000, 20) + [PROMPT])
+        nvdaStubs.inputTarget = console
+        try:
+            stats, prompt = measure(lambda: typeCommand(console, command), 10)
+        finally:
+            nvdaStubs.inputTarget = None
+        checkEqual(prompt, PROMPT + command, f"Typed command in {name} console")
+        # Echo of every chunk is verified by reading only the prompt line, not the long buffer.
+        bufferLength = len(console.formatRows(console.rows))
+        check(
+            console.charactersRead * 100 < bufferLength,
+            f"Typing a command read {console.charactersRead} characters of a buffer of {bufferLength} characters",
+        )
+        results[f"sendInputsPaced {name}"] = stats
+    return results
+
+def benchmarkTextProcessing():
+    command = "find . -name '*.py' | xargs grep -n 'def ' | sort | uniq -c " * 5
+    screen = [f"{i:5} some output line of the console" for i in range(3000)]
+    consoleWidth = 120
+    legacyScreen = "".join(line.ljust(consoleWidth) for line in screen)
+    lessScreen = [f"{i:5} some output line of the command being captured" for i in range(45)] + ["~"] * 4 + ["(END)"]
+    results = {}
+    stats, lines = measure(lambda: ct.splitFixedWidthText(legacyScreen, consoleWidth), 100)
+    checkEqual(lines, screen, "Rows of legacy console")
+    results["splitFixedWidthText"] = stats
+    stats, (state, lines) = measure(lambda: ct.parseLessScreen(lessScreen), 10000)
+    checkEqual((state, lines), (ct.LESS_SCREEN_END, lessScreen[:45]), "Parsed less screen")
+    results["parseLessScreen"] = stats
+    newCommand = command.replace("sort", "sort -r", 1)
+    stats, edit = measure(lambda: ct.computeMinimalEdit(command, newCommand), 1000)
+    suffixLength, deleteCount, insertText = edit
+    check(
+        command[:len(command) - suffixLength - deleteCount] + insertText + command[len(command) - suffixLength:] == newCommand,
+        "Minimal edit must turn old command into new one",
+    )
+    checkEqual((deleteCount, len(insertText)), (0, len(" -r")), "Minimal edit")
+    results["computeMinimalEdit"] = stats
+    return results
+
+def benchmarkSplitCommands():
+    cases = [
+        ("uptime; df -h; free -m", ["uptime", "df -h", "free -m"]),
+        ("echo 'a;b' \"c;d\" e\\;f; ls", ["echo 'a;b' \"c;d\" e\\;f", "ls"]),
+        ("for i in 1 2; do echo $i; done; ls", ["for i in 1 2; do echo $i; done", "ls"]),
+        ("for ((i=0; i<3; i++)); do echo $i; done; ls", ["for ((i=0; i<3; i++)); do echo $i; done", "ls"]),
+        ("if true; then a; else b; fi; ls", ["if true; then a; else b; fi", "ls"]),
+        ("if a; then for i in x; do b; done; fi; ls", ["if a; then for i in x; do b; done; fi", "ls"]),
+        ("case $x in a) b;; c) d;; esac; ls", ["case $x in a) b;; c) d;; esac", "ls"]),
+        ("echo $(a; b); ls", ["echo $(a; b)", "ls"]),
+        ("{ a; b; }; (cd src; make); f() { a; b; }", ["{ a; b; }", "(cd src; make)", "f() { a; b; }"]),
+        ("echo done; echo fi", ["echo done", "echo fi"]),
+    ]
+    for commandLine, commands in cases:
+        checkEqual(ct.splitCommands(commandLine), commands, f"Commands of {commandLine}")
+    commandLine = "; ".join(commandLine for commandLine, commands in cases)
+    stats, commands = measure(lambda: ct.splitCommands(commandLine), 100)
+    checkEqual(commands, [command for dummy, commands in cases for command in commands], "Commands of long command line")
+    return {"splitCommands": stats}
+
+def isTracerEnabledCheck(node):
+    return (
+        isinstance(node, ast.If)
+        and isinstance(node.test, ast.Attribute)
+        and node.test.attr == "enabled"
+        and isinstance(node.test.value, ast.Name)
+        and node.test.value.id == "tracer"
+    )
+
+def findUnguardedTraceCalls(node, guarded=False):
+    """
+    Returns line numbers of mylog calls with formatted arguments, that are not inside of if tracer.enabled block,
+    so that their arguments would be formatted even when tracing is disabled.
+    """
+    result = []
+    if (
+        not guarded
+        and isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id == "mylog"
+        and any(isinstance(child, ast.FormattedValue) for arg in node.args for child in ast.walk(arg))
+    ):
+        result.append(node.lineno)
+    if isTracerEnabledCheck(node):
+        for child in node.body:
+            result += findUnguardedTraceCalls(child, guarded=True)
+        for child in node.orelse:
+            result += findUnguardedTraceCalls(child, guarded)
+        return result
+    for child in ast.iter_child_nodes(node):
+        result += findUnguardedTraceCalls(child, guarded)
+    return result
+
+def benchmarkTracer():
+    with open(ct.__file__, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    checkEqual(findUnguardedTraceCalls(tree), [], "Lines of trace calls formatting their arguments while tracing is disabled")
+    check(not ct.tracer.enabled, "Tracing must be disabled by default")
+    stats, dummy = measure(lambda: ct.mylog("message"), 10000)
+    return {"Tracer.trace disabled": stats}
+
+benchmarks = [
+    benchmarkTracer,
+    benchmarkReportConsoleText,
+    benchmarkLineFilter,
+    benchmarkCaptureLines,
+    benchmarkMergeUIAPromptTexts,
+    benchmarkBeeper,
+    benchmarkUnicodeInput,
+    benchmarkSendInputsPaced,
+    benchmarkTextProcessing,
+    benchmarkSplitCommands,
+]
@@ -0,0 +1,342 @@
+"""
+Minimal stand-ins for NVDA modules used by Console Toolkit.
+They provide just enough for consoleToolkit module to be imported and for its hot paths to run outside of NVDA,
+for example on Linux. Stubs don't try to emulate NVDA: speech, tones and audio do nothing,
+keystrokes posted to windows are delivered to fake consoles registered in winUser.windows.
+"""
+
+import builtins
+import contextlib
+import ctypes
+import queue
+import re
+import sys
+import tempfile
+import types
+
+def makeModule(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+class Stub:
+    """
+    Placeholder for NVDA and wx classes: accepts any arguments and is a valid base class.
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+
+class Action:
+    # Extension point, such as config.post_configReset
+    def __init__(self):
+        self.handlers = []
+    def register(self, handler):
+        self.handlers.append(handler)
+    def unregister(self, handler):
+        self.handlers.remove(handler)
+
+# speech
+
+class CallbackCommand:
+    def __init__(self, callback):
+        self.callback = callback
+
+spokenSequences = []
+def speak(sequence, *args, **kwargs):
+    # Speech never completes, so callbacks are never called.
+    spokenSequences.append(sequence)
+
+def cancelSpeech():
+    pass
+
+speechModule = makeModule(
+    "speech",
+    IDT_BASE_FREQUENCY=220,
+    speak=speak,
+    cancelSpeech=cancelSpeech,
+    speakTextInfo=lambda *args, **kwargs: None,
+    commands=types.SimpleNamespace(CallbackCommand=CallbackCommand),
+    spokenSequences=spokenSequences,
+)
+speechModule.speech = speechModule
+
+# tones
+
+makeModule("tones", SAMPLE_RATE=44100, beep=lambda *args, **kwargs: None)
+
+# NVDAHelper
+
+def generateBeep(buf, hz, length, left, right):
+    # Same buffer size as NVDA's generateBeep: 16 bit stereo samples at 44100 Hz.
+    size = int(44100 * length / 1000) * 4
+    if buf is not None:
+        ctypes.memset(buf, 0, size)
+    return size
+
+makeModule("NVDAHelper", localLib=types.SimpleNamespace(generateBeep=generateBeep))
+
+# nvwave
+
+fedAudio = []
+class WavePlayer(Stub):
+    # Audio is discarded; only the size of every fed buffer is recorded.
+    def feed(self, data):
+        fedAudio.append(len(data))
+    def stop(self):
+        pass
+
+makeModule("nvwave", WavePlayer=WavePlayer, AudioPurpose=types.SimpleNamespace(SOUNDS="sounds"), fedAudio=fedAudio)
+
+# winUser
+
+# Fake windows by window handle; keystrokes posted to them are delivered to their onKey method.
+windows = {}
+WM_KEYDOWN = 0x0100
+
+def PostMessage(hwnd, message, wParam, lParam):
+    window = windows.get(hwnd)
+    if window is not None and message == WM_KEYDOWN:
+        window.onKey(wParam)
+
+def VkKeyScanEx(ch, hkl):
+    return 0, ord(ch.upper())
+
+virtualKeys = dict(
+    VK_BACK=0x08, VK_RETURN=0x0D, VK_SHIFT=0x10, VK_CONTROL=0x11, VK_MENU=0x12, VK_ESCAPE=0x1B,
+    VK_END=0x23, VK_HOME=0x24, VK_LEFT=0x25, VK_INSERT=0x2D, VK_DELETE=0x2E,
+    VK_LWIN=0x5B, VK_RWIN=0x5C, VK_LSHIFT=0xA0, VK_RSHIFT=0xA1, VK_LCONTROL=0xA2, VK_RCONTROL=0xA3,
+    VK_LMENU=0xA4, VK_RMENU=0xA5,
+)
+makeModule(
+    "winUser",
+    windows=windows,
+    PostMessage=PostMessage,
+    VkKeyScanEx=VkKeyScanEx,
+    getKeyState=lambda vk: 0,
+    getForegroundWindow=lambda: 0,
+    getWindowThreadProcessID=lambda hwnd: (0, 0),
+    getWindowText=lambda hwnd: "",
+    CF_UNICODETEXT=13,
+    SWP_NOSIZE=0x0001, SWP_NOMOVE=0x0002, SWP_NOACTIVATE=0x0010,
+    MOUSEEVENTF_RIGHTDOWN=0x0008, MOUSEEVENTF_RIGHTUP=0x0010,
+    **virtualKeys,
+)
+
+# winBindings: INPUT structures have the same layout as in Windows.
+
+class KEYBDINPUT(ctypes.Structure):
+    _fields_ = [
+        ("wVk", ctypes.c_ushort),
+        ("wScan", ctypes.c_ushort),
+        ("dwFlags", ctypes.c_uint),
+        ("time", ctypes.c_uint),
+        ("dwExtraInfo", ctypes.c_void_p),
+    ]
+
+class MOUSEINPUT(ctypes.Structure):
+    _fields_ = [
+        ("dx", ctypes.c_long),
+        ("dy", ctypes.c_long),
+        ("mouseData", ctypes.c_uint),
+        ("dwFlags", ctypes.c_uint),
+        ("time", ctypes.c_uint),
+        ("dwExtraInfo", ctypes.c_void_p),
+    ]
+
+class INPUTUnion(ctypes.Union):
+    _fields_ = [("ki", KEYBDINPUT), ("mi", MOUSEINPUT)]
+
+class INPUT(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_uint), ("ii", INPUTUnion)]
+
+sentInputs = []
+# Fake console that receives keystrokes sent by SendInput, as if it was in the foreground.
+inputTarget = None
+def SendInput(n, inputs, size):
+    sentInputs.append(n)
+    if inputTarget is not None:
+        inputTarget.onInputs(inputs[:n])
+    return n
+
+makeModule("winBindings", user32=types.SimpleNamespace(
+    INPUT=INPUT,
+    INPUT_TYPE=types.SimpleNamespace(MOUSE=0, KEYBOARD=1),
+    KEYEVENTF=types.SimpleNamespace(KEYUP=0x0002, UNICODE=0x0004),
+    dll=types.SimpleNamespace(
+        SendInput=SendInput,
+        SetWindowPos=lambda *args: 1,
+        AttachThreadInput=lambda *args: 1,
+        GetKeyboardState=lambda *args: 1,
+        SetKeyboardState=lambda *args: 1,
+    ),
+))
+
+if not hasattr(ctypes, "windll"):
+    ctypes.windll = types.SimpleNamespace(
+        user32=types.SimpleNamespace(
+            GetKeyboardLayout=lambda threadId: 0x04090409,
+            RegisterClipboardFormatW=lambda name: 0xC000,
+            SetClipboardData=lambda format, data: 0,
+            WindowFromPoint=lambda point: 0,
+        ),
+        kernel32=types.SimpleNamespace(GetCurrentThreadId=lambda: 1),
+    )
+
+# textInfos
+
+class TextInfo:
+    pass
+
+makeModule(
+    "textInfos",
+    TextInfo=TextInfo,
+    POSITION_FIRST="first",
+    POSITION_LAST="last",
+    POSITION_CARET="caret",
+    POSITION_ALL="all",
+    UNIT_CHARACTER="character",
+    UNIT_LINE="line",
+)
+
+# wx
+
+makeModule(
+    "wx",
+    Dialog=Stub, TextCtrl=Stub, CheckBox=Stub, Choice=Stub, Slider=Stub, StaticText=Stub, BoxSizer=Stub,
+    FileDialog=Stub, SingleChoiceDialog=Stub, TextEntryDialog=Stub,
+    # As in wx, calls are made later from the main loop, see core stub.
+    CallAfter=lambda func, *args, **kwargs: callLater(0, func, *args, **kwargs),
+    ID_ANY=-1, ID_OK=5100, ID_CANCEL=5101,
+    HORIZONTAL=4, VERTICAL=8,
+    TE_MULTILINE=0x20, TE_DONTWRAP=0x40000000, TE_PROCESS_ENTER=0x400,
+    FD_SAVE=2, FD_OVERWRITE_PROMPT=4,
+    EVT_CHAR=object(), EVT_CHAR_HOOK=object(), EVT_TEXT=object(), EVT_WINDOW_DESTROY=object(),
+    WXK_CONTROL_A=1, WXK_TAB=9, WXK_ESCAPE=27, WXK_HOME=313, WXK_F3=342,
+)
+
+# config
+
+class ConfigSection(dict):
+    pass
+
+class ConfigManager(dict):
+    """
+    Serves default values of configuration spec, so that add-on configuration can be read as in NVDA.
+    """
+    DEFAULT_RE = re.compile(r"^(\w+)\(.*default=(.*?)(,\s*\w+=.*)?\)$")
+
+    def __init__(self):
+        super().__init__()
+        self.spec = {}
+        self["audio"] = ConfigSection(outputDevice="default")
+        self["speech"] = ConfigSection(outputDevice="default")
+        self["reviewCursor"] = ConfigSection(followCaret=True)
+
+    def __missing__(self, name):
+        section = ConfigSection({
+            key: self.parseDefault(value)
+            for key, value in self.spec[name].items()
+        })
+        self[name] = section
+        return section
+
+    def parseDefault(self, spec):
+        kind, value = self.DEFAULT_RE.match(spec).group(1, 2)
+        if kind == "boolean":
+            return value == "True"
+        elif kind == "integer":
+            return int(value)
+        elif kind == "string_list":
+            return []
+        return value.strip("'\"")
+
+makeModule(
+    "config",
+    conf=ConfigManager(),
+    post_configProfileSwitch=Action(),
+    post_configReset=Action(),
+)
+
+# core: functions scheduled with callLater are queued and executed by runPending.
+
+pendingCalls = queue.Queue()
+
+def callLater(delay, func, *args, **kwargs):
+    pendingCalls.put((func, args, kwargs))
+
+def runPending(block=False):
+    try:
+        func, args, kwargs = pendingCalls.get(block=block, timeout=10 if block else None)
+    except queue.Empty:
+        return False
+    func(*args, **kwargs)
+    return True
+
+makeModule("core", callLater=callLater, runPending=runPending)
+
+# api: review position and clipboard are just stored.
+
+api = makeModule("api", reviewPosition=None, clipboard="")
+
+def getReviewPosition():
+    return api.reviewPosition
+
+def setReviewPosition(info, *args, **kwargs):
+    api.reviewPosition = info
+    return True
+
+def copyToClip(text, *args, **kwargs):
+    api.clipboard = text
+    return True
+
+api.getReviewPosition = getReviewPosition
+api.setReviewPosition = setReviewPosition
+api.copyToClip = copyToClip
+api.getClipData = lambda: api.clipboard
+
+# Everything else is only needed for consoleToolkit to import.
+
+def installTranslation():
+    builtins._ = lambda text: text
+
+def script(**kwargs):
+    return lambda func: func
+
+class Log:
+    def debug(self, *args, **kwargs):
+        pass
+    info = debugWarning = warning = debug
+    def error(self, message, *args, **kwargs):
+        print(f"ERROR: {message}", file=sys.stderr)
+
+makeModule("addonHandler", initTranslation=installTranslation)
+makeModule("controlTypes", OutputReason=types.SimpleNamespace(CARET="caret"))
+makeModule("editableText")
+makeModule("globalPluginHandler", GlobalPlugin=Stub)
+makeModule("globalVars", appArgs=types.SimpleNamespace(configPath=tempfile.mkdtemp(prefix="consoleToolkitBenchmarks")))
+gui = makeModule("gui", mainFrame=types.SimpleNamespace(prePopup=lambda: None, postPopup=lambda: None))
+gui.guiHelper = makeModule("gui.guiHelper", BoxSizerHelper=Stub)
+gui.nvdaControls = makeModule("gui.nvdaControls")
+gui.settingsDialogs = makeModule("gui.settingsDialogs", SettingsPanel=Stub, NVDASettingsDialog=types.SimpleNamespace(categoryClasses=[]))
+makeModule("inputCore", InputGesture=Stub, decide_handleRawKey=Action())
+makeModule("keyboardHandler", KeyboardInputGesture=Stub, VK_WIN="windows", VK_NVDA="NVDA", ignoreInjection=contextlib.nullcontext)
+makeModule("logHandler", log=Log())
+nvdaObjects = makeModule("NVDAObjects", NVDAObject=Stub)
+nvdaObjects.behaviors = makeModule("NVDAObjects.behaviors", LiveText=Stub, Terminal=Stub)
+nvdaObjects.IAccessible = makeModule("NVDAObjects.IAccessible", IAccessible=Stub)
+nvdaObjects.UIA = makeModule("NVDAObjects.UIA", UIA=type("UIA", (Stub,), {}))
+nvdaObjects.UIA.winConsoleUIA = makeModule(
+    "NVDAObjects.UIA.winConsoleUIA",
+    _DiffBasedWinTerminalUIA=type("_DiffBasedWinTerminalUIA", (nvdaObjects.UIA.UIA,), {}),
+    _NotificationsBasedWinTerminalUIA=type("_NotificationsBasedWinTerminalUIA", (nvdaObjects.UIA.UIA,), {}),
+)
+makeModule("review", handleCaretMove=None)
+makeModule("scriptHandler", script=script, willSayAllResume=lambda gesture: False, getLastScriptRepeatCount=lambda: 0)
+makeModule("ui", message=lambda *args, **kwargs: None)
+makeModule("watchdog", cancellableSendMessage=lambda *args, **kwargs: 0)
+makeModule("globalCommands", commands=None)
+uiaHandler = makeModule("UIAHandler")
+uiaHandler.utils = makeModule("UIAHandler.utils", _shouldUseWindowsTerminalNotifications=lambda: False)
+makeModule("buildVersion", version="2026.1", version_year=2026)
+makeModule("vkCodes", byName={})
@@ -0,0 +1,154 @@
+"""
+Checks of review cursor navigation against a simulated console buffer.
+"""
+
+import api
+import core
+
+from .fakeConsoles import makeSession, PROMPT, RowTextInfo, SimulatedLegacyConsole, SimulatedUIAConsole
+from .harness import check, checkEqual, consoleToolkit as ct, measure, runTask
+
+def findFirstVisibleLine(lineCount, firstVisible, lastVisible, reviewLine):
+    console = SimulatedUIAConsole([""] * lineCount, firstVisible, lastVisible)
+    info = ct.findFirstVisibleLine(RowTextInfo(console, reviewLine, reviewLine))
+    return info.start, console.probes
+
+def maxProbes(distance):
+    # Doubling and then bisecting the distance to the first visible line
+    return 2 * distance.bit_length() + 2
+
+def checkFindFirstVisibleLine():
+    cases = [
+        # lineCount, firstVisible, lastVisible, reviewLine
+        (10000, 9970, 9999, 9999),
+        (10000, 9970, 9999, 9970),
+        (10000, 9970, 9999, 9985),
+        (10000, 5000, 9999, 9999),
+        (30, 0, 29, 29),
+        (30, 0, 29, 0),
+        (1, 0, 0, 0),
+    ]
+    for lineCount, firstVisible, lastVisible, reviewLine in cases:
+        line, probes = findFirstVisibleLine(lineCount, firstVisible, lastVisible, reviewLine)
+        checkEqual(line, firstVisible, f"First visible line of buffer {lineCount, firstVisible, lastVisible} above line {reviewLine}")
+        distance = reviewLine - firstVisible
+        check(
+            probes <= maxProbes(distance),
+            f"Finding first visible line {distance} lines above review took {probes} probes, expected at most {maxProbes(distance)}",
+        )
+    for distance in range(200):
+        line, probes = findFirstVisibleLine(1000, 500, 999, 500 + distance)
+        checkEqual(line, 500, f"First visible line {distance} lines above review")
+        check(probes <= maxProbes(distance), f"Finding first visible line {distance} lines above review took {probes} probes")
+
+def benchmarkFindFirstVisibleLine():
+    checkFindFirstVisibleLine()
+    stats, (line, probes) = measure(lambda: findFirstVisibleLine(100000, 50000, 99999, 99999), 1000)
+    checkEqual(line, 50000, "First visible line of a tall screen")
+    stats["probes"] = probes
+    return {"findFirstVisibleLine": stats}
+
+def moveReview(console, row):
+    api.reviewPosition = console.textInfoClass(console, row, row)
+
+def getCommandOutput(console, row):
+    moveReview(console, row)
+    api.clipboard = None
+    runTask(ct.getCommandOutputAsync(console))
+    return api.clipboard.split("\r\n")
+
+def checkPromptIndex(consoleClass):
+    console = consoleClass(makeSession(100, 20) + [PROMPT])
+    lineFilter = ct.getLineFilter()
+    promptIndex = ct.PromptIndex()
+    promptIndex.update(console, lineFilter)
+    checkEqual([prompt.start for prompt in promptIndex.prompts], list(range(0, 2101, 21)), "Prompt rows")
+    check(console.linesMoved <= 2 * len(console.rows), f"Building index of {len(console.rows)} rows moved by {console.linesMoved} lines")
+    # New output is appended: only the new text must be read.
+    console.rows[-1:] = makeSession(1, 20, firstCommand=100) + [PROMPT]
+    console.charactersRead = 0
+    console.linesMoved = 0
+    promptIndex.update(console, lineFilter)
+    checkEqual([prompt.start for prompt in promptIndex.prompts], list(range(0, 2122, 21)), "Prompt rows after new output")
+    newTextLength = len(console.formatRows(console.rows[2100:]))
+    check(console.charactersRead <= 2 * newTextLength, f"Update read {console.charactersRead} characters, while only {newTextLength} are new")
+    newLineCount = len(console.rows) - 2100
+    check(console.linesMoved <= 4 * newLineCount, f"Update moved by {console.linesMoved} lines, while only {newLineCount} lines are new")
+    # Buffer is cleared: whole buffer must be rescanned.
+    console.rows[:] = makeSession(2, 3) + [PROMPT]
+    promptIndex.update(console, lineFilter)
+    checkEqual([prompt.start for prompt in promptIndex.prompts], [0, 4, 8], "Prompt rows after clearing buffer")
+    # Navigation
+    promptIndexes = ct.promptIndexes
+    console.rows[:] = makeSession(10, 5) + [PROMPT]
+    promptIndexes[console.windowHandle] = ct.PromptIndex()
+    for row, direction, expected in [(20, -1, 18), (18, -1, 12), (19, 1, 24), (60, 1, None), (0, -1, None)]:
+        moveReview(console, row)
+        runTask(ct.navigatePromptAsync(console, direction))
+        checkEqual(api.reviewPosition.start, row if expected is None else expected, f"Navigating from row {row} in direction {direction}")
+    # Stale index is detected and rebuilt when buffer is trimmed without printing a prompt.
+    del console.rows[:3]
+    moveReview(console, 20)
+    runTask(ct.navigatePromptAsync(console, -1))
+    checkEqual(api.reviewPosition.start, 15, "Navigating after buffer has been trimmed")
+    # Command output
+    checkEqual(getCommandOutput(console, 20), [f"output {j} of command 3" for j in range(5)], "Output of command above review")
+    checkEqual(getCommandOutput(console, 15), [f"output {j} of command 3" for j in range(5)], "Output of command at review")
+    console.rows[-1:] = [f"{PROMPT}command 10", "last output", PROMPT]
+    checkEqual(getCommandOutput(console, 58), ["last output"], "Output of the last command")
+    del promptIndexes[console.windowHandle]
+
+def benchmarkPromptIndex():
+    results = {}
+    for name, consoleClass in [("UIA", SimulatedUIAConsole), ("legacy", SimulatedLegacyConsole)]:
+        checkPromptIndex(consoleClass)
+        console = consoleClass(makeSession(1000, 20) + [PROMPT])
+        promptIndex = ct.PromptIndex()
+        promptIndex.update(console, ct.getLineFilter())
+        lineStart = console.textInfoClass(console, 15000, 15000)
+        stats, previous = measure(lambda: promptIndex.previous(lineStart), 1000)
+        checkEqual(previous.start, 14994, "Previous prompt")
+        results[f"PromptIndex.previous {name}"] = stats
+    return results
+
+def checkCaretDebounce():
+    console = SimulatedLegacyConsole(makeSession(2, 2) + [PROMPT])
+    console.windowClassName = "ConsoleWindowClass"
+    handled = []
+    ct.originalHandleCaretMove = handled.append
+    while core.runPending():
+        pass
+    try:
+        ct.newHandleCaretMove(console)
+        checkEqual(len(handled), 1, "Caret moves handled at once")
+        for dummy in range(5):
+            ct.newHandleCaretMove(console)
+        checkEqual(len(handled), 1, "Caret moves handled during a burst")
+        core.runPending()
+        checkEqual(len(handled), 2, "Caret moves handled at the end of debounce interval")
+        core.runPending()
+        ct.newHandleCaretMove(console)
+        checkEqual(len(handled), 3, "Caret moves handled once the burst is over")
+        while core.runPending():
+            pass
+    finally:
+        ct.originalHandleCaretMove = None
+
+def benchmarkCaretDebounce():
+    checkCaretDebounce()
+    console = SimulatedUIAConsole(makeSession(2, 2) + [PROMPT])
+    console.windowClassName = "ConsoleWindowClass"
+    ct.originalHandleCaretMove = lambda obj: None
+    try:
+        stats, dummy = measure(lambda: ct.newHandleCaretMove(console), 1000)
+        while core.runPending():
+            pass
+    finally:
+        ct.originalHandleCaretMove = None
+    return {"newHandleCaretMove": stats}
+
+benchmarks = [
+    benchmarkFindFirstVisibleLine,
+    benchmarkPromptIndex,
+    benchmarkCaretDebounce,
+]
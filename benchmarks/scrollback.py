@@ -0,0 +1,27 @@
+"""
+Checks of scrollback export against a simulated console buffer.
+"""
+
+import api
+
+from .fakeConsoles import makeSession, PROMPT, SimulatedLegacyConsole, SimulatedUIAConsole
+from .harness import checkEqual, consoleToolkit as ct, measure, runTask
+
+def exportScrollback(console):
+    api.clipboard = None
+    runTask(ct.exportScrollbackAsync(console))
+    return api.clipboard.split("\r\n")
+
+def benchmarkExportScrollback():
+    results = {}
+    for name, consoleClass in [("UIA", SimulatedUIAConsole), ("legacy", SimulatedLegacyConsole)]:
+        # Buffer spans several chunks, and the last chunk is not full.
+        rows = makeSession(100, 11) + [PROMPT.rstrip(), "", ""]
+        stats, lines = measure(lambda: exportScrollback(consoleClass(rows)), 10)
+        checkEqual(lines, rows[:-2], f"Exported lines of {name} console")
+        results[f"exportScrollbackAsync {name}"] = stats
+    return results
+
+benchmarks = [
+    benchmarkExportScrollback,
+]
@@ -0,0 +1,62 @@
+"""
+Benchmark of the time consoleToolkit adds to NVDA startup.
+Every import is done in a fresh Python process with NVDA modules stubbed out, so that nothing is cached between runs.
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+
+from .harness import check, REPOSITORY_DIRECTORY
+
+# Modules that are only needed by some commands, so they must only be imported once these commands are used.
+DEFERRED_MODULES = ["wave", "subprocess", "tempfile", "json"]
+IMPORT_REPEATS = 5
+
+# Stubs might import some of deferred modules themselves, so they are unloaded before consoleToolkit is imported.
+IMPORT_SCRIPT = """
+import sys
+import time
+from benchmarks import nvdaStubs
+sys.path.insert(0, "addon/globalPlugins")
+deferredModules = sys.argv[1:]
+for name in deferredModules:
+    sys.modules.pop(name, None)
+start = time.perf_counter()
+import consoleToolkit
+elapsed = time.perf_counter() - start
+result = {
+    "seconds": elapsed,
+    "importedModules": [name for name in deferredModules if name in sys.modules],
+    "playerCreated": consoleToolkit.captureBeeper._player is not None,
+}
+import json
+print(json.dumps(result))
+"""
+
+def importConsoleToolkit():
+    output = subprocess.check_output(
+        [sys.executable, "-c", IMPORT_SCRIPT] + DEFERRED_MODULES,
+        cwd=REPOSITORY_DIRECTORY,
+        text=True,
+    )
+    return json.loads(output.splitlines()[-1])
+
+def benchmarkImport():
+    timings = []
+    for dummy in range(IMPORT_REPEATS):
+        result = importConsoleToolkit()
+        check(len(result["importedModules"]) == 0, f"Modules imported at startup: {result['importedModules']}")
+        check(not result["playerCreated"], "Audio player must only be created when the first beep is played")
+        timings.append(result["seconds"])
+    return {"import consoleToolkit": {
+        "iterations": 1,
+        "repeats": IMPORT_REPEATS,
+        "minUs": round(min(timings) * 1000000, 3),
+        "medianUs": round(statistics.median(timings) * 1000000, 3),
+    }}
+
+benchmarks = [
+    benchmarkImport,
+]
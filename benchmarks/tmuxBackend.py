@@ -0,0 +1,43 @@
+"""
+Checks of tmux capture backend against a private tmux server, that is started just for them.
+They are skipped when tmux is not installed.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from .harness import check, checkEqual, consoleToolkit as ct, measure
+
+def benchmarkTmuxCapture():
+    if shutil.which("tmux") is None:
+        print("    tmux is not installed, skipping")
+        return {}
+    socketDirectory = tempfile.mkdtemp(prefix="consoleToolkitTmux")
+    tmuxArgs = ["tmux", "-S", os.path.join(socketDirectory, "socket")]
+    def tmux(*args):
+        return subprocess.check_output(tmuxArgs + list(args), text=True).strip()
+    tmux("-f", os.devnull, "new-session", "-d", "-s", "user")
+    try:
+        historyLimit = tmux("show-options", "-gv", "history-limit")
+        backend = ct.TmuxCaptureBackend(" ".join(tmuxArgs))
+        # Output is longer than default history limit.
+        stats, lines = measure(lambda: backend.capture("seq 1 5000", 30), 1, repeats=3)
+        checkEqual(lines, [str(i) for i in range(1, 5001)], "Captured lines")
+        checkEqual(tmux("show-options", "-gv", "history-limit"), historyLimit, "Global history limit")
+        checkEqual(tmux("list-sessions", "-F", "#{session_name}"), "user", "Sessions left after capture")
+        try:
+            backend.capture("sleep 60", 1)
+            check(False, "Capture of a command that doesn't finish in time must fail")
+        except subprocess.TimeoutExpired:
+            pass
+        checkEqual(tmux("list-sessions", "-F", "#{session_name}"), "user", "Sessions left after capture has timed out")
+    finally:
+        tmux("kill-server")
+        shutil.rmtree(socketDirectory, ignore_errors=True)
+    return {"TmuxCaptureBackend.capture": stats}
+
+benchmarks = [
+    benchmarkTmuxCapture,
+]